@@ -1,20 +1,153 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g, url_for, send_from_directory
+import csv
+import hashlib
+import json
+import logging
+import math
+import mimetypes
 import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import StringIO
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import safe_join
+from catalogo import CatalogoRecargable
+from compresion import CompresionRespuestas
+from construir_estaticos import DESTINO as DESTINO_ESTATICOS, MANIFIESTO as MANIFIESTO_ARCHIVO, cargar_manifiesto
+from construir_imagenes import cargar_manifiesto as cargar_manifiesto_imagenes, originales as originales_imagenes
+from intenciones import ConjuntoPalabras, MensajeUsuario
+from limites import LimitadorConcurrencia, LimitadorPeticiones
+from eventos import CanalEventos
+from estadisticas import ContadoresCitas
+from metricas import MetricasPeticiones
+from conversaciones import AlmacenConversaciones, cambios_datos
+from registro import configurar_registro, obtener_registro
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Registro estructurado con escritura en segundo plano; DEBUG solo en desarrollo
+configurar_registro()
+registro = obtener_registro('app')
+# Fracción de las respuestas del chat que se registran (eventos de mucho volumen)
+LOG_MUESTREO_CHAT = float(os.getenv('LOG_MUESTREO_CHAT', '0.01'))
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'tu-clave-secreta-aqui')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///citas.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///citas.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Ajustes de la base de datos (por worker). El pool tiene por defecto una
+# conexión por hilo de gunicorn para que ningún hilo espere a otro
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', '20000'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '8'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(GUNICORN_THREADS)))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '2'))
+
+def opciones_motor(url):
+    """Opciones del motor de SQLAlchemy según el tipo de base de datos"""
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+            return {}
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'connect_args': {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'check_same_thread': False
+            }
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_motor(app.config['SQLALCHEMY_DATABASE_URI'])
+
+@event.listens_for(Engine, 'connect')
+def configurar_sqlite(dbapi_connection, connection_record):
+    """Ajusta cada conexión SQLite para varios procesos e hilos.
+    
+    WAL permite leer mientras otro proceso escribe, busy_timeout hace que los
+    escritores esperen el bloqueo en lugar de fallar con "database is locked"
+    y synchronous=NORMAL es seguro con WAL y evita un fsync por transacción.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
 # Inicializar SQLAlchemy
 db = SQLAlchemy(app)
 
+# Canal de eventos en tiempo real para el panel y la administración
+CANAL_EVENTOS = CanalEventos(capacidad=int(os.getenv('EVENTOS_CAPACIDAD', '500')))
+# Cada flujo de eventos ocupa un hilo del worker mientras está abierto: por
+# defecto como mucho la mitad de los hilos, el resto queda libre para /chat.
+# Las páginas que no consiguen flujo consultan los cambios cada 30 segundos
+EVENTOS_MAX_SUSCRIPTORES = int(os.getenv('EVENTOS_MAX_SUSCRIPTORES', str(max(1, GUNICORN_THREADS // 2))))
+EVENTOS_LATIDO = int(os.getenv('EVENTOS_LATIDO', '15'))
+EVENTOS_DURACION_MAXIMA = int(os.getenv('EVENTOS_DURACION_MAXIMA', '300'))
+
+# Proxies por delante de la aplicación (el balanceador de Render es uno): la IP
+# del cliente se toma de X-Forwarded-For, que solo es fiable si lo pone un proxy.
+# Detrás de un proxy es obligatorio: sin él todos los clientes tienen la IP del
+# proxy y comparten un mismo límite de peticiones
+PROXIES_CONFIABLES = int(os.getenv('PROXIES_CONFIABLES', '0'))
+if PROXIES_CONFIABLES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIABLES, x_proto=PROXIES_CONFIABLES)
+
+# Compresión gzip/brotli de las respuestas de texto, JSON y CSV según Accept-Encoding
+if os.getenv('COMPRESION', '1') == '1':
+    app.wsgi_app = CompresionRespuestas(app.wsgi_app, minimo=int(os.getenv('COMPRESION_MINIMO', '1024')))
+
+# Métricas por endpoint (latencia, tamaño de respuesta y consultas SQL) para /metrics
+METRICAS = MetricasPeticiones()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def iniciar_consulta_sql(conn, cursor, statement, parameters, context, executemany):
+    METRICAS.iniciar_consulta()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def terminar_consulta_sql(conn, cursor, statement, parameters, context, executemany):
+    METRICAS.terminar_consulta()
+
+@app.before_request
+def iniciar_metricas():
+    g.inicio_peticion = time.perf_counter()
+    METRICAS.iniciar_peticion()
+
+@app.after_request
+def registrar_metricas(response):
+    # Con las respuestas por partes (CSV, eventos) se mide el tiempo hasta empezar a enviarlas
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+    tamano = None if response.is_streamed else response.calculate_content_length()
+    METRICAS.terminar_peticion(endpoint, request.method, response.status_code,
+                               time.perf_counter() - g.inicio_peticion, tamano)
+    return response
+
+# Siguiente número de cambio de las citas (ver Cita.num_cambio)
+SIGUIENTE_CAMBIO = text('(SELECT COALESCE(MAX(num_cambio), 0) + 1 FROM cita)')
+
 # Modelo de la base de datos
 class Cita(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,186 +159,41 @@ class Cita(db.Model):
     hora = db.Column(db.String(10), nullable=False)
     estado = db.Column(db.String(20), default='pendiente')  # 'pendiente', 'confirmada', 'cancelada'
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    # Última modificación (alta o cambio de estado)
+    fecha_modificacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Número del último cambio; base de la sincronización incremental. Lo asigna la
+    # base de datos en la misma sentencia que escribe la cita, con el bloqueo de
+    # escritura ya tomado: los números crecen en el orden en que se confirman los
+    # cambios aunque escriban varios procesos, cosa que no garantiza la hora
+    num_cambio = db.Column(db.Integer, default=SIGUIENTE_CAMBIO, onupdate=SIGUIENTE_CAMBIO, index=True)
+    # Número de cambio del alta: mientras coincide con num_cambio la cita no se ha modificado
+    num_cambio_alta = db.Column(db.Integer, default=SIGUIENTE_CAMBIO)
+    
+    __table_args__ = (
+        # Búsqueda de franjas ocupadas por fecha y hora
+        db.Index('ix_cita_fecha_hora_estado', 'fecha', 'hora', 'estado'),
+        # Una sola cita pendiente por franja: evita las dobles reservas aunque
+        # haya varios procesos guardando a la vez
+        db.Index(
+            'uq_cita_franja_pendiente', 'fecha', 'hora', unique=True,
+            sqlite_where=db.text("estado = 'pendiente'"),
+            postgresql_where=db.text("estado = 'pendiente'")
+        ),
+    )
 
-# Sistema de respuestas predefinidas
-RESPUESTAS_PREDEFINIDAS = {
-    # Saludos y bienvenida
-    'hola': '¡Hola! Bienvenido a Clínica Dental "De Ejemplo", ¿en qué puedo ayudarte?',
-    'buenos días': '¡Buenos días! Bienvenido a Clínica Dental "De Ejemplo", ¿en qué puedo ayudarte?',
-    'buenas tardes': '¡Buenas tardes! Bienvenido a Clínica Dental "De Ejemplo", ¿en qué puedo ayudarte?',
-    'buenas noches': '¡Buenas noches! Bienvenido a Clínica Dental "De Ejemplo", ¿en qué puedo ayudarte?',
-    
-    # Información sobre tratamientos
-    'información sobre tratamientos': '¿Sobre qué tratamiento específico te gustaría saber más?',
-    'tratamientos': '¿Sobre qué tratamiento específico te gustaría saber más?',
-    
-    # Tratamientos específicos
-    'limpieza dental': {
-        'texto': 'La limpieza dental profesional es fundamental para mantener la salud bucal. Este tratamiento elimina la placa bacteriana y el sarro que se acumula en los dientes y encías. La placa bacteriana se forma constantemente por bacterias que se adhieren a los dientes, y si no se elimina regularmente, puede causar caries y enfermedades de las encías. El proceso incluye la eliminación de sarro, pulido dental y aplicación de flúor. Es recomendable realizarla cada 6 meses para mantener una boca saludable.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=1', 'alt': 'Antes de limpieza dental'},
-            {'url': 'https://picsum.photos/400/300?random=2', 'alt': 'Después de limpieza dental'}
-        ]
-    },
-    
-    'empastes': {
-        'texto': 'Los empastes restauran dientes que han sido afectados por caries. La caries se desarrolla cuando las bacterias de la placa producen ácidos que desmineralizan el esmalte dental, creando cavidades. El proceso incluye la eliminación del tejido cariado y la restauración con materiales como composite o amalgama. Es importante tratar las caries temprano para evitar que lleguen al nervio del diente.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=3', 'alt': 'Antes de empaste'},
-            {'url': 'https://picsum.photos/400/300?random=4', 'alt': 'Después de empaste'}
-        ]
-    },
-    
-    'ortodoncia': {
-        'texto': 'La ortodoncia corrige la posición de los dientes y la mordida. Los problemas de alineación pueden ser causados por factores genéticos, hábitos infantiles como chuparse el dedo o la pérdida prematura de dientes. El tratamiento aplica fuerzas controladas que mueven gradualmente los dientes a su posición correcta. Esto mejora tanto la estética como la función masticatoria.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=5', 'alt': 'Antes de ortodoncia'},
-            {'url': 'https://picsum.photos/400/300?random=6', 'alt': 'Después de ortodoncia'}
-        ]
-    },
-    
-    'cirugía oral': {
-        'texto': 'La cirugía oral trata problemas que no pueden resolverse con tratamientos convencionales. Incluye extracciones complejas, extracción de muelas del juicio impactadas, y cirugías para tratar infecciones o lesiones. Los problemas pueden surgir por dientes impactados, infecciones avanzadas o traumatismos. El proceso incluye anestesia local y técnicas quirúrgicas especializadas.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=7', 'alt': 'Antes de cirugía oral'},
-            {'url': 'https://picsum.photos/400/300?random=8', 'alt': 'Después de cirugía oral'}
-        ]
-    },
-    
-    'blanqueamiento': {
-        'texto': 'El blanqueamiento dental aclara el color de los dientes eliminando manchas superficiales y profundas. Las manchas pueden ser causadas por alimentos, bebidas, tabaco o el envejecimiento natural. El proceso utiliza agentes blanqueadores que penetran el esmalte y descomponen las moléculas que causan las manchas. Es un tratamiento estético que mejora la apariencia de la sonrisa.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=9', 'alt': 'Antes de blanqueamiento'},
-            {'url': 'https://picsum.photos/400/300?random=10', 'alt': 'Después de blanqueamiento'}
-        ]
-    },
-    
-    'endodoncia': {
-        'texto': 'La endodoncia trata dientes con infección en el nervio o pulpa dental. Esto ocurre cuando las caries avanzan hasta el nervio, causando dolor e infección. El proceso incluye la eliminación del tejido infectado, limpieza de los conductos radiculares y sellado para prevenir nuevas infecciones. Salva dientes que de otra manera tendrían que extraerse.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=11', 'alt': 'Antes de endodoncia'},
-            {'url': 'https://picsum.photos/400/300?random=12', 'alt': 'Después de endodoncia'}
-        ]
-    },
-    
-    'periodoncia': {
-        'texto': 'La periodoncia trata las enfermedades de las encías y el hueso que sostiene los dientes. La gingivitis y la periodontitis son causadas por la acumulación de placa bacteriana que inflama las encías y puede destruir el hueso. El tratamiento incluye limpieza profunda de las raíces dentales y control de la infección bacteriana.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=13', 'alt': 'Antes de periodoncia'},
-            {'url': 'https://picsum.photos/400/300?random=14', 'alt': 'Después de periodoncia'}
-        ]
-    },
-    
-    'implantes dentales': {
-        'texto': 'Los implantes dentales reemplazan dientes perdidos con raíces artificiales de titanio. La pérdida de dientes puede ser causada por caries avanzadas, enfermedad periodontal o traumatismos. El proceso incluye la colocación quirúrgica del implante en el hueso, que se integra con el tiempo, y luego la colocación de la corona dental. Restauran tanto la función como la estética.\n\nEs importante que sepas que cada caso es único y requiere una evaluación personalizada por parte de un profesional. Para determinar si este tratamiento es el más adecuado para tu situación específica, es fundamental que te evalúe un dentista profesional.',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=15', 'alt': 'Antes de implantes'},
-            {'url': 'https://picsum.photos/400/300?random=16', 'alt': 'Después de implantes'}
-        ]
-    },
-    
-    # Solicitud de citas
-    'solicitar una cita': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-    'quiero una cita': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-    'necesito una cita': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-    'agendar cita': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-    'sí, quiero agendar una cita': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-    
-    # Respuestas sobre tratamiento abierto
-    'sí, ya tengo tratamiento': 'Perfecto, para gestionar tu cita existente o alguna consulta acerca de tu tratamiento, por favor contacta directamente con nosotros al teléfono +34 900 123 456. Nuestro equipo te ayudará a programar tu próxima cita.',
-    'no, es mi primera vez': 'Entendido, te ayudo a solicitar una nueva cita. ¿Tu cita es para una revisión general periódica o tienes algún padecimiento específico que te gustaría consultar?',
-    
-    # Tipo de cita
-    'revisión general periódica': 'Perfecto, una revisión general es fundamental para mantener tu salud dental. Te ayudo a programar tu cita paso a paso. Primero vamos a seleccionar la fecha y hora que te venga mejor.',
-    'tengo algún padecimiento': 'Entiendo tu situación. Es importante que un profesional evalúe tu caso personalmente para determinar el tratamiento más adecuado. Te ayudo a programar tu cita paso a paso. Primero vamos a seleccionar la fecha y hora que te venga mejor.',
-    
-    # Ubicaciones
-    'ubicaciones': 'Tenemos clínicas en varias ciudades. Puedes ver las ubicaciones exactas haciendo clic en el botón "Ver ubicaciones" que aparece en la parte superior del chat.',
-    'dónde están': 'Tenemos clínicas en varias ciudades. Puedes ver las ubicaciones exactas haciendo clic en el botón "Ver ubicaciones" que aparece en la parte superior del chat.',
-    'dirección': 'Tenemos clínicas en varias ciudades. Puedes ver las ubicaciones exactas haciendo clic en el botón "Ver ubicaciones" que aparece en la parte superior del chat.',
-    
-    # Horarios
-    'horarios': 'Nuestros horarios son: Lunes a Viernes de 9:00 a 18:00, Sábados de 9:00 a 14:00.',
-    'cuándo abren': 'Nuestros horarios son: Lunes a Viernes de 9:00 a 18:00, Sábados de 9:00 a 14:00.',
-    
-    # Teléfono
-    'teléfono': 'Nuestro teléfono de contacto es +34 900 123 456.',
-    'contacto': 'Nuestro teléfono de contacto es +34 900 123 456.',
-    
-    # Financiación
-    'información sobre financiación': {
-        'texto': '💰 **OPCIONES DE FINANCIACIÓN DISPONIBLES**\n\nEn nuestra clínica dental ofrecemos varias opciones de financiación para que puedas acceder a los tratamientos que necesitas:\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n💳 **FINANCIACIÓN SIN INTERESES**\n• Hasta 12 meses sin intereses\n• Para tratamientos superiores a 500€\n• Sin comisiones ocultas\n\n🏦 **FINANCIACIÓN BANCARIA**\n• Colaboración con entidades bancarias\n• Préstamos personales con condiciones especiales\n• Términos flexibles según tu perfil\n\n📋 **PAGO A PLAZOS**\n• Cuotas mensuales personalizadas\n• Sin intereses adicionales\n• Según el tipo de tratamiento\n\n💎 **DESCUENTOS POR PAGO AL CONTADO**\n• 5% de descuento inmediato\n• Al pagar el tratamiento completo\n• Ahorro garantizado\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📞 **¿Necesitas más información?**\nContacta con nosotros al +34 900 123 456\n\n📍 **Consulta en cualquiera de nuestras clínicas**\nNuestro personal te asesorará personalmente',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=17', 'alt': 'Opciones de financiación'},
-            {'url': 'https://picsum.photos/400/300?random=18', 'alt': 'Beneficios de financiación'}
-        ]
-    },
-    'financiación': '💰 **¿Te gustaría conocer nuestras opciones de financiación?**\n\nTenemos varias alternativas flexibles para que puedas acceder a los tratamientos que necesitas sin preocupaciones económicas.',
-    'pago': '💳 **OPCIONES DE PAGO DISPONIBLES**\n\n• Financiación sin intereses (hasta 12 meses)\n• Pago a plazos personalizado\n• Descuentos por pago al contado (5%)\n• Colaboración con entidades bancarias',
-    'precio': '💰 **INFORMACIÓN SOBRE PRECIOS**\n\nLos precios varían según el tratamiento específico.\n\n📋 **Te recomendamos:**\n• Agendar una consulta personalizada\n• Evaluar tu caso individualmente\n• Recibir un presupuesto detallado\n\n📞 Contacta con nosotros para más información',
-    'coste': '💵 **SOBRE LOS COSTES DE TRATAMIENTOS**\n\nLos costes dependen del tratamiento específico que necesites.\n\n✅ **Ofrecemos financiación flexible** para que puedas acceder a los tratamientos que requieres sin problemas económicos.',
-    
-    # Preguntas frecuentes
-    'preguntas frecuentes': {
-        'texto': '❓ **PREGUNTAS FRECUENTES**\n\nAquí tienes las preguntas más frecuentes que recibimos de nuestros pacientes. Haz clic en la pregunta que te interese para ver la respuesta detallada:\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=19', 'alt': 'Preguntas frecuentes'},
-            {'url': 'https://picsum.photos/400/300?random=20', 'alt': 'Información útil'}
-        ],
-        'mostrar_botones_faq': True
-    },
-    'faq': '❓ **PREGUNTAS FRECUENTES**\n\nAquí tienes las preguntas más frecuentes que recibimos de nuestros pacientes.\n\n💬 **¿Hay alguna en particular que te interese?**',
-    'pregunta': '❓ **¿Qué pregunta específica tienes?**\n\nEstoy aquí para ayudarte con cualquier duda sobre tratamientos, procedimientos o servicios.',
-    'duración': '⏱️ **DURACIÓN DE TRATAMIENTOS**\n\nLa duración varía según el caso específico.\n\n📋 **¿Sobre qué tratamiento quieres saber?**\n• Limpieza dental: 30-45 minutos\n• Ortodoncia: 18-24 meses\n• Blanqueamiento: 1-2 sesiones\n• Empastes: 30-60 minutos',
-    'dolor': '🦷 **SOBRE EL DOLOR EN TRATAMIENTOS**\n\n✅ **La mayoría de tratamientos son mínimamente invasivos**\n• No causan dolor significativo\n• Usamos técnicas modernas y suaves\n• Anestesia local cuando es necesario\n• Tu comodidad es nuestra prioridad',
-    'emergencia': '🚨 **EMERGENCIAS DENTALES**\n\n📞 **Para emergencias fuera de horario:**\n• Teléfono: +34 900 123 456\n• Atención 24/7 para urgencias\n• Te atenderemos de inmediato\n\n⚠️ **¿Tienes una emergencia ahora?**',
-    
-    # Respuestas individuales de preguntas frecuentes
-    'limpieza dental duración': {
-        'texto': '⏱️ **DURACIÓN DE LIMPIEZA DENTAL**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📋 **Información detallada:**\n\n• **Duración total:** 30-45 minutos\n• **Incluye:** Eliminación de sarro y pulido\n• **Frecuencia recomendada:** Cada 6 meses\n• **Proceso:** Completamente indoloro\n\n💡 **¿Por qué es importante?**\nLa limpieza dental profesional elimina la placa bacteriana y el sarro que no se puede quitar con el cepillado normal, previniendo caries y enfermedades de las encías.\n\n📞 **¿Quieres agendar tu limpieza?**\nContacta con nosotros al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=21', 'alt': 'Limpieza dental profesional'}
-        ]
-    },
-    
-    'blanqueamiento dolor': {
-        'texto': '🦷 **BLANQUEAMIENTO DENTAL - SIN DOLOR**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n✅ **Información importante:**\n\n• **¿Es doloroso?** No, no es doloroso\n• **Sensibilidad:** Puede causar sensibilidad temporal\n• **Técnicas:** Usamos técnicas suaves y modernas\n• **Duración:** 1-2 sesiones de 45-60 minutos\n\n💡 **¿Qué esperar?**\nEl blanqueamiento utiliza agentes blanqueadores que pueden causar sensibilidad temporal, pero no dolor. Nuestros especialistas usan técnicas avanzadas para minimizar cualquier molestia.\n\n📞 **¿Quieres consultar sobre blanqueamiento?**\nContacta con nosotros al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=22', 'alt': 'Blanqueamiento dental'}
-        ]
-    },
-    
-    'ortodoncia duración': {
-        'texto': '⏰ **DURACIÓN DE TRATAMIENTO DE ORTODONCIA**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📋 **Información detallada:**\n\n• **Duración promedio:** 18-24 meses\n• **Varía según:** Complejidad del caso\n• **Revisiones:** Mensuales incluidas\n• **Tipos:** Brackets metálicos, cerámicos, invisibles\n\n💡 **Factores que influyen:**\n- Gravedad del problema de alineación\n- Edad del paciente\n- Tipo de ortodoncia elegida\n- Cooperación del paciente\n\n📞 **¿Quieres una consulta de ortodoncia?**\nContacta con nosotros al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=23', 'alt': 'Tratamiento de ortodoncia'}
-        ]
-    },
-    
-    'empaste anestesia': {
-        'texto': '💉 **ANESTESIA EN EMPASTES**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📋 **Información detallada:**\n\n• **¿Siempre necesito anestesia?** No\n• **Cuándo se usa:** Solo si la caries es profunda\n• **La mayoría:** Se realizan sin anestesia\n• **Proceso:** Rápido y cómodo\n\n💡 **¿Por qué no siempre es necesaria?**\nLos empastes modernos se realizan con técnicas mínimamente invasivas. Solo se aplica anestesia cuando la caries está cerca del nervio dental.\n\n📞 **¿Tienes dolor de muela?**\nContacta con nosotros al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=24', 'alt': 'Empaste dental'}
-        ]
-    },
-    
-    'frecuencia visitas': {
-        'texto': '📅 **FRECUENCIA DE VISITAS AL DENTISTA**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📋 **Recomendaciones:**\n\n• **Revisiones generales:** Cada 6 meses\n• **Limpieza dental:** Cada 6 meses\n• **Pacientes con problemas:** Cada 3-4 meses\n• **Ortodoncia:** Mensual\n\n💡 **¿Por qué es importante?**\nLas revisiones regulares permiten detectar problemas temprano, cuando son más fáciles de tratar. La prevención es siempre mejor que el tratamiento.\n\n📞 **¿Quieres agendar tu revisión?**\nContacta con nosotros al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=25', 'alt': 'Revisión dental'}
-        ]
-    },
-    
-    'emergencia dolor': {
-        'texto': '🚨 **EMERGENCIAS DENTALES - DOLOR FUERA DE HORARIO**\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n📞 **Información de contacto:**\n\n• **Teléfono de emergencias:** +34 900 123 456\n• **Atención:** 24/7 para urgencias\n• **Respuesta:** Inmediata\n• **Servicio:** Gratuito para emergencias\n\n💡 **¿Qué se considera una emergencia?**\n- Dolor dental intenso\n- Traumatismos dentales\n- Infecciones con hinchazón\n- Fracturas dentales\n\n⚠️ **¿Tienes una emergencia ahora?**\nLlama inmediatamente al +34 900 123 456',
-        'imagenes': [
-            {'url': 'https://picsum.photos/400/300?random=26', 'alt': 'Emergencia dental'}
-        ]
-    },
-    
-    # Respuesta por defecto
-    'default': 'Gracias por tu mensaje. Si necesitas información sobre tratamientos, puedes hacer clic en "Información sobre tratamientos". Si quieres agendar una cita, puedes hacer clic en "Solicitar una cita". Si quieres conocer nuestras opciones de financiación, puedes hacer clic en "Información sobre financiación". Si tienes preguntas generales, puedes hacer clic en "Preguntas frecuentes". Y si quieres ver nuestras ubicaciones, puedes hacer clic en "Ver ubicaciones".'
-}
+def conteos_por_estado_y_tipo():
+    """Número de citas por estado y tipo de cita en una única consulta agregada"""
+    return db.session.query(
+        Cita.estado, Cita.tipo_cita, db.func.count(Cita.id)
+    ).group_by(Cita.estado, Cita.tipo_cita).all()
+
+# Contadores en memoria para /api/database-stats, reconciliados periódicamente con la tabla
+CONTADORES_CITAS = ContadoresCitas(
+    conteos_por_estado_y_tipo,
+    intervalo_reconciliacion=float(os.getenv('ESTADISTICAS_RECONCILIACION', '300')),
+    # Las citas guardadas por otros workers se detectan por el número de cambio
+    version=lambda: version_citas()
+)
 
 # Sistema de estado de conversación
 ESTADOS_CONVERSACION = {
@@ -222,290 +210,234 @@ ESTADOS_CONVERSACION = {
     'confirmando_cita': 'confirmando_cita'
 }
 
-def obtener_respuesta(mensaje, estado_actual='inicial', datos_cita=None):
-    """Función para obtener la respuesta predefinida basada en el mensaje del usuario y el estado actual"""
-    mensaje_lower = mensaje.lower().strip()
-    
-    # Manejar el flujo de citas basado en el estado
-    if estado_actual == ESTADOS_CONVERSACION['preguntando_tratamiento_abierto']:
-        if 'sí' in mensaje_lower or 'si' in mensaje_lower or 'ya tengo' in mensaje_lower:
-            return {
-                'respuesta': 'Perfecto, para gestionar tu cita existente o alguna consulta acerca de tu tratamiento, por favor contacta directamente con nosotros al teléfono +34 900 123 456. Nuestro equipo te ayudará a programar tu próxima cita.',
-                'estado': ESTADOS_CONVERSACION['inicial'],
-                'datos_cita': datos_cita
-            }
-        elif 'no' in mensaje_lower or 'primera vez' in mensaje_lower:
-            return {
-                'respuesta': 'Entendido, te ayudo a solicitar una nueva cita. ¿Tu cita es para una revisión general periódica o tienes algún padecimiento específico que te gustaría consultar?',
-                'estado': ESTADOS_CONVERSACION['preguntando_tipo_cita'],
-                'datos_cita': datos_cita
-            }
-    
-    elif estado_actual == ESTADOS_CONVERSACION['preguntando_tipo_cita']:
-        if 'revisión' in mensaje_lower or 'general' in mensaje_lower:
-            if datos_cita is None:
-                datos_cita = {}
-            datos_cita['tipo_cita'] = 'revision'
-            return {
-                'respuesta': 'Perfecto, una revisión general es fundamental para mantener tu salud dental. Ahora vamos a seleccionar la fecha de tu cita. ¿Qué día te viene mejor?',
-                'estado': ESTADOS_CONVERSACION['solicitando_fecha'],
-                'datos_cita': datos_cita,
-                'mostrar_calendario': True
-            }
-        elif 'padecimiento' in mensaje_lower or 'dolor' in mensaje_lower or 'problema' in mensaje_lower:
-            if datos_cita is None:
-                datos_cita = {}
-            datos_cita['tipo_cita'] = 'padecimiento'
-            return {
-                'respuesta': 'Por favor, describe brevemente tu padecimiento o motivo de consulta:',
-                'estado': ESTADOS_CONVERSACION['solicitando_detalle_padecimiento'],
-                'datos_cita': datos_cita,
-                'mostrar_input_padecimiento': True
-            }
+# Palabras y frases que se reconocen como respuesta en cada estado. Se comparan
+# palabras completas sin tildes: 'si' no coincide dentro de 'visita'
+RESPUESTA_TRATAMIENTO_ABIERTO = ConjuntoPalabras(['sí', 'ya tengo'])
+RESPUESTA_PRIMERA_VEZ = ConjuntoPalabras(['no', 'primera vez'])
+RESPUESTA_REVISION = ConjuntoPalabras(['revisión', 'revisiones', 'general'])
+RESPUESTA_PADECIMIENTO = ConjuntoPalabras(['padecimiento', 'padecimientos', 'dolor', 'dolores', 'problema', 'problemas'])
+RESPUESTA_CONFIRMAR = ConjuntoPalabras(['sí', 'confirmo'])
 
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_detalle_padecimiento']:
-        if datos_cita is None:
-            datos_cita = {}
-        datos_cita['detalle_padecimiento'] = mensaje
-        return {
-            'respuesta': 'Gracias por la información. Ahora vamos a seleccionar la fecha de tu cita. ¿Qué día te viene mejor?',
-            'estado': ESTADOS_CONVERSACION['solicitando_fecha'],
-            'datos_cita': datos_cita,
-            'mostrar_calendario': True
-        }
-    
-    # Manejar estados específicos del flujo de citas
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_fecha']:
-        # Aquí el usuario debería seleccionar una fecha del calendario
-        # Por ahora, asumimos que el calendario se maneja en el frontend
-        return {
-            'respuesta': 'Por favor selecciona una fecha del calendario que aparece arriba.',
-            'estado': ESTADOS_CONVERSACION['solicitando_fecha'],
-            'datos_cita': datos_cita,
-            'mostrar_calendario': True
-        }
-    
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_hora']:
-        # El usuario seleccionó una fecha, ahora pedir hora
-        if datos_cita and datos_cita.get('fecha'):
-            return {
-                'respuesta': f'Perfecto, has seleccionado el {datos_cita["fecha"]}. Ahora selecciona la hora que te viene mejor:',
-                'estado': ESTADOS_CONVERSACION['solicitando_hora'],
-                'datos_cita': datos_cita,
-                'mostrar_horas': True
-            }
-    
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_nombre']:
-        # El usuario seleccionó fecha y hora, ahora pedir nombre
-        datos_cita['nombre'] = mensaje
-        return {
-            'respuesta': f'Gracias {mensaje}. Ahora necesito tu número de teléfono de contacto.',
-            'estado': ESTADOS_CONVERSACION['solicitando_telefono'],
-            'datos_cita': datos_cita
-        }
-    
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_telefono']:
-        # El usuario proporcionó teléfono, ahora pedir email
-        datos_cita['telefono'] = mensaje
-        return {
-            'respuesta': 'Perfecto. Ahora necesito tu dirección de email para enviarte la confirmación de la cita.',
-            'estado': ESTADOS_CONVERSACION['solicitando_email'],
-            'datos_cita': datos_cita
-        }
-    
-    elif estado_actual == ESTADOS_CONVERSACION['solicitando_email']:
-        # El usuario proporcionó email, mostrar confirmación
-        datos_cita['email'] = mensaje
-        return {
-            'respuesta': f'¡Excelente! Aquí tienes el resumen de tu cita:\n\n📅 Fecha: {datos_cita["fecha"]}\n🕐 Hora: {datos_cita["hora"]}\n👤 Nombre: {datos_cita["nombre"]}\n📞 Teléfono: {datos_cita["telefono"]}\n📧 Email: {datos_cita["email"]}\n🏥 Tipo: {"Revisión general" if datos_cita["tipo_cita"] == "revision" else "Padecimiento específico"}\n\n¿Confirmas que quieres agendar esta cita?',
-            'estado': ESTADOS_CONVERSACION['confirmando_cita'],
-            'datos_cita': datos_cita,
-            'mostrar_confirmacion': True
-        }
+def respuesta_estado(texto, estado, datos_cita, **opciones):
+    """Resultado del chatbot con el texto, el siguiente estado, los datos de la cita y las opciones de la interfaz"""
+    resultado = {
+        'respuesta': texto,
+        'estado': ESTADOS_CONVERSACION[estado],
+        'datos_cita': datos_cita
+    }
+    resultado.update(opciones)
+    return resultado
+
+def con_dato(datos_cita, campo, valor):
+    """Añade un campo a los datos de la cita, creándolos si aún no existen"""
+    if datos_cita is None:
+        datos_cita = {}
+    datos_cita[campo] = valor
+    return datos_cita
+
+def respuesta_catalogo(clave, estado, datos_cita, catalogo):
+    """Resultado con la respuesta del catálogo para una clave (texto o texto con imágenes)"""
+    respuesta = catalogo.respuestas[clave]
+    if isinstance(respuesta, dict):
+        return respuesta_estado(respuesta['texto'], estado, datos_cita,
+                                imagenes=resolver_imagenes(respuesta.get('imagenes', [])), intencion=clave)
+    return respuesta_estado(respuesta, estado, datos_cita, intencion=clave)
+
+def tratamiento_ya_abierto(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Perfecto, para gestionar tu cita existente o alguna consulta acerca de tu tratamiento, por favor contacta directamente con nosotros al teléfono +34 900 123 456. Nuestro equipo te ayudará a programar tu próxima cita.',
+        'inicial', datos_cita
+    )
+
+def primera_cita(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Entendido, te ayudo a solicitar una nueva cita. ¿Tu cita es para una revisión general periódica o tienes algún padecimiento específico que te gustaría consultar?',
+        'preguntando_tipo_cita', datos_cita
+    )
+
+def elegir_revision(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Perfecto, una revisión general es fundamental para mantener tu salud dental. Ahora vamos a seleccionar la fecha de tu cita. ¿Qué día te viene mejor?',
+        'solicitando_fecha', con_dato(datos_cita, 'tipo_cita', 'revision'), mostrar_calendario=True
+    )
+
+def elegir_padecimiento(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Por favor, describe brevemente tu padecimiento o motivo de consulta:',
+        'solicitando_detalle_padecimiento', con_dato(datos_cita, 'tipo_cita', 'padecimiento'),
+        mostrar_input_padecimiento=True
+    )
+
+def guardar_padecimiento(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Gracias por la información. Ahora vamos a seleccionar la fecha de tu cita. ¿Qué día te viene mejor?',
+        'solicitando_fecha', con_dato(datos_cita, 'detalle_padecimiento', mensaje.original), mostrar_calendario=True
+    )
+
+def pedir_fecha(mensaje, datos_cita, catalogo):
+    # La fecha se elige en el calendario del frontend
+    return respuesta_estado(
+        'Por favor selecciona una fecha del calendario que aparece arriba.',
+        'solicitando_fecha', datos_cita, mostrar_calendario=True
+    )
+
+def pedir_hora(mensaje, datos_cita, catalogo):
+    # Sin fecha elegida se pasa a las respuestas del catálogo
+    if datos_cita and datos_cita.get('fecha'):
+        return respuesta_estado(
+            f'Perfecto, has seleccionado el {datos_cita["fecha"]}. Ahora selecciona la hora que te viene mejor:',
+            'solicitando_hora', datos_cita, mostrar_horas=True
+        )
+    return None
+
+def guardar_nombre(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        f'Gracias {mensaje.original}. Ahora necesito tu número de teléfono de contacto.',
+        'solicitando_telefono', con_dato(datos_cita, 'nombre', mensaje.original)
+    )
+
+def guardar_telefono(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Perfecto. Ahora necesito tu dirección de email para enviarte la confirmación de la cita.',
+        'solicitando_email', con_dato(datos_cita, 'telefono', mensaje.original)
+    )
+
+def guardar_email(mensaje, datos_cita, catalogo):
+    datos_cita = con_dato(datos_cita, 'email', mensaje.original)
+    return respuesta_estado(
+        f'¡Excelente! Aquí tienes el resumen de tu cita:\n\n📅 Fecha: {datos_cita["fecha"]}\n🕐 Hora: {datos_cita["hora"]}\n👤 Nombre: {datos_cita["nombre"]}\n📞 Teléfono: {datos_cita["telefono"]}\n📧 Email: {datos_cita["email"]}\n🏥 Tipo: {"Revisión general" if datos_cita["tipo_cita"] == "revision" else "Padecimiento específico"}\n\n¿Confirmas que quieres agendar esta cita?',
+        'confirmando_cita', datos_cita, mostrar_confirmacion=True
+    )
+
+def confirmar_cita(mensaje, datos_cita, catalogo):
+    # Guardar la cita en la base de datos
+    try:
+        nueva_cita = reservar_cita(
+            nombre=datos_cita['nombre'],
+            telefono=datos_cita['telefono'],
+            email=datos_cita['email'],
+            tipo_cita=datos_cita['tipo_cita'],
+            fecha=datetime.strptime(datos_cita['fecha'], '%Y-%m-%d').date(),
+            hora=datos_cita['hora']
+        )
+        
+        if nueva_cita is None:
+            # Otra persona ha reservado la franja mientras tanto: volver a elegir fecha
+            hora_ocupada = datos_cita.pop('hora', None)
+            return respuesta_estado(
+                f'Lo sentimos, la hora {hora_ocupada} del {datos_cita["fecha"]} ya no está disponible. Por favor selecciona otra fecha del calendario.',
+                'solicitando_fecha', datos_cita, mostrar_calendario=True
+            )
+        
+        return respuesta_estado(
+            f'¡Perfecto! Tu cita ha sido programada exitosamente para el {datos_cita["fecha"]} a las {datos_cita["hora"]}. Recibirás una confirmación por email. Tu número de cita es #{nueva_cita.id}. ¡Gracias por confiar en nosotros!',
+            'inicial', {}, cita_guardada=True
+        )
+    except BaseDatosOcupada:
+        # Mantener la confirmación pendiente para que el paciente pueda repetirla
+        return respuesta_estado(
+            'En este momento tenemos muchas solicitudes y no hemos podido guardar tu cita. Por favor, vuelve a confirmar en unos segundos.',
+            'confirmando_cita', datos_cita, mostrar_confirmacion=True
+        )
+    except Exception:
+        return respuesta_estado(
+            'Lo sentimos, hubo un error al guardar tu cita. Por favor, inténtalo de nuevo o contacta directamente con nosotros al +34 900 123 456.',
+            'inicial', {}
+        )
+
+def cancelar_confirmacion(mensaje, datos_cita, catalogo):
+    return respuesta_estado(
+        'Entendido, la cita no se ha confirmado. Si cambias de opinión, puedes volver a solicitar una cita en cualquier momento.',
+        'inicial', {}
+    )
+
+def menu_tratamientos(mensaje, datos_cita, catalogo):
+    # Si el usuario quiere agendar una cita desde el menú de tratamientos
+    if catalogo.buscador.agendar_en_menu.contiene(mensaje.minusculas):
+        return respuesta_estado(
+            '¿Ya tienes un tratamiento abierto con nuestra clínica?',
+            'preguntando_tratamiento_abierto', datos_cita, limpiar_pantalla=True, intencion='agendar_en_menu'
+        )
+    # Si el usuario pregunta sobre otro tratamiento
+    if catalogo.buscador.tratamientos_en_menu.contiene(mensaje.minusculas):
+        # Coincidencias flexibles: la clave completa o cualquiera de sus palabras
+        clave = catalogo.buscador.menu_tratamientos.buscar(mensaje.minusculas)
+        if registro.isEnabledFor(logging.DEBUG):
+            registro.debug('tratamiento_en_menu', extra={'datos': {'mensaje': mensaje.minusculas, 'clave': clave}})
+        if clave is not None:
+            return respuesta_catalogo(clave, 'en_menu_tratamientos', datos_cita, catalogo)
+    # Si no coincide con nada, mantener en el menú de tratamientos
+    return respuesta_estado(
+        '¿Sobre qué tratamiento específico te gustaría saber más? Tenemos: limpieza dental, empastes, ortodoncia, cirugía oral, blanqueamiento, endodoncia, periodoncia, implantes dentales y otros tratamientos especializados.',
+        'en_menu_tratamientos', datos_cita, intencion='menu_tratamientos'
+    )
+
+# Tabla de transiciones: para cada estado, las condiciones que se comprueban en
+# orden y la función que construye la respuesta. Una condición None se cumple
+# siempre; si la función devuelve None se sigue con la siguiente fila y, al
+# final, con las respuestas del catálogo
+TRANSICIONES = {
+    'preguntando_tratamiento_abierto': (
+        (RESPUESTA_TRATAMIENTO_ABIERTO, tratamiento_ya_abierto),
+        (RESPUESTA_PRIMERA_VEZ, primera_cita),
+    ),
+    'preguntando_tipo_cita': (
+        (RESPUESTA_REVISION, elegir_revision),
+        (RESPUESTA_PADECIMIENTO, elegir_padecimiento),
+    ),
+    'solicitando_detalle_padecimiento': ((None, guardar_padecimiento),),
+    'solicitando_fecha': ((None, pedir_fecha),),
+    'solicitando_hora': ((None, pedir_hora),),
+    'solicitando_nombre': ((None, guardar_nombre),),
+    'solicitando_telefono': ((None, guardar_telefono),),
+    'solicitando_email': ((None, guardar_email),),
+    'confirmando_cita': (
+        (RESPUESTA_CONFIRMAR, confirmar_cita),
+        (None, cancelar_confirmacion),
+    ),
+    'en_menu_tratamientos': ((None, menu_tratamientos),),
+}
+
+def responder_con_catalogo(mensaje, datos_cita, catalogo):
+    """Respuesta del catálogo para el estado inicial y para los mensajes que ningún estado reconoce.
     
-    elif estado_actual == ESTADOS_CONVERSACION['confirmando_cita']:
-        if 'sí' in mensaje_lower or 'si' in mensaje_lower or 'confirmo' in mensaje_lower:
-            # Guardar la cita en la base de datos
-            try:
-                nueva_cita = Cita(
-                    nombre=datos_cita['nombre'],
-                    telefono=datos_cita['telefono'],
-                    email=datos_cita['email'],
-                    tipo_cita=datos_cita['tipo_cita'],
-                    fecha=datetime.strptime(datos_cita['fecha'], '%Y-%m-%d').date(),
-                    hora=datos_cita['hora']
-                )
-                db.session.add(nueva_cita)
-                db.session.commit()
-                
-                return {
-                    'respuesta': f'¡Perfecto! Tu cita ha sido programada exitosamente para el {datos_cita["fecha"]} a las {datos_cita["hora"]}. Recibirás una confirmación por email. Tu número de cita es #{nueva_cita.id}. ¡Gracias por confiar en nosotros!',
-                    'estado': ESTADOS_CONVERSACION['inicial'],
-                    'datos_cita': {},
-                    'cita_guardada': True
-                }
-            except Exception as e:
-                return {
-                    'respuesta': f'Lo sentimos, hubo un error al guardar tu cita. Por favor, inténtalo de nuevo o contacta directamente con nosotros al +34 900 123 456.',
-                    'estado': ESTADOS_CONVERSACION['inicial'],
-                    'datos_cita': {}
-                }
-        else:
-            return {
-                'respuesta': 'Entendido, la cita no se ha confirmado. Si cambias de opinión, puedes volver a solicitar una cita en cualquier momento.',
-                'estado': ESTADOS_CONVERSACION['inicial'],
-                'datos_cita': {}
-            }
+    El buscador da prioridad a las coincidencias exactas con una clave y, si no
+    hay ninguna, a las palabras clave, respetando el orden de ambos diccionarios
+    """
+    coincidencia = catalogo.buscador.general.buscar(mensaje.minusculas)
+    if coincidencia is None:
+        # Sin coincidencias literales: la clave o palabra clave más parecida (faltas de ortografía, tildes)
+        coincidencia = catalogo.buscador.aproximado.buscar(mensaje.minusculas)
+        if coincidencia is not None and registro.isEnabledFor(logging.DEBUG):
+            registro.debug('coincidencia_aproximada', extra={'datos': {'mensaje': mensaje.minusculas, 'clave': coincidencia[0]}})
+    if coincidencia is None:
+        return respuesta_estado(catalogo.respuestas['default'], 'inicial', datos_cita, intencion='default')
     
-    # Manejar estado cuando el usuario está en el menú de tratamientos
-    elif estado_actual == ESTADOS_CONVERSACION['en_menu_tratamientos']:
-        # Si el usuario quiere agendar una cita desde el menú de tratamientos
-        if any(palabra in mensaje_lower for palabra in ['sí, quiero agendar', 'quiero agendar', 'agendar cita', 'solicitar cita', 'necesito cita', 'quiero una cita']):
-            return {
-                'respuesta': '¿Ya tienes un tratamiento abierto con nuestra clínica?',
-                'estado': ESTADOS_CONVERSACION['preguntando_tratamiento_abierto'],
-                'datos_cita': datos_cita,
-                'limpiar_pantalla': True
-            }
-        # Si el usuario pregunta sobre otro tratamiento
-        elif any(palabra in mensaje_lower for palabra in ['limpieza', 'empaste', 'ortodoncia', 'cirugía', 'cirugía oral', 'blanqueamiento', 'endodoncia', 'periodoncia', 'implante', 'implantes']):
-            print(f"Buscando tratamiento en mensaje: '{mensaje_lower}'")
-            # Buscar la respuesta correspondiente en RESPUESTAS_PREDEFINIDAS
-            print(f"Claves disponibles: {list(RESPUESTAS_PREDEFINIDAS.keys())}")
-            for clave, respuesta in RESPUESTAS_PREDEFINIDAS.items():
-                # Buscar coincidencias más flexibles
-                if clave in mensaje_lower or any(palabra in mensaje_lower for palabra in clave.split()):
-                    print(f"Encontrada clave: '{clave}' en mensaje")
-                    # Manejar respuestas con estructura compleja (con imágenes)
-                    if isinstance(respuesta, dict):
-                        print(f"Devolviendo respuesta con imágenes para {clave}: {respuesta.get('imagenes', [])}")
-                        return {
-                            'respuesta': respuesta['texto'],
-                            'imagenes': respuesta.get('imagenes', []),
-                            'estado': ESTADOS_CONVERSACION['en_menu_tratamientos'],
-                            'datos_cita': datos_cita
-                        }
-                    else:
-                        return {
-                            'respuesta': respuesta,
-                            'estado': ESTADOS_CONVERSACION['en_menu_tratamientos'],
-                            'datos_cita': datos_cita
-                        }
-        # Si no coincide con nada, mantener en el menú de tratamientos
-        return {
-            'respuesta': '¿Sobre qué tratamiento específico te gustaría saber más? Tenemos: limpieza dental, empastes, ortodoncia, cirugía oral, blanqueamiento, endodoncia, periodoncia, implantes dentales y otros tratamientos especializados.',
-            'estado': ESTADOS_CONVERSACION['en_menu_tratamientos'],
-            'datos_cita': datos_cita
-        }
+    clave, origen = coincidencia
+    # Las solicitudes de cita inician la reserva; las claves de información sobre
+    # tratamientos (no sus palabras clave) abren el menú de tratamientos
+    if clave in catalogo.claves_solicitar_cita:
+        estado = 'preguntando_tratamiento_abierto'
+    elif origen == 'clave' and clave in catalogo.claves_menu_tratamientos:
+        estado = 'en_menu_tratamientos'
+    else:
+        estado = 'inicial'
+    resultado = respuesta_catalogo(clave, estado, datos_cita, catalogo)
+    resultado.setdefault('imagenes', [])
+    return resultado
+
+def obtener_respuesta(mensaje, estado_actual='inicial', datos_cita=None, catalogo=None):
+    """Función para obtener la respuesta predefinida basada en el mensaje del usuario y el estado actual"""
+    catalogo = catalogo or CATALOGO.actual
+    mensaje = MensajeUsuario(mensaje)
     
-    # Para otros estados o estado inicial, usar el sistema de respuestas predefinidas
-    # Buscar coincidencias exactas primero
-    for clave, respuesta in RESPUESTAS_PREDEFINIDAS.items():
-        if clave in mensaje_lower:
-            # Manejar respuestas con estructura compleja (con imágenes)
-            if isinstance(respuesta, dict):
-                respuesta_texto = respuesta['texto']
-                imagenes = respuesta.get('imagenes', [])
-                print(f"Encontrada respuesta con imágenes para '{clave}': {len(imagenes)} imágenes")
-            else:
-                respuesta_texto = respuesta
-                imagenes = []
-            
-            # Si es una solicitud de cita, cambiar el estado
-            if clave in ['solicitar una cita', 'quiero una cita', 'necesito una cita', 'agendar cita', 'sí, quiero agendar una cita']:
-                return {
-                    'respuesta': respuesta_texto,
-                    'imagenes': imagenes,
-                    'estado': ESTADOS_CONVERSACION['preguntando_tratamiento_abierto'],
-                    'datos_cita': datos_cita
-                }
-            # Si es información sobre tratamientos, cambiar al estado de menú de tratamientos
-            elif clave in ['información sobre tratamientos', 'tratamientos']:
-                return {
-                    'respuesta': respuesta_texto,
-                    'imagenes': imagenes,
-                    'estado': ESTADOS_CONVERSACION['en_menu_tratamientos'],
-                    'datos_cita': datos_cita
-                }
-            else:
-                return {
-                    'respuesta': respuesta_texto,
-                    'imagenes': imagenes,
-                    'estado': ESTADOS_CONVERSACION['inicial'],
-                    'datos_cita': datos_cita
-                }
-    
-    # Si no hay coincidencias exactas, buscar palabras clave
-    palabras_clave = {
-        'hola': 'hola',
-        'buenos días': 'buenos días',
-        'buenas tardes': 'buenas tardes',
-        'buenas noches': 'buenas noches',
-        'tratamiento': 'información sobre tratamientos',
-        'limpieza': 'limpieza dental',
-        'empaste': 'empastes',
-        'ortodoncia': 'ortodoncia',
-        'cirugía': 'cirugía oral',
-        'blanqueamiento': 'blanqueamiento',
-        'endodoncia': 'endodoncia',
-        'periodoncia': 'periodoncia',
-        'implante': 'implantes dentales',
-        'cita': 'solicitar una cita',
-        'agendar': 'solicitar una cita',
-        'financiación': 'información sobre financiación',
-        'financiar': 'información sobre financiación',
-        'pago': 'pago',
-        'precio': 'precio',
-        'coste': 'coste',
-        'costo': 'coste',
-        'cuota': 'información sobre financiación',
-        'plazo': 'información sobre financiación',
-        'pregunta': 'preguntas frecuentes',
-        'frecuente': 'preguntas frecuentes',
-        'faq': 'preguntas frecuentes',
-        'duración': 'duración',
-        'dolor': 'dolor',
-        'emergencia': 'emergencia',
-        'ubicación': 'ubicaciones',
-        'dirección': 'ubicaciones',
-        'horario': 'horarios',
-        'teléfono': 'teléfono',
-        'contacto': 'teléfono'
-    }
+    for condicion, accion in TRANSICIONES.get(estado_actual, ()):
+        if condicion is None or condicion.presente(mensaje):
+            resultado = accion(mensaje, datos_cita, catalogo)
+            if resultado is not None:
+                return resultado
     
-    for palabra, respuesta_clave in palabras_clave.items():
-        if palabra in mensaje_lower:
-            respuesta = RESPUESTAS_PREDEFINIDAS[respuesta_clave]
-            # Manejar respuestas con estructura compleja (con imágenes)
-            if isinstance(respuesta, dict):
-                respuesta_texto = respuesta['texto']
-                imagenes = respuesta.get('imagenes', [])
-            else:
-                respuesta_texto = respuesta
-                imagenes = []
-            
-            # Si es una solicitud de cita, cambiar el estado
-            if respuesta_clave == 'solicitar una cita':
-                return {
-                    'respuesta': respuesta_texto,
-                    'imagenes': imagenes,
-                    'estado': ESTADOS_CONVERSACION['preguntando_tratamiento_abierto'],
-                    'datos_cita': datos_cita
-                }
-            else:
-                return {
-                    'respuesta': respuesta_texto,
-                    'imagenes': imagenes,
-                    'estado': ESTADOS_CONVERSACION['inicial'],
-                    'datos_cita': datos_cita
-                }
-    
-    # Si no hay coincidencias, devolver respuesta por defecto
-    return {
-        'respuesta': RESPUESTAS_PREDEFINIDAS['default'],
-        'estado': ESTADOS_CONVERSACION['inicial'],
-        'datos_cita': datos_cita
-    }
+    return responder_con_catalogo(mensaje, datos_cita, catalogo)
 
 # Configuración del chatbot
 CHATBOT_CONFIG = {
@@ -513,24 +445,170 @@ CHATBOT_CONFIG = {
     'welcome_message': 'Bienvenido a Clínica Dental "De Ejemplo", ¿en qué puedo ayudarte?'
 }
 
+# CSS y JS con el hash del contenido en el nombre (construir_estaticos.py); como el
+# nombre cambia con cada versión, el navegador puede guardarlos sin volver a pedirlos
+MANIFIESTO_ESTATICOS = cargar_manifiesto(app.static_folder)
+CACHE_ESTATICOS_SEGUNDOS = 365 * 24 * 3600
+RUTA_MANIFIESTO_ESTATICOS = os.path.join(app.static_folder, DESTINO_ESTATICOS, MANIFIESTO_ARCHIVO)
+
+def _fecha_manifiesto():
+    try:
+        return os.stat(RUTA_MANIFIESTO_ESTATICOS).st_mtime_ns
+    except OSError:
+        return None
+
+_FECHA_MANIFIESTO = _fecha_manifiesto()
+
+def version_manifiesto_estaticos():
+    """Fecha del manifiesto; si se han reconstruido los estáticos, vuelve a cargarlo"""
+    global MANIFIESTO_ESTATICOS, _FECHA_MANIFIESTO
+    fecha = _fecha_manifiesto()
+    if fecha != _FECHA_MANIFIESTO:
+        MANIFIESTO_ESTATICOS = cargar_manifiesto(app.static_folder, construir_si_cambia=False)
+        _FECHA_MANIFIESTO = fecha
+    return fecha
+
+@app.template_global()
+def estatico(ruta):
+    """URL de un archivo de static/: su versión con hash o, en desarrollo, el original"""
+    versionada = MANIFIESTO_ESTATICOS.get(ruta)
+    if versionada is None or app.debug:
+        return url_for('static', filename=ruta)
+    return url_for('estatico_versionado', ruta=versionada)
+
+@app.route(f'/static/{DESTINO_ESTATICOS}/<path:ruta>')
+def estatico_versionado(ruta):
+    """Sirve la versión precomprimida que acepte el navegador con caché inmutable"""
+    directorio = os.path.join(app.static_folder, DESTINO_ESTATICOS)
+    archivo, codificacion = ruta, None
+    for candidata, extension in (('br', '.br'), ('gzip', '.gz')):
+        comprimido = safe_join(directorio, ruta + extension)
+        if request.accept_encodings[candidata] and comprimido and os.path.isfile(comprimido):
+            archivo, codificacion = ruta + extension, candidata
+            break
+    
+    respuesta = send_from_directory(directorio, archivo, mimetype=mimetypes.guess_type(ruta)[0],
+                                    max_age=CACHE_ESTATICOS_SEGUNDOS)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.public = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+# Imágenes de los tratamientos: el catálogo las referencia por identificador y
+# construir_imagenes.py genera sus miniaturas y versiones grandes en WebP y JPEG
+IMAGENES = cargar_manifiesto_imagenes(app.static_folder)
+IMAGENES_ORIGINALES = originales_imagenes(app.static_folder)
+_IMAGENES_RESUELTAS = {}
+
+def url_estatica(ruta, versionada=True):
+    """URL de un archivo de static/dist (o de static/ si no es una versión generada)"""
+    if versionada:
+        return f'{app.static_url_path}/{DESTINO_ESTATICOS}/{ruta}'
+    return f'{app.static_url_path}/{ruta}'
+
+def _srcset(variantes):
+    return ', '.join(f'{url_estatica(ruta)} {ancho}w' for ruta, ancho in variantes)
+
+def resolver_imagen(imagen):
+    """Datos para mostrar una imagen del catálogo: URL, srcset en JPEG y WebP, tamaño y versión grande.
+    
+    Las imágenes con 'url' (externas) se devuelven tal cual; las que no tienen
+    variantes generadas usan el original. Devuelve None si el identificador no existe.
+    """
+    identificador = imagen.get('id')
+    if identificador is None:
+        return imagen
+    clave = (identificador, imagen.get('alt', ''))
+    resuelta = _IMAGENES_RESUELTAS.get(clave)
+    if resuelta is not None:
+        return resuelta
+    
+    variantes = IMAGENES.get(identificador)
+    if variantes is not None:
+        miniatura = variantes['miniatura']
+        resuelta = {
+            'alt': clave[1],
+            'url': url_estatica(miniatura['variantes']['jpg'][0][0]),
+            'srcset': _srcset(miniatura['variantes']['jpg']),
+            'srcset_webp': _srcset(miniatura['variantes']['webp']),
+            'ancho': miniatura['ancho'],
+            'alto': miniatura['alto'],
+            'grande': url_estatica(variantes['grande']['jpg'][-1][0])
+        }
+    elif identificador in IMAGENES_ORIGINALES:
+        resuelta = {'alt': clave[1], 'url': url_estatica(IMAGENES_ORIGINALES[identificador], versionada=False)}
+    else:
+        registro.warning('imagen_desconocida', extra={'datos': {'id': identificador}})
+        return None
+    _IMAGENES_RESUELTAS[clave] = resuelta
+    return resuelta
+
+def resolver_imagenes(imagenes):
+    return [resuelta for resuelta in map(resolver_imagen, imagenes) if resuelta is not None]
+
+# Páginas que solo dependen de la plantilla, de CHATBOT_CONFIG y de sus
+# argumentos: se renderizan una vez y se vuelven a renderizar cuando cambia la
+# plantilla, la configuración o el manifiesto de los estáticos (las páginas
+# enlazan los CSS y JS por su nombre con hash). Se sirven con ETag y Last-Modified para que
+# los navegadores que ya las tienen reciban un 304
+PAGINAS_CAPACIDAD = 64
+_PAGINAS = OrderedDict()
+_PAGINAS_LOCK = threading.Lock()
+
+def firma_pagina(plantilla):
+    """Versión de lo que determina una página: fecha de la plantilla, configuración y manifiesto de estáticos"""
+    ruta = os.path.join(app.root_path, app.template_folder, plantilla)
+    return (os.stat(ruta).st_mtime_ns, json.dumps(CHATBOT_CONFIG, sort_keys=True), app.debug,
+            version_manifiesto_estaticos())
+
+def pagina_cacheada(plantilla, argumentos=(), **contexto):
+    """Respuesta de una página renderizada, reutilizada mientras no cambie su firma"""
+    clave = (request.endpoint, argumentos)
+    firma = firma_pagina(plantilla)
+    with _PAGINAS_LOCK:
+        pagina = _PAGINAS.get(clave)
+        if pagina is not None:
+            _PAGINAS.move_to_end(clave)
+    
+    if pagina is None or pagina[0] != firma:
+        if pagina is not None and app.jinja_env.cache is not None:
+            # Sin recarga automática Jinja seguiría usando la plantilla ya compilada
+            app.jinja_env.cache.clear()
+        cuerpo = render_template(plantilla, **contexto).encode()
+        pagina = (firma, cuerpo, hashlib.sha1(cuerpo).hexdigest(), datetime.utcnow().replace(microsecond=0))
+        with _PAGINAS_LOCK:
+            _PAGINAS[clave] = pagina
+            while len(_PAGINAS) > PAGINAS_CAPACIDAD:
+                _PAGINAS.popitem(last=False)
+    
+    _, cuerpo, etag, modificada = pagina
+    respuesta = app.response_class(cuerpo, mimetype='text/html')
+    respuesta.set_etag(etag)
+    respuesta.last_modified = modificada
+    # El navegador la guarda pero pregunta cada vez si sigue siendo válida
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
 @app.route('/')
 def index():
-    return render_template('index.html', config=CHATBOT_CONFIG)
+    return pagina_cacheada('index.html', config=CHATBOT_CONFIG)
 
 @app.route('/citas')
 def citas():
     tipo_cita = request.args.get('tipo', 'revision')
-    return render_template('citas.html', tipo_cita=tipo_cita)
+    return pagina_cacheada('citas.html', (tipo_cita,), tipo_cita=tipo_cita)
 
 @app.route('/admin')
 def admin():
     """Página de administración de la base de datos"""
-    return render_template('admin.html')
+    return pagina_cacheada('admin.html')
 
 @app.route('/panel')
 def panel():
     """Panel de atención al cliente"""
-    return render_template('panel.html')
+    return pagina_cacheada('panel.html')
 
 @app.route('/formulario-cita')
 def formulario_cita():
@@ -551,45 +629,40 @@ def formulario_cita():
                          datos_cita=datos_cita,
                          horas_disponibles=horas_disponibles)
 
+def horas_formulario(fecha):
+    """Horas libres para volver a mostrar el formulario; vacía si no se pueden consultar"""
+    if not fecha:
+        return []
+    try:
+        return get_horas_disponibles(fecha)
+    except (BaseDatosOcupada, ValueError):
+        return []
+
 @app.route('/guardar-cita-form', methods=['POST'])
 def guardar_cita_form():
     """Procesar el formulario de citas"""
+    # Obtener datos del formulario
+    nombre = request.form.get('nombre')
+    telefono = request.form.get('telefono')
+    email = request.form.get('email')
+    tipo_cita = request.form.get('tipo_cita')
+    fecha = request.form.get('fecha')
+    hora = request.form.get('hora')
+    datos_cita = {'nombre': nombre, 'telefono': telefono, 'email': email, 'tipo_cita': tipo_cita, 'fecha': fecha, 'hora': hora}
+    
     try:
-        # Obtener datos del formulario
-        nombre = request.form.get('nombre')
-        telefono = request.form.get('telefono')
-        email = request.form.get('email')
-        tipo_cita = request.form.get('tipo_cita')
-        fecha = request.form.get('fecha')
-        hora = request.form.get('hora')
-        
         # Validar datos requeridos
         if not all([nombre, telefono, email, tipo_cita, fecha, hora]):
             return render_template('cita_form.html',
                                 config=CHATBOT_CONFIG,
-                                datos_cita={'nombre': nombre, 'telefono': telefono, 'email': email, 'tipo_cita': tipo_cita, 'fecha': fecha, 'hora': hora},
+                                datos_cita=datos_cita,
                                 horas_disponibles=get_horas_disponibles(fecha) if fecha else [],
                                 mensaje='Por favor completa todos los campos requeridos',
                                 tipo_mensaje='error')
         
-        # Verificar si la hora está disponible
+        # Crear nueva cita si la hora sigue disponible
         fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
-        cita_existente = Cita.query.filter_by(
-            fecha=fecha_obj,
-            hora=hora,
-            estado='pendiente'
-        ).first()
-        
-        if cita_existente:
-            return render_template('cita_form.html',
-                                config=CHATBOT_CONFIG,
-                                datos_cita={'nombre': nombre, 'telefono': telefono, 'email': email, 'tipo_cita': tipo_cita, 'fecha': fecha, 'hora': hora},
-                                horas_disponibles=get_horas_disponibles(fecha),
-                                mensaje='Lo sentimos, esa hora ya no está disponible. Por favor selecciona otra hora.',
-                                tipo_mensaje='error')
-        
-        # Crear nueva cita
-        nueva_cita = Cita(
+        nueva_cita = reservar_cita(
             nombre=nombre,
             telefono=telefono,
             email=email,
@@ -598,8 +671,13 @@ def guardar_cita_form():
             hora=hora
         )
         
-        db.session.add(nueva_cita)
-        db.session.commit()
+        if nueva_cita is None:
+            return render_template('cita_form.html',
+                                config=CHATBOT_CONFIG,
+                                datos_cita=datos_cita,
+                                horas_disponibles=get_horas_disponibles(fecha),
+                                mensaje='Lo sentimos, esa hora ya no está disponible. Por favor selecciona otra hora.',
+                                tipo_mensaje='error')
         
         # Limpiar datos de la sesión
         session.pop('datos_cita', None)
@@ -608,48 +686,286 @@ def guardar_cita_form():
                             config=CHATBOT_CONFIG,
                             mensaje=f'¡Excelente! Tu cita ha sido programada exitosamente para el {fecha} a las {hora}. Recibirás una confirmación por email. Tu número de cita es #{nueva_cita.id}.',
                             tipo_mensaje='success')
-        
+    
+    except BaseDatosOcupada:
+        # Sin volver a consultar las horas: la base de datos sigue saturada
+        pagina = render_template('cita_form.html',
+                                 config=CHATBOT_CONFIG,
+                                 datos_cita=datos_cita,
+                                 horas_disponibles=[],
+                                 mensaje='El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.',
+                                 tipo_mensaje='error')
+        return pagina, 503, {'Retry-After': str(max(1, int(DB_ESPERA_MAXIMA)))}
+    
     except Exception as e:
+        registro.exception('error_guardar_cita_form')
         return render_template('cita_form.html',
                             config=CHATBOT_CONFIG,
-                            datos_cita={'nombre': nombre, 'telefono': telefono, 'email': email, 'tipo_cita': tipo_cita, 'fecha': fecha, 'hora': hora},
-                            horas_disponibles=get_horas_disponibles(fecha) if fecha else [],
-                            mensaje=f'Error al guardar la cita: {str(e)}',
+                            datos_cita=datos_cita,
+                            horas_disponibles=horas_formulario(fecha),
+                            mensaje=f'Error al guardar la cita: {str(e) or type(e).__name__}',
                             tipo_mensaje='error')
 
+# Las respuestas de /chat ya serializadas se guardan en cada versión del
+# catálogo, indexadas por (intención, estado, campos variables). Cada entrada
+# guarda el JSON codificado alrededor de los únicos campos que cambian en cada
+# petición: 'datos_cita' y 'timestamp' y, con las conversaciones guardadas en
+# el servidor, 'conversacion_id' y 'version'
+_SEPARADORES_JSON = (',', ':')
+
+def construir_respuesta_chat(resultado, datos_cita, timestamp, **extra):
+    """Construye el diccionario que devuelve /chat a partir del resultado del chatbot"""
+    respuesta = {
+        'response': resultado['respuesta'],
+        'estado': resultado['estado'],
+        'datos_cita': datos_cita,
+        'mostrar_calendario': resultado.get('mostrar_calendario', False),
+        'mostrar_horas': resultado.get('mostrar_horas', False),
+        'mostrar_confirmacion': resultado.get('mostrar_confirmacion', False),
+        'mostrar_input_padecimiento': resultado.get('mostrar_input_padecimiento', False),
+        'mostrar_botones_faq': resultado.get('mostrar_botones_faq', False),
+        'cita_guardada': resultado.get('cita_guardada', False),
+        'limpiar_pantalla': resultado.get('limpiar_pantalla', False),
+        'timestamp': timestamp
+    }
+    if resultado.get('imagenes'):
+        respuesta['imagenes'] = resultado['imagenes']
+    respuesta.update(extra)
+    return respuesta
+
+def serializar_respuesta_estatica(resultado, variables, catalogo):
+    """Devuelve el cuerpo JSON de una respuesta fija insertando solo los campos variables.
+    
+    `variables` contiene 'datos_cita', 'timestamp' y, opcionalmente, otros
+    campos de la respuesta que cambian en cada petición.
+    """
+    clave = (resultado['intencion'], resultado['estado'], tuple(sorted(variables)))
+    plantilla = catalogo.serializadas.get(clave)
+    
+    if plantilla is None:
+        marcas = {campo: f'\x00{campo}\x00' for campo in variables}
+        extra = {campo: marca for campo, marca in marcas.items() if campo not in ('datos_cita', 'timestamp')}
+        texto = app.json.dumps(
+            construir_respuesta_chat(resultado, marcas['datos_cita'], marcas['timestamp'], **extra),
+            separators=_SEPARADORES_JSON
+        )
+        # Trocear el JSON por las marcas en el orden en que aparecen (claves ordenadas)
+        orden = sorted(variables, key=lambda campo: texto.index(app.json.dumps(marcas[campo])))
+        trozos = []
+        for campo in orden:
+            anterior, _, texto = texto.partition(app.json.dumps(marcas[campo]))
+            trozos.append(anterior.encode())
+        trozos.append((texto + '\n').encode())
+        plantilla = (orden, trozos)
+        catalogo.serializadas[clave] = plantilla
+    
+    orden, trozos = plantilla
+    partes = [trozos[0]]
+    for campo, trozo in zip(orden, trozos[1:]):
+        partes.append(app.json.dumps(variables[campo], separators=_SEPARADORES_JSON).encode())
+        partes.append(trozo)
+    return b''.join(partes)
+
+def precalentar_catalogo(catalogo):
+    """Serializa de antemano las respuestas de cada clave del catálogo antes de ponerlo en uso"""
+    marca = datetime.now().isoformat()
+    for clave in catalogo.respuestas:
+        resultado = obtener_respuesta(clave, 'inicial', {}, catalogo)
+        if resultado.get('intencion') is None:
+            continue
+        serializar_respuesta_estatica(resultado, {'datos_cita': resultado['datos_cita'], 'timestamp': marca}, catalogo)
+        serializar_respuesta_estatica(resultado, {'datos_cita': {}, 'timestamp': marca, 'conversacion_id': '', 'version': 0}, catalogo)
+
+# Contenido del chatbot (respuestas, palabras clave y disparadores) en un archivo
+# JSON que se recarga sin reiniciar; la versión compilada se guarda en instance/
+CATALOGO = CatalogoRecargable(
+    os.getenv('CATALOGO_RUTA') or os.path.join(app.root_path, 'catalogo.json'),
+    directorio_cache=os.getenv('CATALOGO_CACHE') or os.path.join(app.instance_path, 'catalogo'),
+    intervalo=float(os.getenv('CATALOGO_INTERVALO', '2')),
+    al_cambiar=precalentar_catalogo
+)
+precalentar_catalogo(CATALOGO.actual)
+
+# Conversaciones guardadas en el servidor: el cliente solo envía el identificador
+# y la versión, y recibe los cambios de los datos de la cita en lugar de todos
+CONVERSACIONES_EN_SERVIDOR = os.getenv('CONVERSACIONES_EN_SERVIDOR', '1') == '1'
+# Con varios workers cada mensaje puede llegar a uno distinto: sin un almacén
+# compartido la mitad de los mensajes recibirían 409 y el cliente tendría que
+# reenviar el estado completo. Por eso con más de un worker (gunicorn.conf.py
+# publica WEB_CONCURRENCY) se usa por defecto un archivo SQLite en instance/
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+CONVERSACIONES_SQLITE = os.getenv('CONVERSACIONES_SQLITE') or (
+    os.path.join(app.instance_path, 'conversaciones.db') if WEB_CONCURRENCY > 1 else None
+)
+if CONVERSACIONES_SQLITE and os.path.dirname(CONVERSACIONES_SQLITE):
+    os.makedirs(os.path.dirname(CONVERSACIONES_SQLITE), exist_ok=True)
+CONVERSACIONES = AlmacenConversaciones(
+    capacidad=int(os.getenv('CONVERSACIONES_CAPACIDAD', '10000')),
+    ttl=int(os.getenv('CONVERSACIONES_TTL', '1800')),
+    ruta_sqlite=CONVERSACIONES_SQLITE
+)
+
+# Límites por cliente: cada uno puede hacer una ráfaga de peticiones y después
+# recupera el permiso a un ritmo fijo por segundo. Todas las peticiones cuentan
+# para el límite de su IP, más amplio en el chat porque varios pacientes pueden
+# compartir la IP de la clínica o de su operador móvil; los mensajes de una
+# conversación ya abierta cuentan además para el límite, más estricto, de esa
+# conversación. Abrir conversaciones nuevas no amplía el límite de la IP
+LIMITES = os.getenv('LIMITES', '1') == '1'
+LIMITES_SQLITE = os.getenv('LIMITES_SQLITE') or None
+LIMITADORES = {
+    'chat': LimitadorPeticiones(
+        rafaga=float(os.getenv('LIMITE_CHAT_RAFAGA', '60')),
+        ritmo=float(os.getenv('LIMITE_CHAT_RITMO', '3')),
+        ruta_sqlite=LIMITES_SQLITE
+    ),
+    'conversacion': LimitadorPeticiones(
+        rafaga=float(os.getenv('LIMITE_CONVERSACION_RAFAGA', '20')),
+        ritmo=float(os.getenv('LIMITE_CONVERSACION_RITMO', '1')),
+        ruta_sqlite=LIMITES_SQLITE
+    ),
+    'reservas': LimitadorPeticiones(
+        rafaga=float(os.getenv('LIMITE_RESERVAS_RAFAGA', '5')),
+        ritmo=float(os.getenv('LIMITE_RESERVAS_RITMO', '0.1')),
+        ruta_sqlite=LIMITES_SQLITE
+    ),
+}
+LIMITADOR_POR_ENDPOINT = {
+    'chat': 'chat',
+    'api_guardar_cita': 'reservas',
+    'api_guardar_cita_chat': 'reservas',
+}
+# Peticiones limitadas en curso a la vez en cada worker. Con más se responde
+# 503 al momento: siempre quedan hilos libres para el resto de peticiones
+LIMITE_CONCURRENCIA = LimitadorConcurrencia(int(os.getenv('LIMITE_CONCURRENCIA', str(max(1, GUNICORN_THREADS - 2)))))
+LIMITE_CONCURRENCIA_REINTENTO = int(os.getenv('LIMITE_CONCURRENCIA_REINTENTO', '1'))
+
+def limites_peticion(nombre):
+    """Pares (limitador, clave) que se aplican a la petición, el más estricto primero"""
+    limites = [(nombre, f'ip:{request.remote_addr}')]
+    if nombre == 'chat':
+        data = request.get_json(silent=True)
+        conversacion_id = data.get('conversacion_id') if isinstance(data, dict) else None
+        # Solo conversaciones que ya existen: un identificador inventado no tiene límite propio
+        if isinstance(conversacion_id, str) and CONVERSACIONES.en_memoria(conversacion_id):
+            limites.insert(0, ('conversacion', f'conversacion:{conversacion_id}'))
+    return limites
+
+def respuesta_limite(mensaje, status_code, espera):
+    respuesta = jsonify({'success': False, 'error': mensaje})
+    respuesta.status_code = status_code
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+@app.before_request
+def aplicar_limites():
+    nombre = LIMITADOR_POR_ENDPOINT.get(request.endpoint)
+    if not LIMITES or nombre is None:
+        return None
+
+    if not LIMITE_CONCURRENCIA.entrar():
+        registro.warning('peticion_rechazada', extra={'datos': {'motivo': 'concurrencia', 'endpoint': request.endpoint}})
+        return respuesta_limite('El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.',
+                                503, LIMITE_CONCURRENCIA_REINTENTO)
+    g.limite_concurrencia = True
+
+    for limitador, clave in limites_peticion(nombre):
+        try:
+            permitido, espera = LIMITADORES[limitador].consumir(clave)
+        except sqlite3.Error:
+            # Sin el almacén compartido es mejor atender la petición que rechazarla
+            registro.exception('error_limites')
+            return None
+        if not permitido:
+            registro.info('peticion_rechazada', extra={'datos': {'motivo': 'limite', 'limite': limitador,
+                                                                 'endpoint': request.endpoint}})
+            return respuesta_limite('Has enviado demasiadas peticiones seguidas. Por favor, espera unos segundos.',
+                                    429, espera)
+    return None
+
+@app.teardown_request
+def liberar_limites(error=None):
+    if g.pop('limite_concurrencia', False):
+        LIMITE_CONCURRENCIA.salir()
+
+def estado_cliente(data):
+    """Estado y datos de la cita enviados por el cliente, descartando valores no válidos"""
+    estado = data.get('estado', 'inicial')
+    if estado not in ESTADOS_CONVERSACION:
+        estado = ESTADOS_CONVERSACION['inicial']
+    datos_cita = data.get('datos_cita')
+    if not isinstance(datos_cita, dict):
+        datos_cita = {}
+    return estado, datos_cita
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
         data = request.get_json()
         user_message = data.get('message', '')
-        estado_actual = data.get('estado', 'inicial')
-        datos_cita = data.get('datos_cita', {})
         
         if not user_message.strip():
             return jsonify({'error': 'Mensaje vacío'}), 400
         
-        # Obtener respuesta predefinida con estado
-        resultado = obtener_respuesta(user_message, estado_actual, datos_cita)
+        conversacion_id = None
+        if CONVERSACIONES_EN_SERVIDOR and data.get('conversacion_id'):
+            version = data.get('version')
+            if not isinstance(data['conversacion_id'], str) or (
+                    version is not None and (not isinstance(version, int) or isinstance(version, bool))):
+                return jsonify({'error': 'Conversación no válida'}), 400
+            guardada = CONVERSACIONES.obtener(data['conversacion_id'], data.get('version'))
+            if guardada is None:
+                # Caducada, de otro worker o versión antigua: el cliente reenvía su estado completo
+                return jsonify({'conversacion_desconocida': True}), 409
+            conversacion_id = data['conversacion_id']
+            version, estado_actual, datos_cita = guardada
+        elif CONVERSACIONES_EN_SERVIDOR and data.get('usar_conversacion'):
+            # Primer mensaje: el estado del cliente se valida una sola vez y se guarda
+            conversacion_id = CONVERSACIONES.nuevo_id()
+            version = 0
+            estado_actual, datos_cita = estado_cliente(data)
+        else:
+            estado_actual = data.get('estado', 'inicial')
+            datos_cita = data.get('datos_cita', {})
+        datos_anteriores = dict(datos_cita or {})
+        
+        # Obtener respuesta predefinida con estado; toda la petición usa la misma versión del catálogo
+        catalogo = CATALOGO.actual
+        resultado = obtener_respuesta(user_message, estado_actual, datos_cita, catalogo)
+        registro.info('respuesta_chat', extra={
+            'datos': {'estado_anterior': estado_actual, 'estado': resultado['estado'], 'intencion': resultado.get('intencion')},
+            'muestreo': LOG_MUESTREO_CHAT
+        })
         
         # Guardar datos de cita en la sesión si se va a redirigir al formulario
         if resultado.get('redirigir_formulario'):
             session['datos_cita'] = resultado['datos_cita']
         
-        return jsonify({
-            'response': resultado['respuesta'],
-            'estado': resultado['estado'],
-            'datos_cita': resultado['datos_cita'],
-            'mostrar_calendario': resultado.get('mostrar_calendario', False),
-            'mostrar_horas': resultado.get('mostrar_horas', False),
-            'mostrar_confirmacion': resultado.get('mostrar_confirmacion', False),
-            'mostrar_input_padecimiento': resultado.get('mostrar_input_padecimiento', False),
-            'mostrar_botones_faq': resultado.get('mostrar_botones_faq', False),
-            'cita_guardada': resultado.get('cita_guardada', False),
-            'limpiar_pantalla': resultado.get('limpiar_pantalla', False),
-            'timestamp': datetime.now().isoformat()
-        })
+        variables = {'datos_cita': resultado['datos_cita'], 'timestamp': datetime.now().isoformat()}
+        if conversacion_id is not None:
+            datos_nuevos = resultado['datos_cita'] or {}
+            variables['conversacion_id'] = conversacion_id
+            variables['version'] = CONVERSACIONES.guardar(conversacion_id, version, resultado['estado'], datos_nuevos)
+            if variables['version'] is None:
+                # Otro worker ha guardado antes un mensaje de la misma conversación
+                return jsonify({'conversacion_desconocida': True}), 409
+            variables['datos_cita'], eliminados = cambios_datos(datos_anteriores, datos_nuevos)
+            if eliminados:
+                variables['datos_cita_eliminados'] = eliminados
+        
+        # Las respuestas fijas del catálogo reutilizan su JSON ya codificado
+        if resultado.get('intencion') is not None and not app.debug:
+            return app.response_class(
+                serializar_respuesta_estatica(resultado, variables, catalogo),
+                mimetype=app.json.mimetype
+            )
+        
+        datos_respuesta = variables.pop('datos_cita')
+        timestamp = variables.pop('timestamp')
+        return jsonify(construir_respuesta_chat(resultado, datos_respuesta, timestamp, **variables))
         
     except Exception as e:
+        registro.exception('error_chat')
         return jsonify({'error': f'Error en el servidor: {str(e)}'}), 500
 
 # Funciones para manejar citas
@@ -658,6 +974,12 @@ def get_dias_disponibles():
     dias = []
     fecha_actual = datetime.now().date()
     
+    # Huecos libres de toda la ventana con una sola consulta agregada
+    libres = {
+        dia['fecha']: dia['libres']
+        for dia in get_disponibilidad_rango(fecha_actual + timedelta(days=1), 30)
+    }
+    
     for i in range(1, 31):
         fecha = fecha_actual + timedelta(days=i)
         # Excluir domingos (6 = domingo)
@@ -666,70 +988,291 @@ def get_dias_disponibles():
                 'fecha': fecha.strftime('%d/%m/%Y'),
                 'dia_semana': fecha.strftime('%A'),
                 'dia_mes': fecha.day,
-                'mes': fecha.strftime('%B')
+                'mes': fecha.strftime('%B'),
+                # Los días fuera de la ventana de reservas no tienen huecos
+                'libres': libres.get(fecha.strftime('%Y-%m-%d'), 0)
             })
     
     return dias
 
+# Horarios de la clínica: 9:00-18:00 (L-V), 9:00-14:00 (S), en franjas de media hora
+HORA_APERTURA = 9
+
+# Caché en memoria de la ocupación de cada día: fecha -> (mapa de bits, instante).
+# El bit i representa la franja i de media hora a partir de la apertura. La caché
+# se invalida en cada alta de cita; el TTL acota el desfase entre procesos.
+# Solo guarda los días de la ventana de reservas, así que su tamaño está acotado
+# aunque un cliente pida fechas arbitrarias
+_OCUPACION_DIAS = {}
+OCUPACION_CACHE_TTL = float(os.getenv('OCUPACION_CACHE_TTL', '30'))
+# Días a partir de hoy en los que se puede reservar
+VENTANA_RESERVAS_DIAS = int(os.getenv('VENTANA_RESERVAS_DIAS', '90'))
+# Generación de cada día: cambia al invalidarlo, para que una consulta que empezó
+# antes de una reserva no vuelva a guardar en la caché la ocupación anterior
+_GENERACION_OCUPACION = {}
+_OCUPACION_LOCK = threading.Lock()
+
+def ventana_reservas():
+    """Primer y último día en los que se puede reservar"""
+    hoy = datetime.now().date()
+    return hoy, hoy + timedelta(days=VENTANA_RESERVAS_DIAS)
+
+def generacion_ocupacion(fecha):
+    return _GENERACION_OCUPACION.get(fecha, 0)
+
+def guardar_ocupacion(fecha, ocupacion, instante, generacion):
+    """Guarda la ocupación de un día si está en la ventana y nadie lo ha invalidado desde que se leyó"""
+    primero, ultimo = ventana_reservas()
+    if not primero <= fecha <= ultimo:
+        return
+    with _OCUPACION_LOCK:
+        if _GENERACION_OCUPACION.get(fecha, 0) != generacion:
+            return
+        _OCUPACION_DIAS[fecha] = (ocupacion, instante)
+        # Los días que ya han salido de la ventana no se vuelven a consultar
+        for pasado in [f for f in _OCUPACION_DIAS if f < primero]:
+            del _OCUPACION_DIAS[pasado]
+        for pasado in [f for f in _GENERACION_OCUPACION if f < primero]:
+            del _GENERACION_OCUPACION[pasado]
+
+def get_franjas_dia(fecha):
+    """Devuelve todas las franjas de media hora en las que abre la clínica ese día"""
+    hora_fin = 14 if fecha.weekday() == 5 else 18
+    franjas = []
+    for hora in range(HORA_APERTURA, hora_fin):
+        franjas.append(f"{hora:02d}:00")
+        franjas.append(f"{hora:02d}:30")
+    return franjas
+
+def _indice_franja(hora_str):
+    """Convierte 'HH:MM' en el índice de su franja o None si no es una franja válida"""
+    try:
+        horas, minutos = hora_str.split(':')
+        horas, minutos = int(horas), int(minutos)
+    except (AttributeError, ValueError):
+        return None
+    if minutos not in (0, 30) or horas < HORA_APERTURA:
+        return None
+    return (horas - HORA_APERTURA) * 2 + minutos // 30
+
+def get_ocupacion_dia(fecha):
+    """Obtiene el mapa de bits de franjas ocupadas de un día con una única consulta"""
+    ahora = time.monotonic()
+    en_cache = _OCUPACION_DIAS.get(fecha)
+    if en_cache is not None and ahora - en_cache[1] < OCUPACION_CACHE_TTL:
+        return en_cache[0]
+    
+    ocupacion = 0
+    generacion = generacion_ocupacion(fecha)
+    with acceso_db():
+        horas_ocupadas = db.session.query(Cita.hora).filter_by(fecha=fecha, estado='pendiente').all()
+    for (hora,) in horas_ocupadas:
+        indice = _indice_franja(hora)
+        if indice is not None:
+            ocupacion |= 1 << indice
+    
+    guardar_ocupacion(fecha, ocupacion, ahora, generacion)
+    return ocupacion
+
+# Hilos que pueden usar la base de datos a la vez en cada worker. Si SQLite
+# está ocupado, los demás esperan como mucho DB_ESPERA_MAXIMA segundos y la
+# petición se rechaza con 503, en lugar de acaparar todos los hilos del worker
+# y bloquear también las respuestas del chat, que no usan la base de datos
+DB_CONCURRENCIA = int(os.getenv('DB_CONCURRENCIA', str(max(1, GUNICORN_THREADS // 2))))
+DB_ESPERA_MAXIMA = float(os.getenv('DB_ESPERA_MAXIMA', '2'))
+_ACCESO_DB = threading.BoundedSemaphore(DB_CONCURRENCIA)
+
+class BaseDatosOcupada(Exception):
+    """No se ha podido acceder a la base de datos dentro del tiempo de espera"""
+
+@contextmanager
+def acceso_db():
+    """Limita cuántos hilos del worker acceden a la vez a la base de datos.
+    
+    Un error operativo de SQLite (por ejemplo, "database is locked" tras
+    agotar busy_timeout) también se trata como base de datos ocupada.
+    """
+    if not _ACCESO_DB.acquire(timeout=DB_ESPERA_MAXIMA):
+        raise BaseDatosOcupada()
+    try:
+        yield
+    except OperationalError as e:
+        db.session.rollback()
+        registro.warning('base_datos_no_disponible', extra={'datos': {'error': str(e.orig)}})
+        raise BaseDatosOcupada() from e
+    finally:
+        _ACCESO_DB.release()
+
+def respuesta_servidor_ocupado():
+    """Respuesta rápida cuando la base de datos está saturada"""
+    respuesta = jsonify({
+        'success': False,
+        'error': 'El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.'
+    })
+    respuesta.status_code = 503
+    respuesta.headers['Retry-After'] = str(max(1, int(DB_ESPERA_MAXIMA)))
+    return respuesta
+
+def invalidar_ocupacion(fecha):
+    """Descarta la ocupación en caché de un día tras reservar o modificar una cita"""
+    primero, ultimo = ventana_reservas()
+    with _OCUPACION_LOCK:
+        _OCUPACION_DIAS.pop(fecha, None)
+        if primero <= fecha <= ultimo:
+            _GENERACION_OCUPACION[fecha] = _GENERACION_OCUPACION.get(fecha, 0) + 1
+
+def reservar_cita(nombre, telefono, email, tipo_cita, fecha, hora):
+    """Inserta una cita de forma atómica.
+    
+    Devuelve la cita creada o None si la franja ya estaba ocupada. El índice
+    único sobre las citas pendientes hace que la comprobación y la inserción
+    sean una sola operación en la base de datos.
+    """
+    nueva_cita = Cita(
+        nombre=nombre,
+        telefono=telefono,
+        email=email,
+        tipo_cita=tipo_cita,
+        fecha=fecha,
+        hora=hora
+    )
+    
+    with acceso_db():
+        try:
+            db.session.add(nueva_cita)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            # Solo es una franja ocupada si realmente hay otra cita pendiente en ella
+            if Cita.query.filter_by(fecha=fecha, hora=hora, estado='pendiente').first() is None:
+                raise
+            invalidar_ocupacion(fecha)
+            return None
+        
+        # Tras confirmar, la cita se vuelve a leer de la base de datos
+        invalidar_ocupacion(fecha)
+        CONTADORES_CITAS.registrar_alta(nueva_cita.estado, nueva_cita.tipo_cita, nueva_cita.num_cambio)
+        CANAL_EVENTOS.publicar('cita_creada', cita_a_dict(nueva_cita), clave_evento_cita(nueva_cita))
+    return nueva_cita
+
 def get_horas_disponibles(fecha_str):
     """Obtiene las horas disponibles para una fecha específica"""
     fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+    ocupacion = get_ocupacion_dia(fecha)
+    
+    return [
+        hora for indice, hora in enumerate(get_franjas_dia(fecha))
+        if not ocupacion >> indice & 1
+    ]
+
+# Máximo de días que se pueden pedir de una vez a /api/disponibilidad
+MAX_DIAS_DISPONIBILIDAD = 62
+
+def get_disponibilidad_rango(desde, dias, incluir_horas=False):
+    """Obtiene los huecos libres de cada día laborable de un rango con una sola consulta.
     
-    # Horarios de la clínica: 9:00-18:00 (L-V), 9:00-14:00 (S)
-    es_sabado = fecha.weekday() == 5
-    hora_fin = 14 if es_sabado else 18
+    El rango se recorta a la ventana de reservas: fuera de ella no hay nada que reservar.
+    """
+    primero, ultimo = ventana_reservas()
+    hasta = min(desde + timedelta(days=dias - 1), ultimo)
+    desde = max(desde, primero)
+    dias = (hasta - desde).days + 1
+    if dias < 1:
+        return []
+    ahora = time.monotonic()
+    generaciones = {desde + timedelta(days=i): generacion_ocupacion(desde + timedelta(days=i)) for i in range(dias)}
     
-    horas = []
-    hora_actual = 9
+    # Franjas reservadas (fecha, hora) del rango agrupadas en la base de datos
+    with acceso_db():
+        franjas_ocupadas = db.session.query(Cita.fecha, Cita.hora).filter(
+            Cita.estado == 'pendiente',
+            Cita.fecha >= desde,
+            Cita.fecha <= hasta
+        ).group_by(Cita.fecha, Cita.hora).all()
     
-    while hora_actual < hora_fin:
-        hora_str = f"{hora_actual:02d}:00"
-        hora_media_str = f"{hora_actual:02d}:30"
-        
-        # Verificar si la hora está ocupada
-        cita_existente = Cita.query.filter_by(
-            fecha=fecha,
-            hora=hora_str,
-            estado='pendiente'
-        ).first()
-        
-        if not cita_existente:
-            horas.append(hora_str)
-        
-        # Verificar la media hora
-        cita_existente_media = Cita.query.filter_by(
-            fecha=fecha,
-            hora=hora_media_str,
-            estado='pendiente'
-        ).first()
+    ocupacion_por_dia = {}
+    for fecha, hora in franjas_ocupadas:
+        indice = _indice_franja(hora)
+        if indice is not None:
+            ocupacion_por_dia[fecha] = ocupacion_por_dia.get(fecha, 0) | 1 << indice
+    
+    resultado = []
+    for i in range(dias):
+        fecha = desde + timedelta(days=i)
+        # Excluir domingos (6 = domingo)
+        if fecha.weekday() == 6:
+            continue
         
-        if not cita_existente_media:
-            horas.append(hora_media_str)
+        ocupacion = ocupacion_por_dia.get(fecha, 0)
+        # Aprovechar la consulta para refrescar la caché de ocupación de cada día
+        guardar_ocupacion(fecha, ocupacion, ahora, generaciones[fecha])
         
-        hora_actual += 1
+        franjas = get_franjas_dia(fecha)
+        horas = [hora for indice, hora in enumerate(franjas) if not ocupacion >> indice & 1]
+        dia = {
+            'fecha': fecha.strftime('%Y-%m-%d'),
+            'libres': len(horas),
+            'total': len(franjas)
+        }
+        if incluir_horas:
+            dia['horas'] = horas
+        resultado.append(dia)
     
-    return horas
+    return resultado
 
 @app.route('/api/dias-disponibles')
 def api_dias_disponibles():
     """API para obtener días disponibles"""
-    dias = get_dias_disponibles()
+    try:
+        dias = get_dias_disponibles()
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     return jsonify({'dias': dias})
 
 @app.route('/api/horas-disponibles/<fecha>')
 def api_horas_disponibles(fecha):
     """API para obtener horas disponibles para una fecha"""
-    horas = get_horas_disponibles(fecha)
+    try:
+        horas = get_horas_disponibles(fecha)
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     return jsonify({'horas': horas})
 
+@app.route('/api/disponibilidad')
+def api_disponibilidad():
+    """API para obtener los huecos libres de varios días de una vez"""
+    try:
+        desde_str = request.args.get('desde')
+        if desde_str:
+            desde = datetime.strptime(desde_str, '%Y-%m-%d').date()
+        else:
+            desde = datetime.now().date() + timedelta(days=1)
+        dias = min(max(int(request.args.get('dias', 30)), 1), MAX_DIAS_DISPONIBILIDAD)
+        incluir_horas = request.args.get('horas') in ('1', 'true')
+    except ValueError:
+        return jsonify({'error': 'Parámetros de fecha no válidos'}), 400
+    
+    try:
+        return jsonify({'dias': get_disponibilidad_rango(desde, dias, incluir_horas)})
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
+
+def respuesta_franja_ocupada():
+    """Respuesta de las APIs de guardado cuando la hora ya está reservada"""
+    return jsonify({
+        'success': False,
+        'franja_ocupada': True,
+        'error': 'Lo sentimos, esa hora ya no está disponible. Por favor selecciona otra hora.'
+    }), 409
+
 @app.route('/api/guardar-cita', methods=['POST'])
 def api_guardar_cita():
     """API para guardar una cita"""
     try:
         data = request.get_json()
         
-        # Crear nueva cita
-        nueva_cita = Cita(
+        # Crear nueva cita si la hora sigue disponible
+        nueva_cita = reservar_cita(
             nombre=data['nombre'],
             telefono=data['telefono'],
             email=data['email'],
@@ -738,8 +1281,8 @@ def api_guardar_cita():
             hora=data['hora']
         )
         
-        db.session.add(nueva_cita)
-        db.session.commit()
+        if nueva_cita is None:
+            return respuesta_franja_ocupada()
         
         return jsonify({
             'success': True,
@@ -747,6 +1290,8 @@ def api_guardar_cita():
             'mensaje': 'Cita guardada exitosamente'
         })
         
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -760,8 +1305,8 @@ def api_guardar_cita_chat():
     try:
         data = request.get_json()
         
-        # Crear nueva cita
-        nueva_cita = Cita(
+        # Crear nueva cita si la hora sigue disponible
+        nueva_cita = reservar_cita(
             nombre=data['nombre'],
             telefono=data['telefono'],
             email=data['email'],
@@ -770,8 +1315,8 @@ def api_guardar_cita_chat():
             hora=data['hora']
         )
         
-        db.session.add(nueva_cita)
-        db.session.commit()
+        if nueva_cita is None:
+            return respuesta_franja_ocupada()
         
         return jsonify({
             'success': True,
@@ -779,6 +1324,8 @@ def api_guardar_cita_chat():
             'mensaje': f'¡Perfecto! Tu cita ha sido programada exitosamente para el {data["fecha"]} a las {data["hora"]}. Recibirás una confirmación por email. Tu número de cita es #{nueva_cita.id}.'
         })
         
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -790,24 +1337,42 @@ def api_guardar_cita_chat():
 def health():
     return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
 
+@app.route('/metrics')
+def metrics():
+    """Métricas de este proceso en el formato de texto de Prometheus"""
+    return Response(METRICAS.exportar(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/download-database')
 def download_database():
     """Descarga la base de datos SQLite"""
     try:
         from flask import send_file
-        import os
         
-        db_path = 'citas.db'
+        db_path = db.engine.url.database
         
-        if not os.path.exists(db_path):
+        if not db_path or not os.path.exists(db_path):
             return jsonify({'error': 'Base de datos no encontrada'}), 404
         
-        return send_file(
-            db_path,
+        # Con WAL parte de los datos puede estar aún en el archivo -wal: se
+        # descarga una copia consistente hecha con la API de backup de SQLite
+        descriptor, copia_path = tempfile.mkstemp(suffix='.db')
+        os.close(descriptor)
+        origen = sqlite3.connect(db_path)
+        copia = sqlite3.connect(copia_path)
+        try:
+            origen.backup(copia)
+        finally:
+            copia.close()
+            origen.close()
+        
+        respuesta = send_file(
+            copia_path,
             as_attachment=True,
             download_name=f'citas_database_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db',
             mimetype='application/octet-stream'
         )
+        respuesta.call_on_close(lambda: os.remove(copia_path))
+        return respuesta
         
     except Exception as e:
         return jsonify({'error': f'Error al descargar la base de datos: {str(e)}'}), 500
@@ -816,17 +1381,12 @@ def download_database():
 def database_stats():
     """Obtiene estadísticas de la base de datos"""
     try:
-        total_citas = Cita.query.count()
-        citas_pendientes = Cita.query.filter_by(estado='pendiente').count()
-        citas_confirmadas = Cita.query.filter_by(estado='confirmada').count()
-        citas_canceladas = Cita.query.filter_by(estado='cancelada').count()
-        
-        # Estadísticas por tipo de cita
-        revisiones = Cita.query.filter_by(tipo_cita='revision').count()
-        padecimientos = Cita.query.filter_by(tipo_cita='padecimiento').count()
-        
-        # Últimas 5 citas
-        ultimas_citas = Cita.query.order_by(Cita.fecha_creacion.desc()).limit(5).all()
+        with acceso_db():
+            # Totales por estado y tipo desde los contadores en memoria
+            estadisticas = CONTADORES_CITAS.resumen()
+            
+            # Últimas 5 citas (el id crece con la fecha de creación y usa la clave primaria)
+            ultimas_citas = Cita.query.order_by(Cita.id.desc()).limit(5).all()
         ultimas_citas_data = []
         for cita in ultimas_citas:
             ultimas_citas_data.append({
@@ -839,94 +1399,360 @@ def database_stats():
                 'fecha_creacion': cita.fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
             })
         
-        return jsonify({
-            'total_citas': total_citas,
-            'citas_pendientes': citas_pendientes,
-            'citas_confirmadas': citas_confirmadas,
-            'citas_canceladas': citas_canceladas,
-            'revisiones': revisiones,
-            'padecimientos': padecimientos,
-            'ultimas_citas': ultimas_citas_data
-        })
+        estadisticas['ultimas_citas'] = ultimas_citas_data
+        return jsonify(estadisticas)
         
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     except Exception as e:
         return jsonify({'error': f'Error al obtener estadísticas: {str(e)}'}), 500
 
+# Exportación CSV por bloques
+CABECERA_CSV = ['ID', 'Nombre', 'Teléfono', 'Email', 'Tipo de Cita',
+                'Fecha', 'Hora', 'Estado', 'Fecha de Creación']
+FILAS_POR_BLOQUE_CSV = 1000
+
+def consulta_exportacion(args):
+    """Consulta de las columnas a exportar, de la más reciente a la más antigua.
+    
+    Se leen solo las columnas necesarias (sin objetos del ORM) y por bloques
+    con un cursor de servidor, de modo que la memoria no crece con la tabla.
+    """
+    consulta = db.session.query(
+        Cita.id, Cita.nombre, Cita.telefono, Cita.email, Cita.tipo_cita,
+        Cita.fecha, Cita.hora, Cita.estado, Cita.fecha_creacion
+    )
+    return filtrar_citas(consulta, args).order_by(Cita.id.desc()).execution_options(
+        yield_per=FILAS_POR_BLOQUE_CSV
+    )
+
+def fila_csv(fila):
+    """Convierte una fila de la consulta de exportación en una fila del CSV"""
+    cita_id, nombre, telefono, email, tipo_cita, fecha, hora, estado, fecha_creacion = fila
+    return [
+        cita_id,
+        nombre,
+        telefono,
+        email,
+        'Revisión General' if tipo_cita == 'revision' else 'Padecimiento',
+        fecha.strftime('%d/%m/%Y'),
+        hora,
+        estado,
+        fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
+    ]
+
+def generar_csv(filas):
+    """Genera el CSV en bloques de texto a medida que se leen las filas"""
+    bloque = StringIO()
+    escritor = csv.writer(bloque)
+    escritor.writerow(CABECERA_CSV)
+    
+    for numero, fila in enumerate(filas, 1):
+        escritor.writerow(fila_csv(fila))
+        if numero % FILAS_POR_BLOQUE_CSV == 0:
+            yield bloque.getvalue()
+            bloque.seek(0)
+            bloque.truncate(0)
+    
+    yield bloque.getvalue()
+
 @app.route('/export-csv')
 def export_csv():
-    """Exporta la base de datos a CSV"""
+    """Exporta la base de datos a CSV (admite los filtros desde, hasta, estado y tipo_cita)"""
     try:
-        import csv
-        from io import StringIO
-        from flask import Response
-        
-        # Obtener todas las citas
-        citas = Cita.query.order_by(Cita.fecha_creacion.desc()).all()
-        
-        # Crear CSV en memoria
-        si = StringIO()
-        cw = csv.writer(si)
-        
-        # Escribir encabezados
-        cw.writerow(['ID', 'Nombre', 'Teléfono', 'Email', 'Tipo de Cita', 
-                     'Fecha', 'Hora', 'Estado', 'Fecha de Creación'])
-        
-        # Escribir datos
-        for cita in citas:
-            tipo_cita = 'Revisión General' if cita.tipo_cita == 'revision' else 'Padecimiento'
-            cw.writerow([
-                cita.id,
-                cita.nombre,
-                cita.telefono,
-                cita.email,
-                tipo_cita,
-                cita.fecha.strftime('%d/%m/%Y'),
-                cita.hora,
-                cita.estado,
-                cita.fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
-            ])
-        
-        # Crear respuesta
-        output = si.getvalue()
-        si.close()
-        
-        return Response(
-            output,
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=citas_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-        )
+        consulta = consulta_exportacion(request.args)
+    except ValueError:
+        return jsonify({'error': 'Parámetros de fecha no válidos'}), 400
+    
+    # La respuesta se envía por partes mientras se recorre la consulta
+    return Response(
+        stream_with_context(generar_csv(consulta)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=citas_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
+    )
+
+# Paginación de /api/citas
+CITAS_POR_PAGINA = 500
+MAX_CITAS_POR_PAGINA = 1000
+
+# Estados válidos de una cita
+ESTADOS_CITA = ('pendiente', 'confirmada', 'cancelada')
+
+def version_citas():
+    """Versión actual de las citas: el último número de cambio (consulta sobre índice)"""
+    return db.session.query(db.func.max(Cita.num_cambio)).scalar() or 0
+
+def cita_a_dict(cita):
+    """Serializa una cita tal y como la devuelve /api/citas"""
+    return {
+        'id': cita.id,
+        'nombre': cita.nombre,
+        'telefono': cita.telefono,
+        'email': cita.email,
+        'tipo_cita': cita.tipo_cita,
+        'fecha': cita.fecha.strftime('%d/%m/%Y'),
+        'hora': cita.hora,
+        'estado': cita.estado,
+        'fecha_creacion': cita.fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
+    }
+
+def codificar_cursor(cita):
+    """Cursor de paginación: posición (fecha, hora, id) de la última cita devuelta"""
+    return f"{cita.fecha.strftime('%Y-%m-%d')},{cita.hora},{cita.id}"
+
+def decodificar_cursor(cursor):
+    """Convierte un cursor en (fecha, hora, id); lanza ValueError si no es válido"""
+    fecha_str, hora, id_str = cursor.split(',')
+    return datetime.strptime(fecha_str, '%Y-%m-%d').date(), hora, int(id_str)
+
+def filtrar_citas(consulta, args):
+    """Aplica los filtros de rango de fechas, estado y tipo de cita de la petición"""
+    if args.get('desde'):
+        consulta = consulta.filter(Cita.fecha >= datetime.strptime(args['desde'], '%Y-%m-%d').date())
+    if args.get('hasta'):
+        consulta = consulta.filter(Cita.fecha <= datetime.strptime(args['hasta'], '%Y-%m-%d').date())
+    if args.get('estado'):
+        consulta = consulta.filter(Cita.estado == args['estado'])
+    if args.get('tipo_cita'):
+        consulta = consulta.filter(Cita.tipo_cita == args['tipo_cita'])
+    return consulta
+
+def cambios_citas(consulta, since, version):
+    """Citas creadas o modificadas desde una versión dada.
+    
+    El cliente combina las citas por id. Se devuelven todas las citas
+    cambiadas, cumplan o no los filtros: las que ya no los cumplen (por
+    ejemplo, una cita cancelada al filtrar por pendientes) llevan
+    ``fuera_de_filtro`` para que el cliente las quite. Si hay demasiados
+    cambios o la versión no es de esta base de datos (por ejemplo, una marca
+    de tiempo de versiones anteriores) se pide una recarga completa.
+    """
+    if since > version:
+        return {'citas': [], 'recargar': True, 'version': version}
+    
+    citas = Cita.query.filter(Cita.num_cambio > since).order_by(
+        Cita.num_cambio
+    ).limit(MAX_CITAS_POR_PAGINA + 1).all()
+    
+    if len(citas) > MAX_CITAS_POR_PAGINA:
+        return {'citas': [], 'recargar': True, 'version': version}
+    
+    # Cuáles de las citas cambiadas cumplen los filtros de la petición
+    en_filtro = {
+        cita_id for (cita_id,) in
+        consulta.with_entities(Cita.id).filter(Cita.id.in_([cita.id for cita in citas])).all()
+    } if citas else set()
+    cambios = []
+    for cita in citas:
+        datos = cita_a_dict(cita)
+        if cita.id not in en_filtro:
+            datos['fuera_de_filtro'] = True
+        cambios.append(datos)
+    
+    return {'citas': cambios, 'delta': True, 'version': version}
+
+@app.route('/api/citas/<int:cita_id>/estado', methods=['POST'])
+def api_cambiar_estado_cita(cita_id):
+    """API para cambiar el estado de una cita ('pendiente', 'confirmada', 'cancelada')"""
+    data = request.get_json(silent=True) or {}
+    estado = data.get('estado')
+    if estado not in ESTADOS_CITA:
+        return jsonify({'success': False, 'error': 'Estado no válido'}), 400
+    
+    try:
+        with acceso_db():
+            cita = db.session.get(Cita, cita_id)
+            if cita is None:
+                return jsonify({'success': False, 'error': 'Cita no encontrada'}), 404
+            
+            estado_anterior = cita.estado
+            try:
+                cita.estado = estado
+                cita.fecha_modificacion = datetime.utcnow()
+                db.session.commit()
+            except IntegrityError:
+                # Volver a 'pendiente' una franja que ya ha reservado otra persona
+                db.session.rollback()
+                return respuesta_franja_ocupada()
+            
+            invalidar_ocupacion(cita.fecha)
+            CONTADORES_CITAS.registrar_cambio(cita.tipo_cita, estado_anterior, estado, cita.num_cambio)
+            datos_cita = cita_a_dict(cita)
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
+    
+    CANAL_EVENTOS.publicar('cita_actualizada', datos_cita, clave_evento_cita(cita))
+    return jsonify({'success': True, 'cita': datos_cita})
+
+def clave_evento_cita(cita):
+    """Clave de un evento de cita: el mismo cambio tiene la misma clave en todos los workers"""
+    return (cita.id, cita.num_cambio)
+
+# Cada cuántos segundos se buscan cambios guardados por otros workers (0 = nunca)
+EVENTOS_SINCRONIZACION = float(os.getenv('EVENTOS_SINCRONIZACION', '3'))
+_VIGILANTE_EVENTOS = None
+_VIGILANTE_LOCK = threading.Lock()
+
+def vigilar_cambios_citas():
+    """Publica en el canal local las citas que otros workers han creado o modificado.
+    
+    Solo consulta la base de datos mientras hay suscriptores conectados a este
+    proceso; los cambios que ya publicó el propio proceso se descartan por clave.
+    """
+    with app.app_context():
+        # Los cambios anteriores al arranque no se publican
+        ultimo = version_citas()
+        db.session.remove()
         
-    except Exception as e:
-        return jsonify({'error': f'Error al exportar CSV: {str(e)}'}), 500
+        while True:
+            time.sleep(EVENTOS_SINCRONIZACION)
+            if CANAL_EVENTOS.suscriptores == 0:
+                continue
+            try:
+                consulta = Cita.query.filter(Cita.num_cambio > ultimo).order_by(Cita.num_cambio)
+                for cita in consulta.limit(MAX_CITAS_POR_PAGINA).all():
+                    tipo = 'cita_creada' if cita.num_cambio == cita.num_cambio_alta else 'cita_actualizada'
+                    CANAL_EVENTOS.publicar(tipo, cita_a_dict(cita), clave_evento_cita(cita))
+                    ultimo = cita.num_cambio
+            except OperationalError as e:
+                registro.warning('sincronizacion_eventos_fallida', extra={'datos': {'error': str(e)}})
+            finally:
+                db.session.remove()
+
+def iniciar_vigilante_eventos():
+    """Arranca el hilo de sincronización de eventos de este proceso la primera vez que se necesita"""
+    global _VIGILANTE_EVENTOS
+    if EVENTOS_SINCRONIZACION <= 0 or _VIGILANTE_EVENTOS is not None:
+        return
+    with _VIGILANTE_LOCK:
+        if _VIGILANTE_EVENTOS is None:
+            _VIGILANTE_EVENTOS = threading.Thread(target=vigilar_cambios_citas, daemon=True)
+            _VIGILANTE_EVENTOS.start()
+
+@app.route('/api/eventos')
+def api_eventos():
+    """Flujo Server-Sent Events con las citas nuevas y los cambios de estado"""
+    # El hueco se ocupa ya aquí: el generador no empieza a ejecutarse hasta que se envía la respuesta
+    liberar = CANAL_EVENTOS.reservar(EVENTOS_MAX_SUSCRIPTORES)
+    if liberar is None:
+        return jsonify({'error': 'Demasiadas conexiones abiertas'}), 503
+    
+    iniciar_vigilante_eventos()
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    respuesta = Response(
+        CANAL_EVENTOS.escuchar(ultimo_id, latido=EVENTOS_LATIDO, duracion_maxima=EVENTOS_DURACION_MAXIMA,
+                               liberar=liberar),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    respuesta.call_on_close(liberar)
+    return respuesta
 
 @app.route('/api/citas')
 def api_citas():
-    """API para obtener todas las citas"""
+    """API para obtener las citas por páginas.
+    
+    Admite los filtros ``desde``/``hasta`` (YYYY-MM-DD), ``estado`` y
+    ``tipo_cita``. La paginación es por cursor sobre (fecha, hora, id): cada
+    respuesta incluye ``siguiente_cursor`` (None en la última página) y, con
+    ``total=1``, el número total de citas que cumplen los filtros.
+    
+    Cada respuesta lleva la versión de los datos (también como ETag): con
+    ``If-None-Match`` se responde 304 si no hay cambios y con ``since=<versión>``
+    solo se devuelven las citas creadas o modificadas desde entonces.
+    """
     try:
-        citas = Cita.query.order_by(Cita.fecha, Cita.hora).all()
-        citas_data = []
-        
-        for cita in citas:
-            citas_data.append({
-                'id': cita.id,
-                'nombre': cita.nombre,
-                'telefono': cita.telefono,
-                'email': cita.email,
-                'tipo_cita': cita.tipo_cita,
-                'fecha': cita.fecha.strftime('%d/%m/%Y'),
-                'hora': cita.hora,
-                'estado': cita.estado,
-                'fecha_creacion': cita.fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
-            })
-        
-        return jsonify({'citas': citas_data})
-        
+        consulta = filtrar_citas(Cita.query, request.args)
+        limite = min(max(int(request.args.get('limite', CITAS_POR_PAGINA)), 1), MAX_CITAS_POR_PAGINA)
+        cursor = request.args.get('cursor')
+        since = int(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'error': 'Parámetros de consulta no válidos'}), 400
+    
+    try:
+        with acceso_db():
+            return respuesta_citas(consulta, limite, cursor, since)
+    except BaseDatosOcupada:
+        return respuesta_servidor_ocupado()
     except Exception as e:
         return jsonify({'error': f'Error al obtener citas: {str(e)}'}), 500
 
+def respuesta_citas(consulta, limite, cursor, since):
+    """Respuesta de /api/citas: 304, cambios desde una versión o una página de citas"""
+    # Petición condicional: si nada ha cambiado basta con la consulta de la versión
+    version = version_citas()
+    etag = str(version)
+    # Comparación débil: con compresión el cliente devuelve el ETag como W/"..."
+    if request.if_none_match.contains_weak(etag):
+        respuesta = app.response_class(status=304)
+        respuesta.set_etag(etag)
+        return respuesta
+    
+    if since is not None:
+        respuesta = jsonify(cambios_citas(consulta, since, version))
+        respuesta.set_etag(etag)
+        return respuesta
+    
+    total = consulta.count() if request.args.get('total') in ('1', 'true') else None
+    
+    if cursor:
+        try:
+            fecha, hora, cita_id = decodificar_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Cursor no válido'}), 400
+        consulta = consulta.filter(db.or_(
+            Cita.fecha > fecha,
+            db.and_(Cita.fecha == fecha, db.or_(
+                Cita.hora > hora,
+                db.and_(Cita.hora == hora, Cita.id > cita_id)
+            ))
+        ))
+    
+    # Se pide una cita de más para saber si hay otra página
+    citas = consulta.order_by(Cita.fecha, Cita.hora, Cita.id).limit(limite + 1).all()
+    hay_mas = len(citas) > limite
+    citas = citas[:limite]
+    
+    respuesta = {
+        'citas': [cita_a_dict(cita) for cita in citas],
+        'siguiente_cursor': codificar_cursor(citas[-1]) if hay_mas else None,
+        'version': version
+    }
+    if total is not None:
+        respuesta['total'] = total
+    
+    respuesta = jsonify(respuesta)
+    respuesta.set_etag(etag)
+    return respuesta
+
+def actualizar_esquema():
+    """Añade a bases de datos ya existentes las columnas e índices nuevos de la tabla de citas"""
+    columnas = {columna['name'] for columna in inspect(db.engine).get_columns('cita')}
+    if 'fecha_modificacion' not in columnas:
+        with db.engine.begin() as conexion:
+            conexion.execute(text('ALTER TABLE cita ADD COLUMN fecha_modificacion DATETIME'))
+            conexion.execute(text('UPDATE cita SET fecha_modificacion = COALESCE(fecha_creacion, CURRENT_TIMESTAMP)'))
+    if 'num_cambio' not in columnas:
+        with db.engine.begin() as conexion:
+            conexion.execute(text('ALTER TABLE cita ADD COLUMN num_cambio INTEGER'))
+            # Las citas ya guardadas cuentan como cambios anteriores a cualquier otro
+            conexion.execute(text('UPDATE cita SET num_cambio = id'))
+    if 'num_cambio_alta' not in columnas:
+        with db.engine.begin() as conexion:
+            # Las citas ya guardadas no se publican como nuevas
+            conexion.execute(text('ALTER TABLE cita ADD COLUMN num_cambio_alta INTEGER'))
+    
+    for indice in Cita.__table__.indexes:
+        try:
+            indice.create(db.engine, checkfirst=True)
+        except (IntegrityError, OperationalError) as e:
+            # Ya hay franjas con varias citas pendientes: hay que revisarlas a mano
+            registro.warning('indice_no_creado', extra={'datos': {'indice': indice.name, 'error': str(e)}})
+
 # Crear la base de datos
 with app.app_context():
     db.create_all()
+    actualizar_esquema()
 
 if __name__ == '__main__':
     # Configuración para desarrollo local
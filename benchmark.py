@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+Banco de pruebas de carga y latencia de la API
+
+Siembra bases de datos con 1.000, 100.000 y 1.000.000 de citas, recorre las
+mismas conversaciones que hace index.html (saludo → tratamientos → reserva →
+confirmación) y consulta /api/horas-disponibles, /api/citas y /export-csv.
+Para cada operación informa del rendimiento y de las latencias p50/p95/p99
+en JSON:
+
+    python benchmark.py --citas 1000 100000 --iteraciones 200 --salida resultados.json
+    python benchmark.py --gunicorn --concurrencia 16
+    python benchmark.py --estados
+
+Con --estados mide solo la máquina de estados del chat (obtener_respuesta)
+con un mensaje representativo de cada estado, sin base de datos ni HTTP.
+
+Por defecto usa el cliente de pruebas de Flask dentro de un proceso aparte
+(sin red); con --gunicorn arranca un servidor local con gunicorn.conf.py y
+mide por HTTP. Las bases de datos sembradas se guardan en --directorio y se
+reutilizan; cada ejecución trabaja sobre una copia.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+TAMANOS_POR_DEFECTO = [1000, 100000, 1000000]
+HORAS = [f'{hora:02d}:{minuto:02d}' for hora in range(9, 18) for minuto in (0, 30)]
+
+# Mensajes que envía index.html desde el saludo hasta pedir la fecha de la cita
+CONVERSACION = [
+    'hola',
+    'información sobre tratamientos',
+    'ortodoncia',
+    'quiero agendar una cita',
+    'no',
+    'revisión general'
+]
+
+# Códigos que forman parte del funcionamiento normal (409: la franja se ha ocupado)
+ESTADOS_ESPERADOS = {200, 304, 409}
+
+
+def sembrar(ruta, total, semilla=0):
+    """Crea (si no existe ya) una base de datos con `total` citas repartidas en tres años.
+
+    Las citas pasadas están confirmadas o canceladas; en los próximos 60 días
+    cada franja tiene como mucho una cita pendiente, como exige el índice único,
+    y se deja libre la mitad de las franjas para que las reservas no fallen.
+    """
+    conexion = sqlite3.connect(ruta)
+    existentes = conexion.execute('SELECT COUNT(*) FROM cita').fetchone()[0]
+    if existentes >= total:
+        conexion.close()
+        return existentes
+
+    rng = random.Random(semilla)
+    hoy = date.today()
+    inicio = hoy - timedelta(days=3 * 365)
+    dias = (hoy + timedelta(days=60) - inicio).days
+    max_pendientes = 60 * len(HORAS) // 2
+    pendientes = set()
+
+    def filas():
+        for numero in range(existentes, total):
+            fecha = inicio + timedelta(days=rng.randrange(dias))
+            hora = rng.choice(HORAS)
+            if fecha > hoy and ((fecha, hora) in pendientes or len(pendientes) >= max_pendientes):
+                # Franja futura ya ocupada: la cita pasa a ser del año anterior
+                fecha -= timedelta(days=365)
+            if fecha <= hoy:
+                estado = 'confirmada' if rng.random() < 0.7 else 'cancelada'
+            else:
+                pendientes.add((fecha, hora))
+                estado = 'pendiente'
+            creada = datetime.combine(fecha, datetime.min.time()) - timedelta(days=rng.randrange(1, 30))
+            yield (
+                f'Paciente {numero}', f'+34 600 {numero:06d}', f'paciente{numero}@example.com',
+                'revision' if rng.random() < 0.6 else 'padecimiento',
+                fecha.isoformat(), hora, estado,
+                creada.isoformat(' '), creada.isoformat(' ')
+            )
+
+    # Las franjas pendientes ya guardadas cuentan para el índice único
+    for fecha, hora in conexion.execute("SELECT fecha, hora FROM cita WHERE estado = 'pendiente'"):
+        pendientes.add((date.fromisoformat(fecha), hora))
+
+    with conexion:
+        conexion.executemany(
+            'INSERT INTO cita (nombre, telefono, email, tipo_cita, fecha, hora, estado, '
+            'fecha_creacion, fecha_modificacion, num_cambio, num_cambio_alta) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, '
+            '(SELECT COALESCE(MAX(num_cambio), 0) + 1 FROM cita), (SELECT COALESCE(MAX(num_cambio), 0) + 1 FROM cita))',
+            filas()
+        )
+    conexion.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conexion.execute('ANALYZE')
+    conexion.close()
+    return total
+
+
+class ClientePruebas:
+    """Peticiones con el cliente de pruebas de Flask (en el mismo proceso)"""
+
+    def __init__(self, app):
+        self._cliente = app.test_client()
+
+    def peticion(self, metodo, ruta, datos=None):
+        respuesta = self._cliente.open(ruta, method=metodo, json=datos)
+        cuerpo = respuesta.get_data()
+        respuesta.close()
+        return respuesta.status_code, cuerpo
+
+
+class ClienteHTTP:
+    """Peticiones HTTP a un servidor en marcha"""
+
+    def __init__(self, base):
+        self._base = base
+
+    def peticion(self, metodo, ruta, datos=None):
+        cuerpo = json.dumps(datos).encode('utf-8') if datos is not None else None
+        solicitud = urllib.request.Request(self._base + ruta, data=cuerpo, method=metodo)
+        if cuerpo is not None:
+            solicitud.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(solicitud, timeout=120) as respuesta:
+                return respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Registro:
+    """Latencias y códigos de estado por operación"""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.estados = defaultdict(Counter)
+
+    def medir(self, cliente, operacion, metodo, ruta, datos=None):
+        inicio = time.perf_counter()
+        estado, cuerpo = cliente.peticion(metodo, ruta, datos)
+        self.anotar(operacion, time.perf_counter() - inicio, estado)
+        return estado, cuerpo
+
+    def anotar(self, operacion, segundos, estado):
+        # list.append y Counter por clave son seguros entre hilos en CPython
+        self.latencias[operacion].append(segundos)
+        self.estados[operacion][estado] += 1
+
+
+def percentil(ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not ordenados:
+        return None
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def flujo_reserva(cliente, registro, rng):
+    """Conversación completa de index.html hasta guardar la cita"""
+    inicio = time.perf_counter()
+    estado = 'inicial'
+    datos_cita = {}
+    for mensaje in CONVERSACION:
+        codigo, cuerpo = registro.medir(cliente, 'POST /chat', 'POST', '/chat', {
+            'message': mensaje, 'estado': estado, 'datos_cita': datos_cita
+        })
+        if codigo != 200:
+            registro.anotar('flujo_reserva', time.perf_counter() - inicio, codigo)
+            return
+        respuesta = json.loads(cuerpo)
+        estado = respuesta['estado']
+        datos_cita = respuesta.get('datos_cita') or {}
+
+    # Calendario del chat: días con huecos y horas libres del día elegido
+    codigo, cuerpo = registro.medir(cliente, 'GET /api/disponibilidad', 'GET', '/api/disponibilidad?dias=30')
+    dias = [dia['fecha'] for dia in json.loads(cuerpo)['dias'] if dia['libres']] if codigo == 200 else []
+    if not dias:
+        registro.anotar('flujo_reserva', time.perf_counter() - inicio, codigo if codigo != 200 else 409)
+        return
+    fecha = rng.choice(dias)
+    codigo, cuerpo = registro.medir(cliente, 'GET /api/horas-disponibles', 'GET', f'/api/horas-disponibles/{fecha}')
+    horas = json.loads(cuerpo)['horas'] if codigo == 200 else []
+    if not horas:
+        registro.anotar('flujo_reserva', time.perf_counter() - inicio, codigo if codigo != 200 else 409)
+        return
+
+    numero = rng.randrange(10 ** 6)
+    datos_cita.update({
+        'fecha': fecha,
+        'hora': rng.choice(horas),
+        'nombre': f'Benchmark {numero}',
+        'telefono': f'+34 611 {numero:06d}',
+        'email': f'benchmark{numero}@example.com'
+    })
+    codigo, _ = registro.medir(cliente, 'POST /api/guardar-cita-chat', 'POST', '/api/guardar-cita-chat', datos_cita)
+    registro.anotar('flujo_reserva', time.perf_counter() - inicio, codigo)
+
+
+def consultas_panel(cliente, registro, rng):
+    """Lecturas del panel y la administración"""
+    hoy = date.today()
+    dia = hoy + timedelta(days=rng.randrange(1, 30))
+    registro.medir(cliente, 'GET /api/horas-disponibles', 'GET', f'/api/horas-disponibles/{dia.isoformat()}')
+
+    desde = hoy - timedelta(days=rng.randrange(0, 3 * 365))
+    hasta = desde + timedelta(days=30)
+    registro.medir(cliente, 'GET /api/citas (mes)', 'GET',
+                   f'/api/citas?desde={desde.isoformat()}&hasta={hasta.isoformat()}')
+    registro.medir(cliente, 'GET /api/citas (primera página)', 'GET', '/api/citas?limite=500')
+
+
+def exportaciones(cliente, registro, rng):
+    """Exportación CSV de un mes y completa (se lee el cuerpo entero)"""
+    desde = date.today() - timedelta(days=rng.randrange(30, 3 * 365))
+    hasta = desde + timedelta(days=30)
+    registro.medir(cliente, 'GET /export-csv (mes)', 'GET',
+                   f'/export-csv?desde={desde.isoformat()}&hasta={hasta.isoformat()}')
+    registro.medir(cliente, 'GET /export-csv (completa)', 'GET', '/export-csv')
+
+
+def ejecutar(crear_cliente, iteraciones, concurrencia, iteraciones_exportacion, semilla):
+    """Lanza las operaciones con `concurrencia` hilos y devuelve las métricas por operación"""
+    registro = Registro()
+    trabajos = (
+        [(flujo_reserva, i) for i in range(iteraciones)] +
+        [(consultas_panel, iteraciones + i) for i in range(iteraciones)] +
+        [(exportaciones, 2 * iteraciones + i) for i in range(iteraciones_exportacion)]
+    )
+    random.Random(semilla).shuffle(trabajos)
+    clientes = {}
+
+    def trabajo(tarea):
+        funcion, numero = tarea
+        hilo = threading.get_ident()
+        if hilo not in clientes:
+            clientes[hilo] = crear_cliente()
+        funcion(clientes[hilo], registro, random.Random(semilla * 1000003 + numero))
+
+    # Calentamiento: compilar plantillas, llenar cachés y abrir conexiones
+    calentamiento = Registro()
+    flujo_reserva(crear_cliente(), calentamiento, random.Random(semilla))
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        list(ejecutor.map(trabajo, trabajos))
+    duracion = time.perf_counter() - inicio
+
+    resultados = []
+    for operacion, latencias in sorted(registro.latencias.items()):
+        ordenadas = sorted(latencias)
+        estados = registro.estados[operacion]
+        resultados.append({
+            'operacion': operacion,
+            'peticiones': len(ordenadas),
+            'errores': sum(n for codigo, n in estados.items() if codigo not in ESTADOS_ESPERADOS),
+            'estados': {str(codigo): n for codigo, n in sorted(estados.items())},
+            'rendimiento_rps': round(len(ordenadas) / duracion, 2),
+            'p50_ms': round(percentil(ordenadas, 50) * 1000, 3),
+            'p95_ms': round(percentil(ordenadas, 95) * 1000, 3),
+            'p99_ms': round(percentil(ordenadas, 99) * 1000, 3),
+            'max_ms': round(ordenadas[-1] * 1000, 3)
+        })
+    return {'duracion_s': round(duracion, 3), 'operaciones': resultados}
+
+
+# Mensaje representativo y datos de la cita para cada estado de la conversación
+# (la confirmación se rechaza para no escribir en la base de datos)
+MENSAJES_POR_ESTADO = {
+    'inicial': ('¿cuánto dura una ortodoncia invisible?', {}),
+    'inicial_aproximado': ('hacéis ortodonsia para adultos?', {}),
+    'en_menu_tratamientos': ('me interesa la endodoncia', {}),
+    'preguntando_tratamiento_abierto': ('no, es mi primera vez', {}),
+    'preguntando_tipo_cita': ('revisión general periódica', {}),
+    'solicitando_detalle_padecimiento': ('me duele una muela desde ayer', {}),
+    'solicitando_fecha': ('mañana', {'tipo_cita': 'revision'}),
+    'solicitando_hora': ('vale', {'tipo_cita': 'revision', 'fecha': '2030-01-07'}),
+    'solicitando_nombre': ('Ana Pérez', {'tipo_cita': 'revision', 'fecha': '2030-01-07', 'hora': '10:00'}),
+    'solicitando_telefono': ('600123456', {'tipo_cita': 'revision', 'fecha': '2030-01-07', 'hora': '10:00', 'nombre': 'Ana'}),
+    'solicitando_email': ('ana@example.com', {'tipo_cita': 'revision', 'fecha': '2030-01-07', 'hora': '10:00',
+                                              'nombre': 'Ana', 'telefono': '600123456'}),
+    'confirmando_cita': ('no, mejor otro día', {}),
+}
+
+
+def medir_estados(iteraciones):
+    """Latencia de obtener_respuesta para cada estado de la conversación"""
+    from app import obtener_respuesta
+
+    resultados = []
+    for nombre, (mensaje, datos_cita) in MENSAJES_POR_ESTADO.items():
+        estado = 'inicial' if nombre == 'inicial_aproximado' else nombre
+        latencias = []
+        for _ in range(iteraciones):
+            datos = dict(datos_cita)
+            inicio = time.perf_counter()
+            obtener_respuesta(mensaje, estado, datos)
+            latencias.append(time.perf_counter() - inicio)
+        ordenadas = sorted(latencias)
+        resultados.append({
+            'estado': nombre,
+            'llamadas': len(ordenadas),
+            'p50_us': round(percentil(ordenadas, 50) * 1e6, 2),
+            'p99_us': round(percentil(ordenadas, 99) * 1e6, 2),
+            'max_us': round(ordenadas[-1] * 1e6, 2)
+        })
+    return resultados
+
+
+def preparar_base_datos(directorio, total, semilla):
+    """Ruta de una copia de trabajo de la base de datos sembrada con `total` citas"""
+    sembrada = os.path.abspath(os.path.join(directorio, f'citas_{total}.db'))
+    trabajo = os.path.abspath(os.path.join(directorio, f'citas_{total}.trabajo.db'))
+    # El esquema lo crea la propia aplicación al importarse
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--interno-sembrar', str(total), '--semilla', str(semilla)],
+        env=dict(os.environ, DATABASE_URL=f'sqlite:///{sembrada}'),
+        check=True
+    )
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists(trabajo + sufijo):
+            os.remove(trabajo + sufijo)
+    shutil.copyfile(sembrada, trabajo)
+    return trabajo
+
+
+def arrancar_gunicorn(ruta, puerto):
+    """Arranca gunicorn con la configuración de producción y espera a /health"""
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn.conf.py'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, DATABASE_URL=f'sqlite:///{ruta}', PORT=str(puerto)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    cliente = ClienteHTTP(f'http://127.0.0.1:{puerto}')
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            if cliente.peticion('GET', '/health')[0] == 200:
+                return proceso
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError('gunicorn no respondió en 60 segundos')
+
+
+def medir_tamano(args, total):
+    """Siembra, arranca el servidor si hace falta y mide un tamaño de base de datos"""
+    ruta = preparar_base_datos(args.directorio, total, args.semilla)
+    parametros = [
+        '--iteraciones', str(args.iteraciones),
+        '--iteraciones-exportacion', str(args.iteraciones_exportacion),
+        '--concurrencia', str(args.concurrencia),
+        '--semilla', str(args.semilla)
+    ]
+
+    if args.gunicorn:
+        proceso = arrancar_gunicorn(ruta, args.puerto)
+        try:
+            base = f'http://127.0.0.1:{args.puerto}'
+            resultado = ejecutar(lambda: ClienteHTTP(base), args.iteraciones, args.concurrencia,
+                                 args.iteraciones_exportacion, args.semilla)
+        finally:
+            proceso.terminate()
+            proceso.wait()
+    else:
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--interno-medir'] + parametros,
+            env=dict(os.environ, DATABASE_URL=f'sqlite:///{ruta}'),
+            check=True,
+            stdout=subprocess.PIPE
+        )
+        resultado = json.loads(salida.stdout)
+
+    resultado['citas'] = total
+    return resultado
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description='Mide el rendimiento y la latencia de la API')
+    parser.add_argument('--citas', type=int, nargs='+', default=TAMANOS_POR_DEFECTO,
+                        help='Tamaños de las bases de datos sembradas')
+    parser.add_argument('--iteraciones', type=int, default=100,
+                        help='Conversaciones completas y rondas de consultas del panel por tamaño')
+    parser.add_argument('--iteraciones-exportacion', type=int, default=3,
+                        help='Rondas de exportación CSV por tamaño')
+    parser.add_argument('--concurrencia', type=int, default=1, help='Hilos cliente simultáneos')
+    parser.add_argument('--gunicorn', action='store_true', help='Medir contra un gunicorn local por HTTP')
+    parser.add_argument('--puerto', type=int, default=5099, help='Puerto del gunicorn local')
+    parser.add_argument('--directorio', default='benchmark_datos', help='Dónde guardar las bases de datos sembradas')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla para que las ejecuciones sean reproducibles')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto la salida estándar)')
+    parser.add_argument('--estados', action='store_true',
+                        help='Medir solo la máquina de estados del chat (usa --iteraciones × 100 llamadas por estado)')
+    parser.add_argument('--interno-sembrar', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--interno-medir', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argumentos)
+    # Todas las peticiones salen del mismo cliente: con los límites por cliente
+    # se medirían sobre todo respuestas 429 (los subprocesos heredan el entorno)
+    os.environ.setdefault('LIMITES', '0')
+
+    # Subprocesos: la aplicación se importa con DATABASE_URL ya apuntando a la base de datos
+    if args.interno_sembrar is not None:
+        from app import app, db
+        with app.app_context():
+            ruta = db.engine.url.database
+            db.engine.dispose()
+        sembrar(ruta, args.interno_sembrar, args.semilla)
+        return 0
+    if args.interno_medir:
+        from app import app
+        # La salida estándar queda reservada para el JSON de resultados
+        with open(os.devnull, 'w') as nulo, redirect_stdout(nulo):
+            resultado = ejecutar(lambda: ClientePruebas(app), args.iteraciones, args.concurrencia,
+                                 args.iteraciones_exportacion, args.semilla)
+        json.dump(resultado, sys.stdout)
+        return 0
+
+    if args.estados:
+        informe = {
+            'fecha': datetime.now().isoformat(),
+            'modo': 'estados',
+            'python': sys.version.split()[0],
+            'resultados': medir_estados(args.iteraciones * 100)
+        }
+        for resultado in informe['resultados']:
+            print(f"   {resultado['estado']:<34} p50 {resultado['p50_us']:>8.2f} µs  "
+                  f"p99 {resultado['p99_us']:>8.2f} µs", file=sys.stderr)
+        return guardar_informe(informe, args.salida)
+
+    os.makedirs(args.directorio, exist_ok=True)
+    informe = {
+        'fecha': datetime.now().isoformat(),
+        'modo': 'gunicorn' if args.gunicorn else 'cliente_pruebas',
+        'python': sys.version.split()[0],
+        'concurrencia': args.concurrencia,
+        'iteraciones': args.iteraciones,
+        'semilla': args.semilla,
+        'resultados': []
+    }
+    for total in args.citas:
+        print(f"⏱️  Midiendo con {total} citas...", file=sys.stderr)
+        resultado = medir_tamano(args, total)
+        informe['resultados'].append(resultado)
+        for operacion in resultado['operaciones']:
+            print(f"   {operacion['operacion']:<32} p50 {operacion['p50_ms']:>9.2f} ms  "
+                  f"p99 {operacion['p99_ms']:>9.2f} ms  {operacion['rendimiento_rps']:>8.1f} req/s  "
+                  f"errores {operacion['errores']}", file=sys.stderr)
+
+    return guardar_informe(informe, args.salida)
+
+
+def guardar_informe(informe, salida):
+    """Escribe el informe JSON en `salida` o en la salida estándar"""
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultados guardados en {salida}", file=sys.stderr)
+    else:
+        json.dump(informe, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,222 @@
+"""
+Catálogo de contenido del chatbot: respuestas, palabras clave y disparadores.
+
+El contenido vive en un archivo JSON que se compila al cargarse: se validan
+sus referencias y se construyen los autómatas de búsqueda. El resultado
+compilado se guarda en disco indexado por el hash del archivo, de modo que los
+workers que arrancan con el mismo contenido no lo vuelven a compilar.
+
+``CatalogoRecargable`` vigila el archivo y, cuando cambia, compila la nueva
+versión en segundo plano y la sustituye de una sola vez sin reiniciar la
+aplicación; cada petición termina con la versión con la que empezó.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+from intenciones import BuscadorIntenciones
+from registro import obtener_registro
+
+# Cambiar si cambia la estructura de Catalogo o de los autómatas (invalida la caché en disco)
+FORMATO_CACHE = 2
+
+registro = obtener_registro('catalogo')
+
+
+class ErrorCatalogo(ValueError):
+    """El archivo de contenido no es válido"""
+
+
+class Catalogo:
+    """Contenido del chatbot ya compilado"""
+
+    def __init__(self, contenido, version):
+        self.version = version
+        try:
+            self.respuestas = contenido['respuestas']
+            self.palabras_clave = contenido['palabras_clave']
+            self.claves_solicitar_cita = frozenset(contenido['claves_solicitar_cita'])
+            self.claves_menu_tratamientos = frozenset(contenido['claves_menu_tratamientos'])
+            disparadores_agendar_menu = contenido['disparadores_agendar_menu']
+            tratamientos_menu = contenido['tratamientos_menu']
+        except (KeyError, TypeError) as e:
+            raise ErrorCatalogo(f'Falta la sección {e} del catálogo')
+        if not isinstance(self.respuestas, dict) or not isinstance(self.palabras_clave, dict):
+            raise ErrorCatalogo("'respuestas' y 'palabras_clave' deben ser objetos")
+        self._validar()
+
+        self.buscador = BuscadorIntenciones(self.respuestas, self.palabras_clave,
+                                            disparadores_agendar_menu, tratamientos_menu)
+        # Respuestas de /chat ya serializadas con este contenido (se llenan al usarse)
+        self.serializadas = {}
+
+    def _validar(self):
+        if 'default' not in self.respuestas:
+            raise ErrorCatalogo("Falta la respuesta 'default'")
+        for clave, respuesta in self.respuestas.items():
+            if not isinstance(respuesta, (str, dict)) or (isinstance(respuesta, dict) and 'texto' not in respuesta):
+                raise ErrorCatalogo(f"La respuesta '{clave}' debe ser un texto o tener 'texto'")
+        referencias = list(self.palabras_clave.values()) + list(self.claves_solicitar_cita) + list(self.claves_menu_tratamientos)
+        for clave in referencias:
+            if clave not in self.respuestas:
+                raise ErrorCatalogo(f"La clave '{clave}' no tiene respuesta")
+
+    def __getstate__(self):
+        estado = self.__dict__.copy()
+        estado['serializadas'] = {}
+        return estado
+
+
+def cargar_catalogo(ruta, directorio_cache=None):
+    """Lee y compila el catálogo, reutilizando la versión compilada en disco si existe"""
+    with open(ruta, 'rb') as f:
+        datos = f.read()
+    version = hashlib.sha256(datos).hexdigest()[:16]
+
+    ruta_cache = None
+    if directorio_cache:
+        ruta_cache = os.path.join(directorio_cache, f'catalogo-{FORMATO_CACHE}-{version}.pickle')
+        try:
+            with open(ruta_cache, 'rb') as f:
+                catalogo = pickle.load(f)
+            if isinstance(catalogo, Catalogo) and catalogo.version == version:
+                return catalogo
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            registro.warning('cache_catalogo_no_valida', extra={'datos': {'ruta': ruta_cache, 'error': str(e)}})
+
+    try:
+        contenido = json.loads(datos)
+    except ValueError as e:
+        raise ErrorCatalogo(f'El catálogo no es un JSON válido: {e}')
+    catalogo = Catalogo(contenido, version)
+
+    if ruta_cache:
+        # Escritura atómica: otro worker nunca lee un archivo a medio escribir
+        try:
+            os.makedirs(directorio_cache, exist_ok=True)
+            temporal = f'{ruta_cache}.{os.getpid()}.tmp'
+            with open(temporal, 'wb') as f:
+                pickle.dump(catalogo, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporal, ruta_cache)
+        except OSError as e:
+            registro.warning('cache_catalogo_no_guardada', extra={'datos': {'ruta': ruta_cache, 'error': str(e)}})
+    return catalogo
+
+
+class CatalogoRecargable:
+    """Catálogo que se recarga solo cuando cambia el archivo.
+
+    Como mucho cada ``intervalo`` segundos se comprueba la fecha y el tamaño
+    del archivo; si han cambiado, un hilo en segundo plano compila la nueva
+    versión mientras las peticiones siguen usando la anterior, sin esperar. Si la nueva versión no es
+    válida se mantiene la anterior y se reintenta en la siguiente comprobación.
+    ``al_cambiar`` recibe cada catálogo nuevo antes de ponerlo en uso.
+    """
+
+    def __init__(self, ruta, directorio_cache=None, intervalo=2.0, al_cambiar=None):
+        self.ruta = ruta
+        self.directorio_cache = directorio_cache
+        self.intervalo = intervalo
+        self.al_cambiar = al_cambiar
+        self._lock = threading.Lock()
+        self._firma = self._firma_archivo()
+        # Firma de la última versión que no se pudo cargar (para registrar el error una sola vez)
+        self._firma_fallida = None
+        self._catalogo = cargar_catalogo(ruta, directorio_cache)
+        self._proxima_comprobacion = time.monotonic() + intervalo
+        self._hilo_recarga = None
+        # Un hilo de recarga no sobrevive a fork(): el worker no debe heredar el lock ocupado
+        os.register_at_fork(after_in_child=self._tras_fork)
+
+    def _tras_fork(self):
+        self._lock = threading.Lock()
+        self._hilo_recarga = None
+
+    def _firma_archivo(self):
+        estado = os.stat(self.ruta)
+        return estado.st_mtime_ns, estado.st_size
+
+    @property
+    def actual(self):
+        if self.intervalo > 0 and time.monotonic() >= self._proxima_comprobacion:
+            self._comprobar_en_segundo_plano()
+        return self._catalogo
+
+    def _comprobar_en_segundo_plano(self):
+        """Compara la firma del archivo y, si ha cambiado, lanza la recarga en otro hilo"""
+        if not self._lock.acquire(blocking=False):
+            return
+        self._proxima_comprobacion = time.monotonic() + self.intervalo
+        try:
+            firma = self._firma_archivo()
+        except OSError:
+            firma = self._firma
+        if firma == self._firma:
+            self._lock.release()
+            return
+        try:
+            # El lock lo libera el hilo de recarga al terminar
+            self._hilo_recarga = threading.Thread(target=self._recargar_y_liberar, args=(firma,),
+                                                  name='recarga-catalogo', daemon=True)
+            self._hilo_recarga.start()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def _recargar_y_liberar(self, firma):
+        try:
+            self.recargar(firma)
+        finally:
+            self._lock.release()
+
+    def comprobar(self):
+        """Recarga el catálogo si el archivo ha cambiado; devuelve si se ha sustituido"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._proxima_comprobacion = time.monotonic() + self.intervalo
+            try:
+                firma = self._firma_archivo()
+            except OSError:
+                return False
+            if firma == self._firma:
+                return False
+            return self.recargar(firma)
+        finally:
+            self._lock.release()
+
+    def recargar(self, firma=None):
+        """Compila el archivo actual y lo pone en uso si es válido.
+
+        Cualquier error (del archivo, de la compilación o de ``al_cambiar``) se
+        registra y deja en uso la versión anterior, sin llegar a la petición
+        que hizo la comprobación. La firma del archivo solo se da por vista si
+        la nueva versión se ha aplicado, así que se vuelve a intentar en la
+        siguiente comprobación; el error se registra una vez por firma.
+        """
+        try:
+            nuevo = cargar_catalogo(self.ruta, self.directorio_cache)
+            sustituido = nuevo.version != self._catalogo.version
+            if sustituido:
+                if self.al_cambiar is not None:
+                    self.al_cambiar(nuevo)
+                self._catalogo = nuevo
+        except Exception as e:
+            if firma is None or firma != self._firma_fallida:
+                registro.error('catalogo_no_recargado', exc_info=not isinstance(e, (OSError, ErrorCatalogo)),
+                               extra={'datos': {'ruta': self.ruta, 'error': f'{type(e).__name__}: {e}'}})
+            self._firma_fallida = firma
+            return False
+
+        if firma is not None:
+            self._firma = firma
+        self._firma_fallida = None
+        if sustituido:
+            registro.info('catalogo_recargado', extra={'datos': {'version': nuevo.version}})
+        return sustituido
@@ -0,0 +1,164 @@
+"""
+Compresión de las respuestas HTTP según lo que acepte el cliente.
+
+Middleware WSGI que comprime con brotli (si está instalado) o gzip las
+respuestas de texto, JSON y CSV. Las respuestas con tamaño conocido solo se
+comprimen si superan un mínimo; las que se envían por partes (exportación
+CSV) se comprimen trozo a trozo sin acumularlas, vaciando el compresor tras
+cada trozo para que el cliente los reciba en cuanto se generan. Las que ya
+vienen comprimidas (estáticos precomprimidos) y los eventos SSE se envían tal
+cual.
+"""
+
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él se usa solo gzip
+    brotli = None
+
+TIPOS_COMPRIMIBLES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+# Los eventos tienen que llegar en cuanto se publican y son muy pequeños
+TIPOS_EXCLUIDOS = ('text/event-stream',)
+ESTADOS_SIN_CUERPO = (204, 206, 304)
+
+
+class _Gzip:
+    nombre = 'gzip'
+
+    def __init__(self, nivel):
+        # wbits 31: formato gzip (cabecera y suma de control)
+        self._compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def comprimir(self, datos):
+        return self._compresor.compress(datos) + self._compresor.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        return self._compresor.flush()
+
+
+class _Brotli:
+    nombre = 'br'
+
+    def __init__(self, calidad):
+        self._compresor = brotli.Compressor(quality=calidad)
+
+    def comprimir(self, datos):
+        return self._compresor.process(datos) + self._compresor.flush()
+
+    def terminar(self):
+        return self._compresor.finish()
+
+
+class CompresionRespuestas:
+    """Middleware WSGI de compresión negociada con Accept-Encoding"""
+
+    def __init__(self, app, minimo=1024, nivel_gzip=6, calidad_brotli=5):
+        self.app = app
+        self.minimo = minimo
+        self.nivel_gzip = nivel_gzip
+        self.calidad_brotli = calidad_brotli
+
+    def _crear_compresor(self, environ):
+        """Compresor preferido entre los que acepta el cliente o None"""
+        aceptadas = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        if brotli is not None and aceptadas['br']:
+            return _Brotli(self.calidad_brotli)
+        if aceptadas['gzip']:
+            return _Gzip(self.nivel_gzip)
+        return None
+
+    def __call__(self, environ, start_response):
+        decision = {}
+
+        def iniciar(status, headers, exc_info=None):
+            cabeceras = {nombre.lower(): valor for nombre, valor in headers}
+            tipo = cabeceras.get('content-type', '').split(';')[0].strip().lower()
+            comprimible = (
+                tipo.startswith(TIPOS_COMPRIMIBLES) and not tipo.startswith(TIPOS_EXCLUIDOS)
+                and 'content-encoding' not in cabeceras
+                and 'no-transform' not in cabeceras.get('cache-control', '')
+            )
+            if comprimible:
+                headers = _anadir_vary(headers)
+
+            compresor = None
+            longitud = cabeceras.get('content-length')
+            if (comprimible and environ.get('REQUEST_METHOD') != 'HEAD'
+                    and int(status.split()[0]) not in ESTADOS_SIN_CUERPO
+                    and (longitud is None or int(longitud) >= self.minimo)):
+                compresor = self._crear_compresor(environ)
+
+            if compresor is None:
+                return start_response(status, headers, exc_info)
+            decision.update(compresor=compresor, status=status, headers=headers,
+                            exc_info=exc_info, por_partes=longitud is None)
+            if longitud is None:
+                return start_response(status, _cabeceras_comprimidas(headers, compresor), exc_info)
+            # Con tamaño conocido las cabeceras se envían al tener el cuerpo comprimido
+            return _sin_escritura
+
+        respuesta = self.app(environ, iniciar)
+        if 'compresor' not in decision:
+            return respuesta
+        if decision['por_partes']:
+            return _comprimir_por_partes(respuesta, decision['compresor'])
+
+        try:
+            cuerpo = b''.join(respuesta)
+        finally:
+            if hasattr(respuesta, 'close'):
+                respuesta.close()
+        compresor = decision['compresor']
+        comprimido = compresor.comprimir(cuerpo) + compresor.terminar()
+        if len(comprimido) >= len(cuerpo):
+            start_response(decision['status'], decision['headers'], decision['exc_info'])
+            return [cuerpo]
+        cabeceras = _cabeceras_comprimidas(decision['headers'], compresor, len(comprimido))
+        start_response(decision['status'], cabeceras, decision['exc_info'])
+        return [comprimido]
+
+
+def _sin_escritura(datos):
+    raise RuntimeError('La compresión no admite la función write() de WSGI')
+
+
+def _anadir_vary(headers):
+    for i, (nombre, valor) in enumerate(headers):
+        if nombre.lower() == 'vary':
+            if 'accept-encoding' not in valor.lower():
+                headers = headers[:i] + [(nombre, f'{valor}, Accept-Encoding')] + headers[i + 1:]
+            return headers
+    return headers + [('Vary', 'Accept-Encoding')]
+
+
+def _cabeceras_comprimidas(headers, compresor, longitud=None):
+    """Cabeceras de la versión comprimida: codificación, nueva longitud y ETag débil"""
+    cabeceras = []
+    for nombre, valor in headers:
+        minusculas = nombre.lower()
+        if minusculas == 'content-length':
+            continue
+        if minusculas == 'etag' and not valor.startswith('W/'):
+            # Los bytes ya no son los mismos: el ETag pasa a ser débil
+            valor = f'W/{valor}'
+        cabeceras.append((nombre, valor))
+    cabeceras.append(('Content-Encoding', compresor.nombre))
+    if longitud is not None:
+        cabeceras.append(('Content-Length', str(longitud)))
+    return cabeceras
+
+
+def _comprimir_por_partes(respuesta, compresor):
+    try:
+        for trozo in respuesta:
+            if trozo:
+                datos = compresor.comprimir(trozo)
+                if datos:
+                    yield datos
+        yield compresor.terminar()
+    finally:
+        if hasattr(respuesta, 'close'):
+            respuesta.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Genera las versiones publicables de los archivos estáticos
+
+Copia cada archivo de static/css y static/js a static/dist con el hash de su
+contenido en el nombre (index.css → index.3f9a0c1d2e.css) y guarda junto a él
+una versión comprimida con gzip y, si está instalado el módulo brotli, otra
+con brotli. static/dist/manifest.json relaciona cada archivo con su versión:
+las plantillas lo consultan con estatico('css/index.css') y el navegador puede
+guardar los archivos para siempre, porque si cambian cambia su nombre.
+
+    python construir_estaticos.py
+
+La aplicación también lo ejecuta al arrancar si algún archivo es más reciente
+que el manifiesto. Los archivos de versiones anteriores se conservan para las
+páginas que aún los referencian durante un despliegue.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se generan las versiones gzip
+    brotli = None
+
+DIRECTORIO_ESTATICOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+SUBDIRECTORIOS = ('css', 'js')
+DESTINO = 'dist'
+MANIFIESTO = 'manifest.json'
+# Por debajo de este tamaño la versión comprimida no compensa
+TAMANO_MINIMO_COMPRIMIR = 512
+
+
+def archivos_origen(directorio):
+    """Rutas relativas (con /) de los archivos que se publican"""
+    for subdirectorio in SUBDIRECTORIOS:
+        base = os.path.join(directorio, subdirectorio)
+        if not os.path.isdir(base):
+            continue
+        for raiz, _, nombres in os.walk(base):
+            for nombre in sorted(nombres):
+                ruta = os.path.join(raiz, nombre)
+                yield os.path.relpath(ruta, directorio).replace(os.sep, '/')
+
+
+def escribir_atomico(ruta, datos):
+    """Escribe en un temporal y lo renombra: nunca se sirve un archivo a medias"""
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def construir(directorio=DIRECTORIO_ESTATICOS):
+    """Genera los archivos con hash y sus versiones comprimidas; devuelve el manifiesto"""
+    destino = os.path.join(directorio, DESTINO)
+    manifiesto = {}
+    for relativa in archivos_origen(directorio):
+        with open(os.path.join(directorio, relativa), 'rb') as f:
+            datos = f.read()
+        base, extension = os.path.splitext(relativa)
+        versionada = f'{base}.{hashlib.sha256(datos).hexdigest()[:10]}{extension}'
+        manifiesto[relativa] = versionada
+
+        ruta = os.path.join(destino, versionada)
+        if os.path.exists(ruta):
+            continue
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        if len(datos) >= TAMANO_MINIMO_COMPRIMIR:
+            escribir_atomico(ruta + '.gz', gzip.compress(datos, compresslevel=9, mtime=0))
+            if brotli is not None:
+                escribir_atomico(ruta + '.br', brotli.compress(datos, quality=11))
+        # El archivo sin comprimir va el último: su existencia indica que la versión está completa
+        escribir_atomico(ruta, datos)
+
+    os.makedirs(destino, exist_ok=True)
+    escribir_atomico(os.path.join(destino, MANIFIESTO),
+                     json.dumps(manifiesto, indent=2, sort_keys=True).encode())
+    return manifiesto
+
+
+def cargar_manifiesto(directorio=DIRECTORIO_ESTATICOS, construir_si_cambia=True):
+    """Manifiesto actual; si falta o algún archivo es más reciente, se vuelve a construir"""
+    ruta = os.path.join(directorio, DESTINO, MANIFIESTO)
+    if construir_si_cambia:
+        try:
+            generado = os.stat(ruta).st_mtime_ns
+        except FileNotFoundError:
+            generado = None
+        if generado is None or any(
+            os.stat(os.path.join(directorio, relativa)).st_mtime_ns > generado
+            for relativa in archivos_origen(directorio)
+        ):
+            try:
+                return construir(directorio)
+            except OSError:
+                # Directorio de solo lectura: se usa el manifiesto que haya
+                pass
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == '__main__':
+    manifiesto = construir()
+    for original, versionada in sorted(manifiesto.items()):
+        print(f"{original:<24} → {DESTINO}/{versionada}")
+    if brotli is None:
+        print("⚠️  El módulo brotli no está instalado: solo se han generado las versiones gzip", file=sys.stderr)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Genera las variantes de las imágenes de los tratamientos
+
+Cada imagen original de static/img (su identificador es el nombre del archivo
+sin extensión, el que se usa en "imagenes" de catalogo.json) se convierte en:
+
+- miniaturas recortadas al tamaño en que se muestran en el chat, a 1x y 2x;
+- versiones grandes sin recortar para verlas ampliadas;
+
+cada una en WebP y en JPEG, con el hash del original en el nombre, dentro de
+static/dist/img. static/dist/img/imagenes.json describe las variantes de
+cada imagen para construir el srcset. Como los nombres cambian si cambia el
+original, se sirven con caché inmutable igual que el CSS y el JS.
+
+    python construir_imagenes.py
+
+Necesita Pillow. Se ejecuta al desplegar, no al arrancar la aplicación; sin
+las variantes generadas el chat muestra los originales.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from io import BytesIO
+
+from construir_estaticos import DESTINO, DIRECTORIO_ESTATICOS, escribir_atomico
+
+ORIGEN = 'img'
+MANIFIESTO = 'imagenes.json'
+EXTENSIONES = ('.jpg', '.jpeg', '.png', '.webp')
+# Tamaño de la miniatura en el chat (CSS de index.js) y su versión para pantallas de alta densidad
+MINIATURAS = ((150, 120), (300, 240))
+# Anchos de las versiones grandes; nunca se amplía el original
+ANCHOS = (640, 1280)
+# Formato de salida: (extensión, formato de Pillow, opciones)
+FORMATOS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+# Cambiar si cambian los tamaños o la calidad para regenerar todas las variantes
+VERSION = 1
+
+
+def originales(directorio=DIRECTORIO_ESTATICOS):
+    """Identificador → ruta relativa a static/ de cada imagen original"""
+    base = os.path.join(directorio, ORIGEN)
+    if not os.path.isdir(base):
+        return {}
+    imagenes = {}
+    for nombre in sorted(os.listdir(base)):
+        identificador, extension = os.path.splitext(nombre)
+        if extension.lower() in EXTENSIONES:
+            imagenes[identificador] = f'{ORIGEN}/{nombre}'
+    return imagenes
+
+
+def _guardar(imagen, destino, relativa):
+    """Guarda la imagen en cada formato y devuelve {extensión: ruta relativa a dist}"""
+    rutas = {}
+    for extension, formato, opciones in FORMATOS:
+        ruta = f'{relativa}.{extension}'
+        rutas[extension] = ruta
+        completa = os.path.join(destino, ruta)
+        if os.path.exists(completa):
+            continue
+        salida = BytesIO()
+        imagen.save(salida, formato, **opciones)
+        escribir_atomico(completa, salida.getvalue())
+    return rutas
+
+
+def construir(directorio=DIRECTORIO_ESTATICOS):
+    """Genera las variantes que falten y devuelve el manifiesto"""
+    from PIL import Image, ImageOps
+
+    destino = os.path.join(directorio, DESTINO)
+    os.makedirs(os.path.join(destino, ORIGEN), exist_ok=True)
+    manifiesto = {}
+    for identificador, relativa in originales(directorio).items():
+        ruta = os.path.join(directorio, relativa)
+        with open(ruta, 'rb') as f:
+            huella = hashlib.sha256(f.read() + bytes([VERSION])).hexdigest()[:10]
+
+        with Image.open(ruta) as original:
+            # Respetar la orientación de las fotos de móvil y trabajar siempre en RGB
+            imagen = ImageOps.exif_transpose(original).convert('RGB')
+        ancho, alto = imagen.size
+
+        miniaturas = []
+        for ancho_miniatura, alto_miniatura in MINIATURAS:
+            recortada = ImageOps.fit(imagen, (ancho_miniatura, alto_miniatura), Image.Resampling.LANCZOS)
+            nombre = f'{ORIGEN}/{identificador}-{ancho_miniatura}x{alto_miniatura}.{huella}'
+            miniaturas.append((ancho_miniatura, _guardar(recortada, destino, nombre)))
+
+        grandes = []
+        for ancho_grande in [a for a in ANCHOS if a < ancho] or [ancho]:
+            alto_grande = round(alto * ancho_grande / ancho)
+            reducida = imagen if ancho_grande == ancho else imagen.resize((ancho_grande, alto_grande), Image.Resampling.LANCZOS)
+            nombre = f'{ORIGEN}/{identificador}-{ancho_grande}.{huella}'
+            grandes.append((ancho_grande, _guardar(reducida, destino, nombre)))
+
+        manifiesto[identificador] = {
+            'ancho': ancho,
+            'alto': alto,
+            'miniatura': {'ancho': MINIATURAS[0][0], 'alto': MINIATURAS[0][1],
+                          'variantes': {ext: [[r[ext], a] for a, r in miniaturas] for ext, _, _ in FORMATOS}},
+            'grande': {ext: [[r[ext], a] for a, r in grandes] for ext, _, _ in FORMATOS},
+        }
+
+    escribir_atomico(os.path.join(destino, ORIGEN, MANIFIESTO),
+                     json.dumps(manifiesto, indent=2, sort_keys=True).encode())
+    return manifiesto
+
+
+def cargar_manifiesto(directorio=DIRECTORIO_ESTATICOS):
+    """Variantes generadas de cada imagen (vacío si aún no se han generado)"""
+    try:
+        with open(os.path.join(directorio, DESTINO, ORIGEN, MANIFIESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == '__main__':
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("❌ Hace falta Pillow para generar las imágenes: pip install Pillow", file=sys.stderr)
+        sys.exit(1)
+    for identificador, imagen in construir().items():
+        variantes = sum(len(rutas) for rutas in imagen['miniatura']['variantes'].values()) + \
+            sum(len(rutas) for rutas in imagen['grande'].values())
+        print(f"{identificador:<32} {imagen['ancho']}x{imagen['alto']} → {variantes} variantes")
@@ -0,0 +1,182 @@
+"""
+Estado de las conversaciones del chat guardado en el servidor.
+
+Cada conversación tiene un identificador aleatorio y guarda el paso de la
+máquina de estados y los datos parciales de la cita. Se mantienen en memoria
+en un LRU con caducidad: al superar la capacidad se descartan las menos
+usadas y las que llevan más de ``ttl`` segundos sin actividad caducan.
+
+Opcionalmente se guardan también en una tabla SQLite, que comparten todos los
+workers y que sobrevive a los reinicios. Cada guardado incrementa la versión
+de la conversación; el cliente devuelve la última versión que ha recibido y,
+si la copia en memoria de un worker es más antigua, se lee de SQLite. El
+guardado solo se aplica si la versión de la tabla sigue siendo la leída: si
+otro worker se ha adelantado, ``guardar`` devuelve None. Si SQLite falla, la
+conversación sigue solo en la memoria del worker.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from registro import obtener_registro
+
+registro = obtener_registro('conversaciones')
+
+
+class AlmacenConversaciones:
+    """LRU en memoria con caducidad y tabla SQLite opcional"""
+
+    def __init__(self, capacidad=10000, ttl=1800, ruta_sqlite=None):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.ruta_sqlite = ruta_sqlite
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._guardados = 0
+        self._local = threading.local()
+        if ruta_sqlite:
+            conexion = sqlite3.connect(ruta_sqlite, timeout=5)
+            try:
+                with conexion:
+                    conexion.execute('PRAGMA journal_mode=WAL')
+                    conexion.execute(
+                        'CREATE TABLE IF NOT EXISTS conversacion ('
+                        'id TEXT PRIMARY KEY, version INTEGER, estado TEXT, datos TEXT, actualizado REAL)'
+                    )
+                    conexion.execute('CREATE INDEX IF NOT EXISTS ix_conversacion_actualizado ON conversacion (actualizado)')
+            finally:
+                conexion.close()
+
+    def _conexion(self):
+        """Conexión del hilo actual, abierta la primera vez que la usa.
+
+        Se guarda con el pid para no reutilizar tras fork() la del proceso padre.
+        """
+        abierta = getattr(self._local, 'conexion', None)
+        if abierta is not None and abierta[0] == os.getpid():
+            return abierta[1]
+        conexion = sqlite3.connect(self.ruta_sqlite, timeout=1, check_same_thread=False)
+        # Con WAL y synchronous=NORMAL confirmar no espera a fsync en cada guardado
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute('PRAGMA synchronous=NORMAL')
+        self._local.conexion = (os.getpid(), conexion)
+        return conexion
+
+    @staticmethod
+    def nuevo_id():
+        return secrets.token_urlsafe(16)
+
+    def __len__(self):
+        return len(self._memoria)
+
+    def en_memoria(self, conversacion_id):
+        """Indica si la conversación está en la memoria de este worker y no ha caducado (sin consultar SQLite)"""
+        entrada = self._memoria.get(conversacion_id)
+        return entrada is not None and time.monotonic() - entrada[3] < self.ttl
+
+    def obtener(self, conversacion_id, version=None):
+        """Devuelve (version, estado, datos_cita) o None si la conversación no existe o ha caducado.
+
+        Si se indica ``version`` solo se acepta esa versión exacta.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._memoria.get(conversacion_id)
+            if entrada is not None:
+                if ahora - entrada[3] >= self.ttl:
+                    del self._memoria[conversacion_id]
+                    entrada = None
+                elif version is None or entrada[0] == version:
+                    self._memoria.move_to_end(conversacion_id)
+                    return entrada[0], entrada[1], dict(entrada[2])
+
+        if not self.ruta_sqlite:
+            return None
+        try:
+            fila = self._conexion().execute(
+                'SELECT version, estado, datos FROM conversacion WHERE id = ? AND actualizado > ?',
+                (conversacion_id, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            # Sin la tabla el cliente reenvía su estado completo
+            registro.warning('conversacion_no_leida', extra={'datos': {'error': str(e)}})
+            return None
+        if fila is None or (version is not None and fila[0] != version):
+            return None
+        datos = json.loads(fila[2])
+        self._recordar(conversacion_id, fila[0], fila[1], datos)
+        return fila[0], fila[1], dict(datos)
+
+    def _recordar(self, conversacion_id, version, estado, datos):
+        """Guarda en memoria y descarta lo caducado y lo que sobra por capacidad"""
+        ahora = time.monotonic()
+        with self._lock:
+            self._memoria[conversacion_id] = (version, estado, datos, ahora)
+            self._memoria.move_to_end(conversacion_id)
+            # La más antigua es la que lleva más tiempo sin usarse
+            while self._memoria:
+                primera = next(iter(self._memoria.values()))
+                if len(self._memoria) <= self.capacidad and ahora - primera[3] < self.ttl:
+                    break
+                self._memoria.popitem(last=False)
+
+    def guardar(self, conversacion_id, version, estado, datos_cita):
+        """Guarda un nuevo paso de la conversación a partir de ``version`` y devuelve la nueva versión.
+
+        Devuelve None si en la tabla ya hay otra versión (otro worker se ha adelantado).
+        """
+        datos = dict(datos_cita or {})
+        if self.ruta_sqlite:
+            try:
+                if not self._guardar_sqlite(conversacion_id, version, estado, datos):
+                    with self._lock:
+                        self._memoria.pop(conversacion_id, None)
+                    return None
+            except sqlite3.Error as e:
+                registro.warning('conversacion_no_guardada', extra={'datos': {'error': str(e)}})
+        self._recordar(conversacion_id, version + 1, estado, datos)
+        return version + 1
+
+    def _guardar_sqlite(self, conversacion_id, version, estado, datos):
+        """Escribe la versión siguiente solo si la tabla sigue en ``version``; devuelve si se ha escrito"""
+        conexion = self._conexion()
+        valores = (version + 1, estado, json.dumps(datos, ensure_ascii=False), time.time())
+        with conexion:
+            if version == 0:
+                cursor = conexion.execute(
+                    'INSERT OR IGNORE INTO conversacion (version, estado, datos, actualizado, id) VALUES (?, ?, ?, ?, ?)',
+                    valores + (conversacion_id,)
+                )
+            else:
+                cursor = conexion.execute(
+                    'UPDATE conversacion SET version = ?, estado = ?, datos = ?, actualizado = ? WHERE id = ? AND version = ?',
+                    valores + (conversacion_id, version)
+                )
+            if cursor.rowcount == 0:
+                return False
+            self._guardados += 1
+            if self._guardados % 1000 == 0:
+                conexion.execute('DELETE FROM conversacion WHERE actualizado < ?', (time.time() - self.ttl,))
+        return True
+
+    def eliminar(self, conversacion_id):
+        with self._lock:
+            self._memoria.pop(conversacion_id, None)
+        if self.ruta_sqlite:
+            try:
+                with self._conexion() as conexion:
+                    conexion.execute('DELETE FROM conversacion WHERE id = ?', (conversacion_id,))
+            except sqlite3.Error as e:
+                registro.warning('conversacion_no_eliminada', extra={'datos': {'error': str(e)}})
+
+
+def cambios_datos(anteriores, nuevos):
+    """Campos nuevos o modificados y lista de campos eliminados entre dos versiones de los datos de la cita"""
+    cambios = {clave: valor for clave, valor in nuevos.items() if anteriores.get(clave) != valor}
+    eliminados = [clave for clave in anteriores if clave not in nuevos]
+    return cambios, eliminados
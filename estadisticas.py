@@ -0,0 +1,117 @@
+"""
+Contadores de citas por estado y tipo mantenidos en memoria.
+
+Se cargan con una única consulta agregada (GROUP BY estado, tipo_cita), se
+actualizan en cada alta o cambio de estado y se reconcilian periódicamente
+con la tabla real para corregir cualquier desviación. Si se indica la versión
+de la tabla (el último número de cambio), también se reconcilian en cuanto
+aparece un cambio que no ha registrado este proceso, por ejemplo una cita
+guardada por otro worker.
+"""
+
+import threading
+import time
+from collections import Counter
+
+
+def resumir(conteos):
+    """Convierte los conteos por (estado, tipo_cita) en las cifras del panel de administración"""
+    por_estado = Counter()
+    por_tipo = Counter()
+    for (estado, tipo_cita), cantidad in conteos.items():
+        por_estado[estado] += cantidad
+        por_tipo[tipo_cita] += cantidad
+
+    return {
+        'total_citas': sum(conteos.values()),
+        'citas_pendientes': por_estado['pendiente'],
+        'citas_confirmadas': por_estado['confirmada'],
+        'citas_canceladas': por_estado['cancelada'],
+        'revisiones': por_tipo['revision'],
+        'padecimientos': por_tipo['padecimiento']
+    }
+
+
+class ContadoresCitas:
+    """Conteos de citas por (estado, tipo_cita) con reconciliación periódica.
+
+    ``cargar`` es una función sin argumentos que devuelve filas
+    ``(estado, tipo_cita, cantidad)`` de la consulta agregada. ``version``,
+    opcional, devuelve el último número de cambio de la tabla; los números de
+    los cambios registrados se pasan en ``num_cambio``.
+    """
+
+    def __init__(self, cargar, intervalo_reconciliacion=300, version=None):
+        self._cargar = cargar
+        self._intervalo = intervalo_reconciliacion
+        self._version = version
+        self._conteos = Counter()
+        self._ultima_carga = None
+        # Último número de cambio incluido en los conteos
+        self._version_conteos = None
+        self._lock = threading.Lock()
+        # Solo una reconciliación a la vez
+        self._lock_reconciliacion = threading.Lock()
+        # Altas y cambios registrados mientras se ejecuta la consulta de una reconciliación
+        self._durante_consulta = None
+
+    def reconciliar(self):
+        """Recalcula los conteos desde la base de datos.
+
+        La consulta se hace sin el lock para no bloquear las altas; las que se
+        registran mientras tanto se vuelven a aplicar sobre el resultado, de
+        modo que no se pierden al sustituir los conteos.
+        """
+        with self._lock_reconciliacion:
+            with self._lock:
+                self._durante_consulta = Counter()
+            try:
+                # La versión se lee antes: lo que cambie durante la consulta provoca otra reconciliación
+                version = self._version() if self._version else None
+                conteos = Counter()
+                for estado, tipo_cita, cantidad in self._cargar():
+                    conteos[(estado, tipo_cita)] += cantidad
+            except BaseException:
+                with self._lock:
+                    self._durante_consulta = None
+                raise
+            with self._lock:
+                conteos.update(self._durante_consulta)
+                self._durante_consulta = None
+                self._conteos = conteos
+                self._version_conteos = version
+                self._ultima_carga = time.monotonic()
+
+    def _sumar(self, clave, cantidad):
+        self._conteos[clave] += cantidad
+        if self._durante_consulta is not None:
+            self._durante_consulta[clave] += cantidad
+
+    def _avanzar(self, num_cambio):
+        # Solo el cambio siguiente al último incluido: si falta alguno, es de otro proceso
+        if num_cambio is not None and self._version_conteos is not None and num_cambio == self._version_conteos + 1:
+            self._version_conteos = num_cambio
+
+    def registrar_alta(self, estado, tipo_cita, num_cambio=None):
+        """Suma una cita nueva"""
+        with self._lock:
+            self._sumar((estado, tipo_cita), 1)
+            self._avanzar(num_cambio)
+
+    def registrar_cambio(self, tipo_cita, estado_anterior, estado_nuevo, num_cambio=None):
+        """Mueve una cita de un estado a otro"""
+        with self._lock:
+            if estado_anterior != estado_nuevo:
+                self._sumar((estado_anterior, tipo_cita), -1)
+                self._sumar((estado_nuevo, tipo_cita), 1)
+            self._avanzar(num_cambio)
+
+    def resumen(self):
+        """Cifras actuales; reconcilia antes si la última carga es demasiado antigua o hay cambios ajenos"""
+        if self._ultima_carga is None or time.monotonic() - self._ultima_carga >= self._intervalo:
+            self.reconciliar()
+        elif self._version and self._version() != self._version_conteos:
+            self.reconciliar()
+        with self._lock:
+            conteos = dict(self._conteos)
+        return resumir(conteos)
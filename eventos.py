@@ -0,0 +1,150 @@
+"""
+Canal de eventos en memoria para enviar cambios de citas por Server-Sent Events.
+
+Los eventos se serializan una sola vez al publicarse y se guardan en un búfer
+circular acotado; cada suscriptor solo espera en una condición compartida, de
+modo que no mantiene abierta ninguna conexión a la base de datos. El canal es
+local a cada proceso: con varios workers la aplicación publica también los
+cambios guardados por los demás, identificados con una clave para no repetir
+los que el propio proceso ya ha publicado.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class CanalEventos:
+    """Búfer circular de eventos con reparto a varios suscriptores.
+
+    Los identificadores tienen la forma ``<arranque>-<n>``, donde el arranque
+    incluye el pid del proceso: si un cliente reconecta con un
+    ``Last-Event-ID`` de otro proceso o más antiguo que el búfer, recibe un
+    evento ``recargar`` para que vuelva a pedir los datos.
+    """
+
+    def __init__(self, capacidad=500):
+        self._eventos = deque(maxlen=capacidad)
+        self._ultimo = 0
+        self._condicion = threading.Condition()
+        self._claves = deque(maxlen=capacidad)
+        self._nuevo_arranque()
+        self.suscriptores = 0
+        # Con preload_app el canal se crea en el proceso maestro antes de crear
+        # los workers: cada uno necesita su propio arranque para que no acepte
+        # como propio un Last-Event-ID de otro worker
+        os.register_at_fork(after_in_child=self._nuevo_arranque)
+
+    def _nuevo_arranque(self):
+        self._arranque = f'{int(time.time() * 1000)}.{os.getpid()}'
+
+    def publicar(self, tipo, datos, clave=None):
+        """Añade un evento al búfer y despierta a los suscriptores.
+
+        Si se indica ``clave`` y ya se publicó un evento reciente con la misma,
+        no se repite; devuelve si el evento se ha publicado.
+        """
+        contenido = json.dumps(datos, ensure_ascii=False, separators=(',', ':'))
+        with self._condicion:
+            if clave is not None:
+                if clave in self._claves:
+                    return False
+                self._claves.append(clave)
+            self._ultimo += 1
+            self._eventos.append((self._ultimo, tipo, contenido))
+            self._condicion.notify_all()
+        return True
+
+    def reservar(self, maximo):
+        """Ocupa un hueco de suscriptor si hay menos de ``maximo``.
+
+        Se llama antes de devolver la respuesta, para que varias conexiones
+        simultáneas no superen el máximo mientras aún no han empezado a
+        escuchar. Devuelve None si no queda hueco o la función que lo libera,
+        que se puede llamar varias veces: la llama ``escuchar(..., liberar=...)``
+        al terminar y conviene llamarla también al cerrar la respuesta, por si
+        se cierra sin haber empezado a enviarse.
+        """
+        with self._condicion:
+            if self.suscriptores >= maximo:
+                return None
+            self.suscriptores += 1
+        pendiente = [True]
+
+        def liberar():
+            with self._condicion:
+                if pendiente:
+                    pendiente.clear()
+                    self.suscriptores -= 1
+        return liberar
+
+    def _posicion(self, ultimo_id):
+        """Convierte un Last-Event-ID en número de evento o None si no se puede reanudar"""
+        if not ultimo_id:
+            return self._ultimo
+        arranque, _, numero = ultimo_id.partition('-')
+        if arranque != self._arranque or not numero.isdigit():
+            return None
+        return int(numero)
+
+    def _pendientes(self, posicion):
+        """Eventos posteriores a una posición o None si ya han salido del búfer"""
+        if self._eventos and posicion < self._eventos[0][0] - 1:
+            return None
+        return [evento for evento in self._eventos if evento[0] > posicion]
+
+    def _formatear(self, numero, tipo, contenido):
+        return f"id: {self._arranque}-{numero}\nevent: {tipo}\ndata: {contenido}\n\n"
+
+    def _recargar(self):
+        return f"id: {self._arranque}-{self._ultimo}\nevent: recargar\ndata: {{}}\n\n"
+
+    def escuchar(self, ultimo_id=None, latido=15, duracion_maxima=300, reintento=3000, liberar=None):
+        """Generador con el flujo text/event-stream de un suscriptor.
+
+        Envía un comentario de latido cada ``latido`` segundos y cierra el
+        flujo tras ``duracion_maxima`` segundos para liberar el hilo; el
+        navegador reconecta solo y recupera lo pendiente con Last-Event-ID.
+        """
+        with self._condicion:
+            if liberar is None:
+                self.suscriptores += 1
+            posicion = self._posicion(ultimo_id)
+            pendientes = self._pendientes(posicion) if posicion is not None else None
+
+        try:
+            yield f"retry: {reintento}\n\n"
+            if pendientes is None:
+                yield self._recargar()
+                with self._condicion:
+                    posicion = self._ultimo
+            else:
+                for numero, tipo, contenido in pendientes:
+                    yield self._formatear(numero, tipo, contenido)
+                    posicion = numero
+
+            fin = time.monotonic() + duracion_maxima
+            while time.monotonic() < fin:
+                with self._condicion:
+                    self._condicion.wait_for(lambda: self._ultimo > posicion, timeout=latido)
+                    pendientes = self._pendientes(posicion)
+
+                if pendientes is None:
+                    # El suscriptor se ha quedado atrás más que el tamaño del búfer
+                    yield self._recargar()
+                    with self._condicion:
+                        posicion = self._ultimo
+                elif pendientes:
+                    for numero, tipo, contenido in pendientes:
+                        yield self._formatear(numero, tipo, contenido)
+                        posicion = numero
+                else:
+                    yield ": latido\n\n"
+        finally:
+            if liberar is not None:
+                liberar()
+            else:
+                with self._condicion:
+                    self.suscriptores -= 1
@@ -1,19 +1,44 @@
 #!/usr/bin/env python3
 """
 Script para exportar la base de datos de citas a CSV
+
+Sin argumentos muestra las estadísticas y pregunta si exportar; con --desde
+y --hasta (YYYY-MM-DD) solo se exportan las citas de ese rango de fechas. Con
+--incremental añade a un archivo CSV o NDJSON (opcionalmente comprimido con
+gzip) solo las citas nuevas desde la última ejecución, sin preguntar nada:
+
+    python export_database.py --incremental --formato ndjson --salida citas.ndjson.gz --gzip
 """
 
+import argparse
 import csv
+import gzip
+import json
 import os
 from datetime import datetime
-from app import app, db, Cita
+from io import StringIO
+from app import app, db, Cita, conteos_por_estado_y_tipo, consulta_exportacion, generar_csv, fila_csv, CABECERA_CSV
+from estadisticas import resumir
+
+# Citas que se leen y escriben de cada vez en la exportación incremental
+FILAS_POR_BLOQUE = 1000
 
-def export_to_csv():
-    """Exporta todas las citas a un archivo CSV"""
+class ExportacionIncompatible(Exception):
+    """El formato o la compresión no coinciden con los de las exportaciones anteriores al mismo archivo"""
+
+def export_to_csv(desde=None, hasta=None):
+    """Exporta las citas a un archivo CSV, opcionalmente entre dos fechas (YYYY-MM-DD)"""
     
     with app.app_context():
-        # Obtener todas las citas
-        citas = Cita.query.order_by(Cita.fecha_creacion.desc()).all()
+        # Recorrer las citas por bloques sin cargarlas todas en memoria
+        filtros = {'desde': desde, 'hasta': hasta}
+        total = 0
+        
+        def contar(filas):
+            nonlocal total
+            for fila in filas:
+                total += 1
+                yield fila
         
         # Crear nombre del archivo con timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -21,29 +46,11 @@ def export_to_csv():
         
         # Escribir CSV
         with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['ID', 'Nombre', 'Teléfono', 'Email', 'Tipo de Cita', 
-                         'Fecha', 'Hora', 'Estado', 'Fecha de Creación']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            writer.writeheader()
-            
-            for cita in citas:
-                tipo_cita = 'Revisión General' if cita.tipo_cita == 'revision' else 'Padecimiento'
-                
-                writer.writerow({
-                    'ID': cita.id,
-                    'Nombre': cita.nombre,
-                    'Teléfono': cita.telefono,
-                    'Email': cita.email,
-                    'Tipo de Cita': tipo_cita,
-                    'Fecha': cita.fecha.strftime('%d/%m/%Y'),
-                    'Hora': cita.hora,
-                    'Estado': cita.estado,
-                    'Fecha de Creación': cita.fecha_creacion.strftime('%d/%m/%Y %H:%M:%S')
-                })
+            for bloque in generar_csv(contar(consulta_exportacion(filtros))):
+                csvfile.write(bloque)
         
         print(f"✅ Base de datos exportada exitosamente a: {filename}")
-        print(f"📊 Total de citas exportadas: {len(citas)}")
+        print(f"📊 Total de citas exportadas: {total}")
         
         return filename
 
@@ -51,50 +58,195 @@ def show_stats():
     """Muestra estadísticas de la base de datos"""
     
     with app.app_context():
-        total_citas = Cita.query.count()
-        citas_pendientes = Cita.query.filter_by(estado='pendiente').count()
-        citas_confirmadas = Cita.query.filter_by(estado='confirmada').count()
-        citas_canceladas = Cita.query.filter_by(estado='cancelada').count()
-        revisiones = Cita.query.filter_by(tipo_cita='revision').count()
-        padecimientos = Cita.query.filter_by(tipo_cita='padecimiento').count()
+        # Una sola consulta agregada por estado y tipo de cita
+        conteos = {(estado, tipo_cita): cantidad for estado, tipo_cita, cantidad in conteos_por_estado_y_tipo()}
+        estadisticas = resumir(conteos)
         
         print("\n📈 ESTADÍSTICAS DE LA BASE DE DATOS:")
-        print(f"   Total de citas: {total_citas}")
-        print(f"   Citas pendientes: {citas_pendientes}")
-        print(f"   Citas confirmadas: {citas_confirmadas}")
-        print(f"   Citas canceladas: {citas_canceladas}")
-        print(f"   Revisiones generales: {revisiones}")
-        print(f"   Consultas por padecimiento: {padecimientos}")
+        print(f"   Total de citas: {estadisticas['total_citas']}")
+        print(f"   Citas pendientes: {estadisticas['citas_pendientes']}")
+        print(f"   Citas confirmadas: {estadisticas['citas_confirmadas']}")
+        print(f"   Citas canceladas: {estadisticas['citas_canceladas']}")
+        print(f"   Revisiones generales: {estadisticas['revisiones']}")
+        print(f"   Consultas por padecimiento: {estadisticas['padecimientos']}")
         
-        if total_citas > 0:
+        if estadisticas['total_citas'] > 0:
             print(f"\n📅 ÚLTIMAS 5 CITAS:")
             ultimas_citas = Cita.query.order_by(Cita.fecha_creacion.desc()).limit(5).all()
             for cita in ultimas_citas:
                 tipo = 'Revisión' if cita.tipo_cita == 'revision' else 'Padecimiento'
                 print(f"   {cita.fecha_creacion.strftime('%d/%m/%Y %H:%M')} - {cita.nombre} ({tipo})")
 
-if __name__ == "__main__":
-    print("🗄️  EXPORTADOR DE BASE DE DATOS")
-    print("=" * 40)
+def leer_estado_exportacion(archivo_estado):
+    """Lee la marca de agua de la exportación incremental (última cita y tamaño del archivo)"""
+    if not os.path.exists(archivo_estado):
+        return {'ultimo_id': 0, 'bytes': 0}
+    with open(archivo_estado, encoding='utf-8') as f:
+        return json.load(f)
+
+def guardar_estado_exportacion(archivo_estado, estado):
+    """Guarda la marca de agua de forma atómica (archivo temporal + renombrado)"""
+    temporal = f'{archivo_estado}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=2)
+    os.replace(temporal, archivo_estado)
+
+def fila_ndjson(fila):
+    """Convierte una fila de la consulta de exportación en una línea NDJSON"""
+    cita_id, nombre, telefono, email, tipo_cita, fecha, hora, estado, fecha_creacion = fila
+    return json.dumps({
+        'id': cita_id,
+        'nombre': nombre,
+        'telefono': telefono,
+        'email': email,
+        'tipo_cita': tipo_cita,
+        'fecha': fecha.isoformat(),
+        'hora': hora,
+        'estado': estado,
+        'fecha_creacion': fecha_creacion.isoformat()
+    }, ensure_ascii=False) + '\n'
+
+def export_incremental(salida, formato='ndjson', comprimir=False, archivo_estado=None):
+    """Añade a `salida` las citas creadas desde la última exportación.
+    
+    La marca de agua (último id exportado y tamaño del archivo) se guarda en
+    `archivo_estado` solo al terminar. Si una ejecución se interrumpe, la
+    siguiente recorta lo escrito después de la última marca y continúa desde
+    ahí, sin duplicar filas. Con gzip cada ejecución añade un miembro nuevo
+    al archivo, que sigue siendo un .gz válido. Lanza ExportacionIncompatible
+    si el formato o la compresión no son los de las ejecuciones anteriores.
+    """
+    archivo_estado = archivo_estado or f'{salida}.estado.json'
+    estado = leer_estado_exportacion(archivo_estado)
+    
+    # Mezclar formatos o compresiones dejaría un archivo que no se puede leer
+    for clave, valor, opcion in (('formato', formato, '--formato'), ('gzip', comprimir, '--gzip')):
+        if clave in estado and estado[clave] != valor:
+            raise ExportacionIncompatible(
+                f"{salida} se exportó con {opcion}={estado[clave]} y ahora se ha pedido {opcion}={valor}"
+            )
+    
+    # Descartar la salida parcial de una ejecución interrumpida
+    if os.path.exists(salida) and os.path.getsize(salida) > estado['bytes']:
+        with open(salida, 'r+b') as f:
+            f.truncate(estado['bytes'])
+    
+    exportadas = 0
+    ultimo_id = estado['ultimo_id']
+    ultima_fecha_creacion = estado.get('ultima_fecha_creacion')
+    fichero = None
+    
+    with app.app_context():
+        consulta = consulta_exportacion({}).filter(Cita.id > ultimo_id).order_by(None).order_by(
+            Cita.id
+        ).execution_options(yield_per=FILAS_POR_BLOQUE)
+        
+        try:
+            bloque = StringIO()
+            escritor = csv.writer(bloque)
+            for fila in consulta:
+                # El archivo solo se abre si hay citas nuevas
+                if fichero is None:
+                    fichero = gzip.open(salida, 'ab') if comprimir else open(salida, 'ab')
+                    if formato == 'csv' and estado['bytes'] == 0:
+                        escritor.writerow(CABECERA_CSV)
+                
+                if formato == 'csv':
+                    escritor.writerow(fila_csv(fila))
+                else:
+                    bloque.write(fila_ndjson(fila))
+                
+                exportadas += 1
+                ultimo_id = fila[0]
+                ultima_fecha_creacion = fila[-1].isoformat()
+                if exportadas % FILAS_POR_BLOQUE == 0:
+                    fichero.write(bloque.getvalue().encode('utf-8'))
+                    bloque.seek(0)
+                    bloque.truncate(0)
+            
+            if fichero is not None:
+                fichero.write(bloque.getvalue().encode('utf-8'))
+        finally:
+            if fichero is not None:
+                fichero.close()
+    
+    if exportadas:
+        guardar_estado_exportacion(archivo_estado, {
+            'ultimo_id': ultimo_id,
+            'ultima_fecha_creacion': ultima_fecha_creacion,
+            'bytes': os.path.getsize(salida),
+            'formato': formato,
+            'gzip': comprimir,
+            'fecha_exportacion': datetime.now().isoformat()
+        })
+    
+    print(f"✅ Exportación incremental a {salida}: {exportadas} citas nuevas (último id: {ultimo_id})")
+    return exportadas
+
+def ruta_base_datos():
+    """Ruta del archivo SQLite que usa la aplicación"""
+    with app.app_context():
+        return db.engine.url.database
+
+def fecha_argumento(valor):
+    """Valida una fecha YYYY-MM-DD de la línea de órdenes"""
+    try:
+        datetime.strptime(valor, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha no válida: {valor} (formato YYYY-MM-DD)")
+    return valor
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description='Exporta las citas de la base de datos')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Añade solo las citas nuevas desde la última ejecución (no interactivo)')
+    parser.add_argument('--formato', choices=['ndjson', 'csv'], default='ndjson',
+                        help='Formato de la exportación incremental')
+    parser.add_argument('--salida', help='Archivo de salida de la exportación incremental')
+    parser.add_argument('--gzip', action='store_true', help='Comprimir la salida con gzip')
+    parser.add_argument('--estado', help='Archivo con la marca de agua (por defecto <salida>.estado.json)')
+    parser.add_argument('--desde', type=fecha_argumento, help='Exportar solo citas desde esta fecha (YYYY-MM-DD)')
+    parser.add_argument('--hasta', type=fecha_argumento, help='Exportar solo citas hasta esta fecha (YYYY-MM-DD)')
+    args = parser.parse_args(argumentos)
+    if args.incremental and (args.desde or args.hasta):
+        # La marca de agua es el último id exportado: un filtro de fechas dejaría huecos
+        parser.error('--desde y --hasta no se pueden usar con --incremental')
     
     # Verificar que existe la base de datos
-    if not os.path.exists('citas.db'):
+    if not os.path.exists(ruta_base_datos()):
         print("❌ Error: No se encontró la base de datos 'citas.db'")
         print("   Asegúrate de que la aplicación se haya ejecutado al menos una vez.")
-        exit(1)
+        return 1
+    
+    if args.incremental:
+        salida = args.salida or f"citas_export.{args.formato}{'.gz' if args.gzip else ''}"
+        try:
+            export_incremental(salida, args.formato, args.gzip, args.estado)
+        except ExportacionIncompatible as e:
+            print(f"❌ Error: {e}")
+            return 1
+        return 0
+    
+    print("🗄️  EXPORTADOR DE BASE DE DATOS")
+    print("=" * 40)
     
     # Mostrar estadísticas
     show_stats()
     
     # Preguntar si quiere exportar
-    print("\n¿Quieres exportar la base de datos a CSV? (s/n): ", end="")
+    rango = f" (del {args.desde or 'principio'} al {args.hasta or 'final'})" if args.desde or args.hasta else ''
+    print(f"\n¿Quieres exportar la base de datos a CSV{rango}? (s/n): ", end="")
     respuesta = input().lower().strip()
     
     if respuesta in ['s', 'si', 'sí', 'y', 'yes']:
         try:
-            filename = export_to_csv()
+            filename = export_to_csv(args.desde, args.hasta)
             print(f"\n✅ Exportación completada: {filename}")
         except Exception as e:
             print(f"❌ Error durante la exportación: {e}")
     else:
-        print("❌ Exportación cancelada.") 
\ No newline at end of file
+        print("❌ Exportación cancelada.")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,36 @@
+"""
+Configuración de gunicorn para producción
+
+Varios procesos (WEB_CONCURRENCY) con varios hilos cada uno (GUNICORN_THREADS)
+sobre la misma base de datos SQLite en modo WAL. La aplicación se carga una vez
+en el proceso maestro, de modo que la creación y migración del esquema se
+ejecutan una sola vez antes de arrancar los workers.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# La aplicación (que se carga después de este archivo) lo consulta para
+# compartir las conversaciones del chat entre workers
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Cada petición se atiende en un hilo: una petición lenta (una escritura que
+# espera a SQLite, un flujo de eventos) no bloquea las respuestas del chat.
+# La aplicación reserva hilos libres limitando los accesos simultáneos a la
+# base de datos (DB_CONCURRENCIA) y los flujos de eventos abiertos
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Conexiones keep-alive que cada worker mantiene abiertas entre peticiones
+worker_connections = int(os.getenv('GUNICORN_CONEXIONES', '1000'))
+keepalive = 5
+timeout = 120
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Cada worker abre sus propias conexiones en lugar de heredar las del maestro"""
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,271 @@
+"""
+Búsqueda de intenciones del chatbot mediante autómatas Aho-Corasick.
+
+Los autómatas se construyen una sola vez (al arrancar o al recargar el
+contenido) y localizan en una única pasada sobre el mensaje todas las claves
+y palabras clave que contiene, devolviendo la de mayor prioridad.
+
+Si el mensaje no contiene ninguna literalmente, un índice de trigramas busca
+la clave o palabra clave más parecida sin tener en cuenta tildes ni
+mayúsculas, para tolerar faltas de ortografía ("ortodonsia", "limpiesa").
+"""
+
+import heapq
+import re
+import unicodedata
+from collections import deque
+
+# Similitud mínima (0 a 1) para aceptar una coincidencia aproximada
+UMBRAL_SIMILITUD = 0.6
+# Límites que acotan el coste de la búsqueda aproximada con mensajes largos
+MAX_PALABRAS_MENSAJE = 24
+MAX_LONGITUD_PALABRA = 24
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+
+class AutomataPalabras:
+    """Autómata Aho-Corasick sobre un conjunto de patrones con prioridad.
+
+    Cada patrón lleva un rango (cuanto menor, más prioritario) y un valor
+    asociado. ``buscar`` devuelve el valor del patrón de menor rango presente
+    en el texto, que equivale a recorrer la lista de patrones en orden y
+    quedarse con el primero que aparezca como subcadena.
+    """
+
+    def __init__(self, patrones):
+        # Nodo 0 = raíz. Cada nodo guarda sus transiciones, su enlace de fallo
+        # y el mejor (rango, valor) que termina en él o en su cadena de fallos
+        self._transiciones = [{}]
+        self._fallo = [0]
+        self._mejor = [None]
+
+        for patron, rango, valor in patrones:
+            if not patron:
+                continue
+            nodo = 0
+            for caracter in patron:
+                siguiente = self._transiciones[nodo].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones[nodo][caracter] = siguiente
+                    self._transiciones.append({})
+                    self._fallo.append(0)
+                    self._mejor.append(None)
+                nodo = siguiente
+            actual = self._mejor[nodo]
+            if actual is None or rango < actual[0]:
+                self._mejor[nodo] = (rango, valor)
+
+        self._construir_enlaces()
+
+    def _construir_enlaces(self):
+        """Calcula los enlaces de fallo en anchura y propaga el mejor patrón"""
+        cola = deque()
+        for hijo in self._transiciones[0].values():
+            cola.append(hijo)
+
+        while cola:
+            nodo = cola.popleft()
+            for caracter, hijo in self._transiciones[nodo].items():
+                cola.append(hijo)
+                fallo = self._fallo[nodo]
+                while fallo and caracter not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                destino = self._transiciones[fallo].get(caracter, 0)
+                self._fallo[hijo] = destino if destino != hijo else 0
+
+                heredado = self._mejor[self._fallo[hijo]]
+                propio = self._mejor[hijo]
+                if heredado is not None and (propio is None or heredado[0] < propio[0]):
+                    self._mejor[hijo] = heredado
+
+    def buscar(self, texto):
+        """Devuelve el valor del patrón más prioritario presente en el texto o None"""
+        transiciones = self._transiciones
+        fallo = self._fallo
+        mejor_nodo = self._mejor
+        nodo = 0
+        mejor = None
+
+        for caracter in texto:
+            while nodo and caracter not in transiciones[nodo]:
+                nodo = fallo[nodo]
+            nodo = transiciones[nodo].get(caracter, 0)
+            candidato = mejor_nodo[nodo]
+            if candidato is not None and (mejor is None or candidato[0] < mejor[0]):
+                mejor = candidato
+                if mejor[0] == 0:
+                    break
+
+        return mejor[1] if mejor is not None else None
+
+    def contiene(self, texto):
+        """Indica si el texto contiene alguno de los patrones"""
+        transiciones = self._transiciones
+        fallo = self._fallo
+        mejor_nodo = self._mejor
+        nodo = 0
+
+        for caracter in texto:
+            while nodo and caracter not in transiciones[nodo]:
+                nodo = fallo[nodo]
+            nodo = transiciones[nodo].get(caracter, 0)
+            if mejor_nodo[nodo] is not None:
+                return True
+
+        return False
+
+
+def normalizar(texto):
+    """Minúsculas sin tildes y con los signos de puntuación convertidos en espacios"""
+    texto = unicodedata.normalize('NFD', texto.lower())
+    texto = ''.join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    return _NO_ALFANUMERICO.sub(' ', texto).strip()
+
+
+def trigramas(palabra):
+    """Trigramas de una palabra con un espacio de relleno a cada lado"""
+    palabra = f' {palabra} '
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+class MensajeUsuario:
+    """Mensaje del usuario preparado una sola vez para todas las comprobaciones"""
+
+    __slots__ = ('original', 'minusculas', 'normalizado', 'palabras')
+
+    def __init__(self, texto):
+        self.original = texto
+        self.minusculas = texto.lower().strip()
+        # Con un espacio a cada lado para buscar frases completas
+        self.normalizado = f' {normalizar(texto)} '
+        self.palabras = frozenset(self.normalizado.split())
+
+
+class ConjuntoPalabras:
+    """Palabras y frases que se buscan completas en un mensaje, sin tildes ni mayúsculas"""
+
+    def __init__(self, expresiones):
+        normalizadas = [normalizar(expresion) for expresion in expresiones]
+        self.palabras = frozenset(e for e in normalizadas if ' ' not in e)
+        self.frases = tuple(f' {e} ' for e in normalizadas if ' ' in e)
+
+    def presente(self, mensaje):
+        """Indica si el ``MensajeUsuario`` contiene alguna de las palabras o frases"""
+        if not self.palabras.isdisjoint(mensaje.palabras):
+            return True
+        return any(frase in mensaje.normalizado for frase in self.frases)
+
+
+class IndiceTrigramas:
+    """Índice invertido de trigramas para encontrar el patrón más parecido a un texto.
+
+    Cada palabra de un patrón se compara con la palabra del mensaje más
+    parecida (coeficiente de Dice sobre sus trigramas) y la puntuación del
+    patrón es la media de esas similitudes ponderada por la longitud de cada
+    palabra. Solo se puntúan las palabras del índice que comparten algún
+    trigrama con el mensaje, y el mensaje se recorta a un número fijo de
+    palabras para que el coste esté acotado.
+    """
+
+    def __init__(self, patrones, umbral=UMBRAL_SIMILITUD):
+        self.umbral = umbral
+        palabras = {}
+        # Por patrón: (rango, valor, [(id_palabra, peso)], peso total)
+        self._patrones = []
+        for patron, rango, valor in patrones:
+            composicion = []
+            for palabra in set(normalizar(patron).split()):
+                if palabra not in palabras:
+                    palabras[palabra] = len(palabras)
+                composicion.append((palabras[palabra], len(trigramas(palabra))))
+            if composicion:
+                peso = sum(peso for _, peso in composicion)
+                self._patrones.append((rango, valor, composicion, peso))
+
+        self._num_trigramas = [0] * len(palabras)
+        self._indice = {}
+        for palabra, id_palabra in palabras.items():
+            propios = trigramas(palabra)
+            self._num_trigramas[id_palabra] = len(propios)
+            for trigrama in propios:
+                self._indice.setdefault(trigrama, []).append(id_palabra)
+
+        # Patrones en los que aparece cada palabra, para puntuar solo los candidatos
+        self._patrones_de_palabra = [[] for _ in palabras]
+        for i, (_, _, composicion, _) in enumerate(self._patrones):
+            for id_palabra, _ in composicion:
+                self._patrones_de_palabra[id_palabra].append(i)
+
+    def similares(self, texto, k=3):
+        """Hasta ``k`` pares (valor, similitud) por encima del umbral, del más parecido al menos"""
+        palabras_mensaje = []
+        for palabra in normalizar(texto).split():
+            if len(palabra) >= 3 and palabra not in palabras_mensaje:
+                palabras_mensaje.append(palabra[:MAX_LONGITUD_PALABRA])
+                if len(palabras_mensaje) == MAX_PALABRAS_MENSAJE:
+                    break
+
+        # Mejor similitud de cada palabra del índice con alguna palabra del mensaje
+        mejor = {}
+        for palabra in palabras_mensaje:
+            propios = trigramas(palabra)
+            compartidos = {}
+            for trigrama in propios:
+                for id_palabra in self._indice.get(trigrama, ()):
+                    compartidos[id_palabra] = compartidos.get(id_palabra, 0) + 1
+            for id_palabra, comunes in compartidos.items():
+                similitud = 2 * comunes / (len(propios) + self._num_trigramas[id_palabra])
+                if similitud > mejor.get(id_palabra, 0):
+                    mejor[id_palabra] = similitud
+
+        candidatos = {i for id_palabra in mejor for i in self._patrones_de_palabra[id_palabra]}
+        puntuados = []
+        for i in candidatos:
+            rango, valor, composicion, peso = self._patrones[i]
+            similitud = sum(mejor.get(id_palabra, 0) * peso_palabra for id_palabra, peso_palabra in composicion) / peso
+            if similitud >= self.umbral:
+                puntuados.append((similitud, -rango, valor))
+
+        return [(valor, similitud) for similitud, _, valor in heapq.nlargest(k, puntuados, key=lambda p: p[:2])]
+
+    def buscar(self, texto):
+        """Devuelve el valor del patrón más parecido al texto o None"""
+        similares = self.similares(texto, k=1)
+        return similares[0][0] if similares else None
+
+
+class BuscadorIntenciones:
+    """Conjunto de autómatas compilados a partir del catálogo de respuestas.
+
+    - ``general``: claves de respuestas (coincidencia exacta) y, con menor
+      prioridad, las palabras clave. Devuelve ``(clave_respuesta, origen)``
+      donde origen es ``'clave'`` o ``'palabra'``.
+    - ``menu_tratamientos``: claves de respuestas y cada una de sus palabras,
+      con la prioridad de la clave a la que pertenecen.
+    - ``agendar_en_menu`` / ``tratamientos_en_menu``: listas de disparadores
+      del estado ``en_menu_tratamientos``.
+    - ``aproximado``: índice de trigramas con los mismos patrones que
+      ``general`` (salvo ``default``) para cuando no hay coincidencia literal.
+    """
+
+    def __init__(self, respuestas, palabras_clave, agendar_en_menu, tratamientos_en_menu):
+        claves = list(respuestas.keys())
+
+        patrones_generales = [(clave, i, (clave, 'clave')) for i, clave in enumerate(claves)]
+        base = len(claves)
+        for j, (palabra, respuesta_clave) in enumerate(palabras_clave.items()):
+            patrones_generales.append((palabra, base + j, (respuesta_clave, 'palabra')))
+        self.general = AutomataPalabras(patrones_generales)
+        self.aproximado = IndiceTrigramas(p for p in patrones_generales if p[0] != 'default')
+
+        patrones_menu = []
+        for i, clave in enumerate(claves):
+            patrones_menu.append((clave, i, clave))
+            for palabra in clave.split():
+                patrones_menu.append((palabra, i, clave))
+        self.menu_tratamientos = AutomataPalabras(patrones_menu)
+
+        self.agendar_en_menu = AutomataPalabras((p, 0, p) for p in agendar_en_menu)
+        self.tratamientos_en_menu = AutomataPalabras((p, 0, p) for p in tratamientos_en_menu)
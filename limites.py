@@ -0,0 +1,127 @@
+"""
+Límites de peticiones por cliente y rechazo de carga.
+
+``LimitadorPeticiones`` es un cubo de fichas por cliente: cada cliente puede
+hacer una ráfaga de ``rafaga`` peticiones y después recupera ``ritmo`` fichas
+por segundo. Los cubos viven en memoria en un LRU: un cubo que ya se habría
+vuelto a llenar equivale a uno nuevo, así que se descarta al encontrarlo al
+principio del LRU sin necesidad de un hilo de limpieza. Opcionalmente se
+guardan en una tabla SQLite para que todos los workers compartan los mismos
+límites.
+
+``LimitadorConcurrencia`` cuenta las peticiones en curso de un tipo y rechaza
+las nuevas en cuanto superan un máximo, para que una avalancha no ocupe todos
+los hilos del worker y el resto de peticiones sigan respondiendo.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LimitadorPeticiones:
+    """Cubo de fichas por clave en memoria, con tabla SQLite opcional compartida entre procesos"""
+
+    def __init__(self, rafaga, ritmo, max_claves=100000, ruta_sqlite=None):
+        self.rafaga = float(rafaga)
+        self.ritmo = float(ritmo)
+        self.max_claves = max_claves
+        self.ruta_sqlite = ruta_sqlite
+        # Tiempo en que un cubo vacío se vuelve a llenar: pasado ese tiempo no hace falta guardarlo
+        self.tiempo_lleno = self.rafaga / self.ritmo
+        # clave → (fichas, momento de la última actualización)
+        self._cubos = OrderedDict()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        if ruta_sqlite:
+            with self._conectar() as conexion:
+                conexion.execute('PRAGMA journal_mode=WAL')
+                conexion.execute(
+                    'CREATE TABLE IF NOT EXISTS limite (clave TEXT PRIMARY KEY, fichas REAL, actualizado REAL)'
+                )
+
+    @contextmanager
+    def _conectar(self):
+        conexion = sqlite3.connect(self.ruta_sqlite, timeout=1, isolation_level=None)
+        try:
+            yield conexion
+        finally:
+            conexion.close()
+
+    def __len__(self):
+        return len(self._cubos)
+
+    def _rellenar(self, fichas, actualizado, ahora):
+        return min(self.rafaga, fichas + (ahora - actualizado) * self.ritmo)
+
+    def consumir(self, clave, coste=1):
+        """Gasta ``coste`` fichas de la clave; devuelve (permitido, segundos hasta poder repetir)"""
+        if self.ruta_sqlite:
+            return self._consumir_sqlite(clave, coste)
+
+        ahora = time.monotonic()
+        with self._lock:
+            cubo = self._cubos.pop(clave, None)
+            fichas = self.rafaga if cubo is None else self._rellenar(cubo[0], cubo[1], ahora)
+            permitido = fichas >= coste
+            if permitido:
+                fichas -= coste
+            self._cubos[clave] = (fichas, ahora)
+
+            # Caducidad perezosa: los más antiguos ya estarían llenos de nuevo
+            while self._cubos:
+                primero = next(iter(self._cubos.values()))
+                if len(self._cubos) <= self.max_claves and ahora - primero[1] < self.tiempo_lleno:
+                    break
+                self._cubos.popitem(last=False)
+
+        return permitido, 0.0 if permitido else (coste - fichas) / self.ritmo
+
+    def _consumir_sqlite(self, clave, coste):
+        # Reloj de pared: es el único que comparten los procesos
+        ahora = time.time()
+        with self._conectar() as conexion:
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                fila = conexion.execute('SELECT fichas, actualizado FROM limite WHERE clave = ?', (clave,)).fetchone()
+                fichas = self.rafaga if fila is None else self._rellenar(fila[0], fila[1], ahora)
+                permitido = fichas >= coste
+                if permitido:
+                    fichas -= coste
+                conexion.execute('INSERT OR REPLACE INTO limite (clave, fichas, actualizado) VALUES (?, ?, ?)',
+                                 (clave, fichas, ahora))
+                self._escrituras += 1
+                if self._escrituras % 1000 == 0:
+                    conexion.execute('DELETE FROM limite WHERE actualizado < ?', (ahora - self.tiempo_lleno,))
+                conexion.execute('COMMIT')
+            except BaseException:
+                conexion.execute('ROLLBACK')
+                raise
+        return permitido, 0.0 if permitido else (coste - fichas) / self.ritmo
+
+
+class LimitadorConcurrencia:
+    """Número máximo de peticiones simultáneas de un tipo; las que sobran se rechazan sin esperar"""
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._en_curso = 0
+        self._lock = threading.Lock()
+
+    @property
+    def en_curso(self):
+        return self._en_curso
+
+    def entrar(self):
+        """Ocupa un hueco si queda alguno; devuelve si se ha podido"""
+        with self._lock:
+            if self._en_curso >= self.maximo:
+                return False
+            self._en_curso += 1
+            return True
+
+    def salir(self):
+        with self._lock:
+            self._en_curso -= 1
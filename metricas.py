@@ -0,0 +1,150 @@
+"""
+Métricas de las peticiones HTTP en formato de texto de Prometheus.
+
+Cada hilo acumula sus propias cifras (latencia, tamaño de la respuesta y
+consultas SQL por endpoint) sin bloqueos en el camino de la petición; el
+endpoint /metrics suma los acumuladores de todos los hilos al exportar. Las
+cifras son de cada proceso: con varios workers, Prometheus las agrega.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_TAMANO = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# Ayuda y límites de cada histograma
+HISTOGRAMAS = {
+    'http_request_duration_seconds': ('Tiempo hasta la respuesta de cada petición', BUCKETS_LATENCIA),
+    'http_response_size_bytes': ('Tamaño del cuerpo de las respuestas (sin las que se envían por partes)', BUCKETS_TAMANO),
+    'sql_queries_per_request': ('Consultas SQL ejecutadas por petición', BUCKETS_CONSULTAS),
+}
+CONTADORES = {
+    'http_requests_total': 'Peticiones atendidas por código de estado',
+    'sql_query_duration_seconds_total': 'Tiempo total en consultas SQL',
+}
+
+
+class _Acumulador:
+    """Cifras de un solo hilo; solo ese hilo escribe en ellas"""
+
+    def __init__(self):
+        self.histogramas = {}
+        self.contadores = {}
+        # Petición en curso: [consultas, segundos en SQL] o None fuera de una petición
+        self.sql = None
+        self.inicio_sql = None
+
+
+class MetricasPeticiones:
+    """Histogramas y contadores por endpoint acumulados por hilo"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._acumuladores = []
+        self._lock = threading.Lock()
+        self._arranque = time.time()
+
+    def _acumulador(self):
+        acumulador = getattr(self._local, 'acumulador', None)
+        if acumulador is None:
+            acumulador = self._local.acumulador = _Acumulador()
+            with self._lock:
+                self._acumuladores.append(acumulador)
+        return acumulador
+
+    def _observar(self, acumulador, nombre, etiquetas, valor):
+        clave = (nombre, etiquetas)
+        serie = acumulador.histogramas.get(clave)
+        if serie is None:
+            # Un contador por bucket más el de +Inf, la suma y el total
+            serie = acumulador.histogramas[clave] = [[0] * (len(HISTOGRAMAS[nombre][1]) + 1), 0.0, 0]
+        serie[0][bisect_left(HISTOGRAMAS[nombre][1], valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def _sumar(self, acumulador, nombre, etiquetas, valor):
+        clave = (nombre, etiquetas)
+        acumulador.contadores[clave] = acumulador.contadores.get(clave, 0) + valor
+
+    def iniciar_peticion(self):
+        """Empieza a contar las consultas SQL de la petición del hilo actual"""
+        self._acumulador().sql = [0, 0.0]
+
+    def iniciar_consulta(self):
+        acumulador = self._acumulador()
+        if acumulador.sql is not None:
+            acumulador.inicio_sql = time.perf_counter()
+
+    def terminar_consulta(self):
+        acumulador = self._acumulador()
+        if acumulador.sql is not None and acumulador.inicio_sql is not None:
+            acumulador.sql[0] += 1
+            acumulador.sql[1] += time.perf_counter() - acumulador.inicio_sql
+            acumulador.inicio_sql = None
+
+    def terminar_peticion(self, endpoint, metodo, estado, segundos, tamano):
+        """Registra una petición terminada; `tamano` es None si la respuesta va por partes"""
+        acumulador = self._acumulador()
+        etiquetas = (('endpoint', endpoint), ('method', metodo))
+        self._observar(acumulador, 'http_request_duration_seconds', etiquetas, segundos)
+        self._sumar(acumulador, 'http_requests_total', etiquetas + (('status', str(estado)),), 1)
+        if tamano is not None:
+            self._observar(acumulador, 'http_response_size_bytes', etiquetas, tamano)
+        if acumulador.sql is not None:
+            consultas, segundos_sql = acumulador.sql
+            self._observar(acumulador, 'sql_queries_per_request', etiquetas, consultas)
+            self._sumar(acumulador, 'sql_query_duration_seconds_total', etiquetas, segundos_sql)
+            acumulador.sql = None
+
+    def exportar(self):
+        """Texto de todas las métricas en el formato de exposición de Prometheus"""
+        with self._lock:
+            acumuladores = list(self._acumuladores)
+
+        histogramas = {}
+        contadores = {}
+        for acumulador in acumuladores:
+            for clave, (buckets, suma, total) in list(acumulador.histogramas.items()):
+                serie = histogramas.setdefault(clave, [[0] * len(buckets), 0.0, 0])
+                for i, cantidad in enumerate(buckets):
+                    serie[0][i] += cantidad
+                serie[1] += suma
+                serie[2] += total
+            for clave, valor in list(acumulador.contadores.items()):
+                contadores[clave] = contadores.get(clave, 0) + valor
+
+        lineas = [
+            '# HELP process_start_time_seconds Momento de arranque del proceso',
+            '# TYPE process_start_time_seconds gauge',
+            f'process_start_time_seconds {self._arranque:.3f}',
+        ]
+        for nombre, (ayuda, limites) in HISTOGRAMAS.items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} histogram')
+            for (serie_nombre, etiquetas), (buckets, suma, total) in sorted(histogramas.items()):
+                if serie_nombre != nombre:
+                    continue
+                acumulado = 0
+                for limite, cantidad in zip(limites + ('+Inf',), buckets):
+                    acumulado += cantidad
+                    lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", str(limite)),))} {acumulado}')
+                lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {suma:.6f}')
+                lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {total}')
+        for nombre, ayuda in CONTADORES.items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} counter')
+            for (serie_nombre, etiquetas), valor in sorted(contadores.items()):
+                if serie_nombre == nombre:
+                    lineas.append(f'{nombre}{_etiquetas(etiquetas)} {valor:g}')
+        return '\n'.join(lineas) + '\n'
+
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(etiquetas):
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in etiquetas) + '}'
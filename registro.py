@@ -0,0 +1,153 @@
+"""
+Registro estructurado de la aplicación.
+
+Cada mensaje es un evento con un nombre y unos datos que se escribe como una
+línea JSON. El hilo que registra solo encola el mensaje; un hilo en segundo
+plano lo formatea y lo escribe, de modo que una salida lenta no añade
+latencia a las peticiones. Si la cola se llena, los mensajes se descartan y
+se cuentan en lugar de bloquear. Los eventos muy frecuentes pueden llevar una
+tasa de muestreo para registrar solo una parte de ellos.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+NOMBRE_RAIZ = 'clinica'
+
+_cola = None
+_entrada = None
+_manejadores = []
+_oyente = None
+_configurado = False
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por evento con la fecha, el nivel, el origen y los datos"""
+
+    def format(self, record):
+        linea = {
+            'fecha': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': record.levelname,
+            'origen': record.name,
+            'evento': record.getMessage()
+        }
+        linea.update(getattr(record, 'datos', None) or {})
+        if record.exc_info:
+            linea['error'] = self.formatException(record.exc_info)
+        return json.dumps(linea, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    """Formato legible para desarrollo: evento seguido de clave=valor"""
+
+    def format(self, record):
+        datos = ' '.join(f'{clave}={valor}' for clave, valor in (getattr(record, 'datos', None) or {}).items())
+        texto = f'{self.formatTime(record, "%H:%M:%S")} {record.levelname:<7} {record.name} {record.getMessage()} {datos}'.rstrip()
+        if record.exc_info:
+            texto += '\n' + self.formatException(record.exc_info)
+        return texto
+
+
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar solo una fracción de los eventos que indican `muestreo` (entre 0 y 1)"""
+
+    def filter(self, record):
+        muestreo = getattr(record, 'muestreo', None)
+        return muestreo is None or random.random() < muestreo
+
+
+class ColaSinBloqueo(logging.handlers.QueueHandler):
+    """Encola los mensajes sin esperar nunca; cuenta los que no caben"""
+
+    descartados = 0
+
+    def prepare(self, record):
+        # Solo se resuelve el mensaje; el formato completo se hace en el hilo de escritura
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            ColaSinBloqueo.descartados += 1
+
+
+def _crear_cola(capacidad):
+    """Crea la cola de mensajes y el manejador que encola en ella, sustituyendo los anteriores"""
+    global _cola, _entrada
+    raiz = logging.getLogger(NOMBRE_RAIZ)
+    if _entrada is not None:
+        raiz.removeHandler(_entrada)
+    _cola = queue.Queue(capacidad)
+    _entrada = ColaSinBloqueo(_cola)
+    _entrada.addFilter(FiltroMuestreo())
+    raiz.addHandler(_entrada)
+
+
+def _iniciar_oyente():
+    """Arranca el hilo que escribe los mensajes encolados"""
+    global _oyente
+    _oyente = logging.handlers.QueueListener(_cola, *_manejadores, respect_handler_level=True)
+    _oyente.start()
+
+
+def _tras_fork():
+    """En cada worker, una cola nueva y su propio hilo de escritura.
+
+    Los hilos no sobreviven a fork() y los locks internos de la cola heredada
+    pueden haberse copiado ocupados por el hilo de escritura del proceso padre.
+    """
+    _crear_cola(_cola.maxsize)
+    _iniciar_oyente()
+
+
+def configurar_registro(nivel=None, formato=None, capacidad=10000):
+    """Configura el registro de la aplicación (solo la primera vez que se llama).
+
+    El nivel por defecto es LOG_LEVEL o INFO (DEBUG con FLASK_ENV=development)
+    y el formato LOG_FORMATO: 'json' (por defecto) o 'texto'.
+    """
+    global _configurado
+    raiz = logging.getLogger(NOMBRE_RAIZ)
+    if _configurado:
+        return raiz
+
+    _configurado = True
+    desarrollo = os.getenv('FLASK_ENV') == 'development'
+    nivel = nivel or os.getenv('LOG_LEVEL') or ('DEBUG' if desarrollo else 'INFO')
+    formato = formato or os.getenv('LOG_FORMATO', 'texto' if desarrollo else 'json')
+
+    salida = logging.StreamHandler(sys.stderr)
+    salida.setFormatter(FormatoJSON() if formato == 'json' else FormatoTexto())
+    _manejadores.append(salida)
+
+    _crear_cola(capacidad)
+    raiz.setLevel(nivel.upper())
+    raiz.propagate = False
+
+    _iniciar_oyente()
+    os.register_at_fork(after_in_child=_tras_fork)
+    atexit.register(detener_registro)
+    return raiz
+
+
+def detener_registro():
+    """Escribe los mensajes pendientes y detiene el hilo de escritura"""
+    global _oyente
+    if _oyente is not None:
+        _oyente.stop()
+        _oyente = None
+
+
+def obtener_registro(nombre):
+    """Logger de un módulo de la aplicación"""
+    return logging.getLogger(f'{NOMBRE_RAIZ}.{nombre}')
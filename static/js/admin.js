@@ -0,0 +1,139 @@
+// Cargar estadísticas al iniciar
+document.addEventListener('DOMContentLoaded', function() {
+    loadStats();
+    connectEvents();
+});
+
+// Recargar las estadísticas cuando se crea o cambia una cita (agrupando ráfagas)
+let statsTimeout = null;
+let eventSource = null;
+
+function connectEvents() {
+    if (!window.EventSource) return;
+
+    const scheduleStats = () => {
+        clearTimeout(statsTimeout);
+        statsTimeout = setTimeout(loadStats, 1000);
+    };
+    eventSource = new EventSource('/api/eventos');
+    eventSource.addEventListener('cita_creada', scheduleStats);
+    eventSource.addEventListener('cita_actualizada', scheduleStats);
+    eventSource.addEventListener('recargar', scheduleStats);
+}
+
+// Si no hay canal de eventos abierto (por ejemplo, el servidor ha respondido 503), actualizar cada 30 segundos
+setInterval(() => {
+    if (!eventSource || eventSource.readyState !== EventSource.OPEN) {
+        loadStats();
+    }
+}, 30000);
+
+function loadStats() {
+    fetch('/api/database-stats')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                showError(data.error);
+            } else {
+                displayStats(data);
+                displayRecentCitas(data.ultimas_citas);
+            }
+        })
+        .catch(error => {
+            showError('Error al cargar las estadísticas: ' + error.message);
+        });
+}
+
+function displayStats(data) {
+    const statsGrid = document.getElementById('statsGrid');
+    statsGrid.innerHTML = `
+        <div class="stat-card">
+            <div class="stat-number">${data.total_citas}</div>
+            <div class="stat-label">Total de Citas</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">${data.citas_pendientes}</div>
+            <div class="stat-label">Citas Pendientes</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">${data.citas_confirmadas}</div>
+            <div class="stat-label">Citas Confirmadas</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">${data.citas_canceladas}</div>
+            <div class="stat-label">Citas Canceladas</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">${data.revisiones}</div>
+            <div class="stat-label">Revisiones Generales</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-number">${data.padecimientos}</div>
+            <div class="stat-label">Consultas por Padecimiento</div>
+        </div>
+    `;
+}
+
+function displayRecentCitas(citas) {
+    const recentCitasDiv = document.getElementById('recentCitas');
+
+    if (citas.length === 0) {
+        recentCitasDiv.innerHTML = '<div style="padding: 20px; text-align: center; color: #666;">No hay citas registradas</div>';
+        return;
+    }
+
+    let html = '';
+    citas.forEach(cita => {
+        const estadoClass = `estado-${cita.estado}`;
+        const tipoText = cita.tipo === 'revision' ? 'Revisión General' : 'Padecimiento';
+
+        html += `
+            <div class="cita-item">
+                <div class="cita-info">
+                    <div class="cita-nombre">${cita.nombre}</div>
+                    <div class="cita-details">
+                        ${cita.fecha} a las ${cita.hora} - ${tipoText}
+                    </div>
+                </div>
+                <div class="cita-estado ${estadoClass}">
+                    ${cita.estado.toUpperCase()}
+                </div>
+            </div>
+        `;
+    });
+
+    recentCitasDiv.innerHTML = html;
+}
+
+function refreshStats() {
+    const btn = event.target;
+    const originalText = btn.innerHTML;
+    btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Actualizando...';
+    btn.disabled = true;
+
+    loadStats();
+
+    setTimeout(() => {
+        btn.innerHTML = originalText;
+        btn.disabled = false;
+    }, 1000);
+}
+
+function exportToCSV() {
+    // Descargar directamente desde el servidor
+    window.location.href = '/export-csv';
+}
+
+
+
+function showError(message) {
+    const adminBody = document.querySelector('.admin-body');
+    const errorDiv = document.createElement('div');
+    errorDiv.className = 'error';
+    errorDiv.innerHTML = `<i class="fas fa-exclamation-triangle"></i> ${message}`;
+    adminBody.insertBefore(errorDiv, adminBody.firstChild);
+
+    setTimeout(() => {
+        errorDiv.remove();
+    }, 5000);
+}
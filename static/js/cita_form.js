@@ -0,0 +1,139 @@
+let fechaActual = new Date();
+let mesActual = fechaActual.getMonth();
+let añoActual = fechaActual.getFullYear();
+let fechaSeleccionada = null;
+
+// Nombres de los meses
+const meses = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 
+              'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'];
+
+// Inicializar calendario
+document.addEventListener('DOMContentLoaded', function() {
+    mostrarCalendario();
+    cargarHorasDisponibles();
+});
+
+function mostrarCalendario() {
+    const primerDia = new Date(añoActual, mesActual, 1);
+    const ultimoDia = new Date(añoActual, mesActual + 1, 0);
+    const primerDiaSemana = primerDia.getDay();
+    const diasEnMes = ultimoDia.getDate();
+
+    // Ajustar para que Lunes sea 1 y Domingo sea 7
+    let primerDiaSemanaAjustado = primerDiaSemana;
+    if (primerDiaSemana === 0) primerDiaSemanaAjustado = 7;
+
+    // Actualizar título del mes
+    document.getElementById('mesActual').textContent = `${meses[mesActual]} ${añoActual}`;
+
+    // Generar días del calendario
+    const calendarDays = document.getElementById('calendar-days');
+    calendarDays.innerHTML = '';
+
+    // Agregar espacios vacíos para alinear con los días de la semana
+    for (let i = 1; i < primerDiaSemanaAjustado; i++) {
+        const emptyDay = document.createElement('div');
+        emptyDay.className = 'calendar-day disabled';
+        calendarDays.appendChild(emptyDay);
+    }
+
+    // Agregar días del mes
+    for (let dia = 1; dia <= diasEnMes; dia++) {
+        const dayElement = document.createElement('div');
+        dayElement.className = 'calendar-day';
+        dayElement.textContent = dia;
+
+        const fechaCompleta = new Date(añoActual, mesActual, dia);
+        const diaSemana = fechaCompleta.getDay();
+        const esHoy = esFechaHoy(fechaCompleta);
+        const esPasado = fechaCompleta < new Date(fechaActual.getFullYear(), fechaActual.getMonth(), fechaActual.getDate());
+        const esDomingo = diaSemana === 0;
+
+        // Aplicar clases según el estado del día
+        if (esPasado) {
+            dayElement.classList.add('disabled');
+        } else if (esDomingo) {
+            dayElement.classList.add('disabled');
+        } else if (esHoy) {
+            dayElement.classList.add('today');
+        } else {
+            dayElement.classList.add('available');
+
+            // Agregar evento de clic
+            dayElement.addEventListener('click', function() {
+                seleccionarFecha(fechaCompleta, this);
+            });
+        }
+
+        calendarDays.appendChild(dayElement);
+    }
+}
+
+function cambiarMes(direccion) {
+    mesActual += direccion;
+
+    if (mesActual > 11) {
+        mesActual = 0;
+        añoActual++;
+    } else if (mesActual < 0) {
+        mesActual = 11;
+        añoActual--;
+    }
+
+    mostrarCalendario();
+}
+
+function seleccionarFecha(fecha, elemento) {
+    // Remover selección anterior
+    document.querySelectorAll('.calendar-day.selected').forEach(day => {
+        day.classList.remove('selected');
+    });
+
+    // Seleccionar nueva fecha
+    elemento.classList.add('selected');
+    fechaSeleccionada = fecha;
+
+    // Actualizar campo oculto
+    const fechaFormato = fecha.toISOString().split('T')[0];
+    document.getElementById('fecha').value = fechaFormato;
+
+    // Cargar horas disponibles para la fecha seleccionada
+    cargarHorasDisponibles(fechaFormato);
+}
+
+function esFechaHoy(fecha) {
+    const hoy = new Date();
+    return fecha.getDate() === hoy.getDate() &&
+           fecha.getMonth() === hoy.getMonth() &&
+           fecha.getFullYear() === hoy.getFullYear();
+}
+
+function cargarHorasDisponibles(fecha = null) {
+    if (!fecha) return;
+
+    fetch(`/api/horas-disponibles/${fecha}`)
+        .then(response => response.json())
+        .then(data => {
+            const horaSelect = document.getElementById('hora');
+            horaSelect.innerHTML = '<option value="">Selecciona una hora</option>';
+
+            data.horas.forEach(hora => {
+                const option = document.createElement('option');
+                option.value = hora;
+                option.textContent = hora;
+                horaSelect.appendChild(option);
+            });
+        })
+        .catch(error => {
+            console.error('Error al cargar horas:', error);
+        });
+}
+
+// Validar formulario antes de enviar
+document.querySelector('form').addEventListener('submit', function(e) {
+    if (!fechaSeleccionada) {
+        e.preventDefault();
+        alert('Por favor selecciona una fecha');
+        return false;
+    }
+});
@@ -0,0 +1,241 @@
+let datosCita = {
+    nombre: '',
+    telefono: '',
+    email: '',
+    tipo_cita: '',
+    fecha: '',
+    hora: ''
+};
+
+let pasoActual = 1;
+
+// Obtener tipo de cita de la URL
+function obtenerTipoCita() {
+    const urlParams = new URLSearchParams(window.location.search);
+    return urlParams.get('tipo') || 'revision';
+}
+
+// Inicializar
+document.addEventListener('DOMContentLoaded', function() {
+    datosCita.tipo_cita = obtenerTipoCita();
+});
+
+// Manejo del formulario de datos
+document.getElementById('formDatos').addEventListener('submit', function(e) {
+    e.preventDefault();
+
+    datosCita.nombre = document.getElementById('nombre').value;
+    datosCita.telefono = document.getElementById('telefono').value;
+    datosCita.email = document.getElementById('email').value;
+
+    siguientePaso();
+});
+
+function siguientePaso() {
+    document.getElementById(`step${pasoActual}`).classList.remove('active');
+    pasoActual++;
+    document.getElementById(`step${pasoActual}`).classList.add('active');
+
+    if (pasoActual === 2) {
+        cargarDiasDisponibles();
+    } else if (pasoActual === 3) {
+        cargarHorasDisponibles();
+    } else if (pasoActual === 4) {
+        mostrarResumen();
+    }
+}
+
+function anteriorPaso() {
+    document.getElementById(`step${pasoActual}`).classList.remove('active');
+    pasoActual--;
+    document.getElementById(`step${pasoActual}`).classList.add('active');
+}
+
+async function cargarDiasDisponibles() {
+    try {
+        const response = await fetch('/api/dias-disponibles');
+        const data = await response.json();
+
+        const calendar = document.getElementById('calendar');
+        calendar.innerHTML = '';
+
+        // Agregar encabezados de días de la semana
+        const diasSemana = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb'];
+        diasSemana.forEach(dia => {
+            const header = document.createElement('div');
+            header.className = 'calendar-header';
+            header.textContent = dia;
+            calendar.appendChild(header);
+        });
+
+        // Agrupar días por semana
+        const semanas = [];
+        let semanaActual = [];
+
+        data.dias.forEach((dia, index) => {
+            semanaActual.push(dia);
+
+            if (semanaActual.length === 6 || index === data.dias.length - 1) {
+                semanas.push([...semanaActual]);
+                semanaActual = [];
+            }
+        });
+
+        // Crear calendario
+        semanas.forEach(semana => {
+            semana.forEach(dia => {
+                const dayElement = document.createElement('div');
+                dayElement.className = 'calendar-day';
+                dayElement.innerHTML = `
+                    <div>${dia.dia_mes}</div>
+                    <div style="font-size: 10px; color: #666;">${dia.dia_semana}</div>
+                `;
+                // Los días sin huecos libres se muestran deshabilitados
+                if (dia.libres === 0) {
+                    dayElement.classList.add('disabled');
+                } else {
+                    dayElement.onclick = () => seleccionarFecha(dia.fecha, dayElement);
+                }
+                calendar.appendChild(dayElement);
+            });
+        });
+
+    } catch (error) {
+        document.getElementById('calendar').innerHTML = '<div class="error">Error al cargar las fechas disponibles</div>';
+    }
+}
+
+function seleccionarFecha(fecha, element) {
+    // Remover selección anterior
+    document.querySelectorAll('.calendar-day').forEach(day => day.classList.remove('selected'));
+
+    // Seleccionar nueva fecha
+    element.classList.add('selected');
+    datosCita.fecha = fecha;
+
+    setTimeout(() => {
+        siguientePaso();
+    }, 500);
+}
+
+async function cargarHorasDisponibles() {
+    try {
+        const response = await fetch(`/api/horas-disponibles/${datosCita.fecha}`);
+        const data = await response.json();
+
+        const horasContainer = document.getElementById('horas');
+        horasContainer.innerHTML = '';
+
+        if (data.horas.length === 0) {
+            horasContainer.innerHTML = '<div class="error">No hay horas disponibles para esta fecha. Por favor, selecciona otra fecha.</div>';
+            return;
+        }
+
+        data.horas.forEach(hora => {
+            const hourBtn = document.createElement('button');
+            hourBtn.className = 'hour-btn';
+            hourBtn.textContent = hora;
+            hourBtn.onclick = () => seleccionarHora(hora, hourBtn);
+            horasContainer.appendChild(hourBtn);
+        });
+
+    } catch (error) {
+        document.getElementById('horas').innerHTML = '<div class="error">Error al cargar las horas disponibles</div>';
+    }
+}
+
+function seleccionarHora(hora, element) {
+    // Remover selección anterior
+    document.querySelectorAll('.hour-btn').forEach(btn => btn.classList.remove('selected'));
+
+    // Seleccionar nueva hora
+    element.classList.add('selected');
+    datosCita.hora = hora;
+
+    setTimeout(() => {
+        siguientePaso();
+    }, 500);
+}
+
+function mostrarResumen() {
+    const resumen = document.getElementById('resumenCita');
+    const fecha = new Date(datosCita.fecha);
+    const opciones = { weekday: 'long', year: 'numeric', month: 'long', day: 'numeric' };
+
+    resumen.innerHTML = `
+        <div class="resumen-item">
+            <span class="resumen-label">Nombre:</span>
+            <span class="resumen-value">${datosCita.nombre}</span>
+        </div>
+        <div class="resumen-item">
+            <span class="resumen-label">Teléfono:</span>
+            <span class="resumen-value">${datosCita.telefono}</span>
+        </div>
+        <div class="resumen-item">
+            <span class="resumen-label">Email:</span>
+            <span class="resumen-value">${datosCita.email}</span>
+        </div>
+        <div class="resumen-item">
+            <span class="resumen-label">Tipo de cita:</span>
+            <span class="resumen-value">${datosCita.tipo_cita === 'revision' ? 'Revisión general' : 'Consulta por padecimiento'}</span>
+        </div>
+        <div class="resumen-item">
+            <span class="resumen-label">Fecha:</span>
+            <span class="resumen-value">${fecha.toLocaleDateString('es-ES', opciones)}</span>
+        </div>
+        <div class="resumen-item">
+            <span class="resumen-label">Hora:</span>
+            <span class="resumen-value">${datosCita.hora}</span>
+        </div>
+    `;
+}
+
+async function confirmarCita() {
+    try {
+        const response = await fetch('/api/guardar-cita', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(datosCita)
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            // Mostrar resumen final
+            const resumenFinal = document.getElementById('resumenFinal');
+            const fecha = new Date(datosCita.fecha);
+            const opciones = { weekday: 'long', year: 'numeric', month: 'long', day: 'numeric' };
+
+            resumenFinal.innerHTML = `
+                <div class="resumen-item">
+                    <span class="resumen-label">Número de cita:</span>
+                    <span class="resumen-value">#${data.cita_id}</span>
+                </div>
+                <div class="resumen-item">
+                    <span class="resumen-label">Nombre:</span>
+                    <span class="resumen-value">${datosCita.nombre}</span>
+                </div>
+                <div class="resumen-item">
+                    <span class="resumen-label">Fecha:</span>
+                    <span class="resumen-value">${fecha.toLocaleDateString('es-ES', opciones)}</span>
+                </div>
+                <div class="resumen-item">
+                    <span class="resumen-label">Hora:</span>
+                    <span class="resumen-value">${datosCita.hora}</span>
+                </div>
+            `;
+
+            siguientePaso();
+        } else {
+            alert('Error al guardar la cita: ' + data.error);
+        }
+    } catch (error) {
+        alert('Error al confirmar la cita. Por favor, inténtalo de nuevo.');
+    }
+}
+
+function volverAlChat() {
+    window.location.href = '/';
+}
@@ -0,0 +1,992 @@
+let isTyping = false;
+
+function closeChat() {
+    if (confirm('¿Estás seguro de que quieres cerrar el chat?')) {
+        window.close();
+    }
+}
+
+function showLocations() {
+    // Limpiar el chat y activar botón volver
+    limpiarChat();
+    activarBotonVolver();
+
+    const modal = document.getElementById('locationModal');
+    modal.style.display = 'flex';
+}
+
+function closeLocationModal() {
+    const modal = document.getElementById('locationModal');
+    modal.style.display = 'none';
+}
+
+// Cerrar modal al hacer clic fuera de él
+document.addEventListener('click', function(event) {
+    const modal = document.getElementById('locationModal');
+    if (event.target === modal) {
+        closeLocationModal();
+    }
+});
+
+function sendQuickMessage(message) {
+    // Limpiar el chat y activar botón volver si es una opción del menú principal
+    if (message === 'Información sobre tratamientos' || 
+        message === 'Solicitar una cita' || 
+        message === 'Información sobre financiación' ||
+        message === 'Preguntas frecuentes' ||
+        message === 'Ver ubicaciones') {
+        limpiarChat();
+        activarBotonVolver();
+    }
+
+    addMessage(message, 'user');
+    sendToAPI(message);
+}
+
+function sendMessage() {
+    const input = document.getElementById('messageInput');
+    const message = input.value.trim();
+
+    if (message) {
+        // Limpiar el chat y activar botón volver si es una opción del menú principal
+        if (message === 'Información sobre tratamientos' || 
+            message === 'Solicitar una cita' || 
+            message === 'Información sobre financiación' ||
+            message === 'Preguntas frecuentes' ||
+            message === 'Ver ubicaciones') {
+            limpiarChat();
+            activarBotonVolver();
+        }
+
+        addMessage(message, 'user');
+        input.value = '';
+        sendToAPI(message);
+    }
+}
+
+function handleKeyPress(event) {
+    if (event.key === 'Enter') {
+        sendMessage();
+    }
+}
+
+function addMessage(message, sender, showQuickReplies = false, showFormButton = false, showCalendar = false, showHours = false, showConfirmation = false, showInputPadecimiento = false, imagenes = [], showBotonesFAQ = false) {
+    const chatMessages = document.getElementById('chatMessages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${sender}-message`;
+
+    // Crear el contenido del mensaje
+    const messageContent = document.createElement('div');
+    messageContent.textContent = message;
+    messageDiv.appendChild(messageContent);
+
+    // Agregar imágenes si existen
+    console.log('addMessage - imágenes recibidas:', imagenes);
+    if (imagenes && imagenes.length > 0) {
+        console.log('Creando contenedor de imágenes con', imagenes.length, 'imágenes');
+        const imagesContainer = document.createElement('div');
+        imagesContainer.className = 'treatment-images';
+        imagesContainer.style.cssText = 'display: flex; gap: 10px; margin-top: 10px; overflow-x: auto; padding: 5px;';
+
+        imagenes.forEach((img, index) => {
+            console.log('Procesando imagen:', img);
+            const imgDiv = document.createElement('div');
+            imgDiv.style.cssText = 'flex-shrink: 0; text-align: center;';
+
+            const imgElement = document.createElement('img');
+            imgElement.src = img.url;
+            imgElement.alt = img.alt;
+            imgElement.loading = 'lazy';
+            imgElement.decoding = 'async';
+            if (img.ancho && img.alto) {
+                imgElement.width = img.ancho;
+                imgElement.height = img.alto;
+            }
+            if (img.srcset) {
+                imgElement.srcset = img.srcset;
+                imgElement.sizes = '150px';
+            }
+            imgElement.style.cssText = 'width: 150px; height: 120px; object-fit: cover; border-radius: 8px; border: 2px solid #e9ecef;';
+
+            // WebP para los navegadores que lo admiten y JPEG para el resto
+            let imagen = imgElement;
+            if (img.srcset_webp) {
+                imagen = document.createElement('picture');
+                const webp = document.createElement('source');
+                webp.type = 'image/webp';
+                webp.srcset = img.srcset_webp;
+                webp.sizes = '150px';
+                imagen.appendChild(webp);
+                imagen.appendChild(imgElement);
+            }
+            // La versión grande se abre al pulsar la miniatura
+            if (img.grande) {
+                const enlace = document.createElement('a');
+                enlace.href = img.grande;
+                enlace.target = '_blank';
+                enlace.rel = 'noopener';
+                enlace.appendChild(imagen);
+                imagen = enlace;
+            }
+
+            const caption = document.createElement('div');
+            caption.textContent = img.alt;
+            caption.style.cssText = 'font-size: 12px; color: #666; margin-top: 5px; text-align: center;';
+
+            imgDiv.appendChild(imagen);
+            imgDiv.appendChild(caption);
+            imagesContainer.appendChild(imgDiv);
+        });
+
+        messageDiv.appendChild(imagesContainer);
+        console.log('Contenedor de imágenes agregado al mensaje');
+    }
+
+    // Agregar botones de respuesta rápida si es necesario
+    if (showQuickReplies && sender === 'bot') {
+        const quickRepliesDiv = document.createElement('div');
+        quickRepliesDiv.className = 'quick-reply-buttons';
+
+        // Verificar qué tipo de botones mostrar
+        if (message.includes('¿Ya tienes un tratamiento abierto con nuestra clínica?')) {
+            quickRepliesDiv.innerHTML = `
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Sí, ya tengo tratamiento')">Sí, ya tengo tratamiento</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('No, es mi primera vez')">No, es mi primera vez</button>
+            `;
+        } else if (message.includes('¿Tu cita es para una revisión general periódica o tienes algún padecimiento específico que te gustaría consultar?')) {
+            quickRepliesDiv.innerHTML = `
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Revisión general periódica')">Revisión general periódica</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Tengo algún padecimiento')">Tengo algún padecimiento</button>
+            `;
+        } else if (message.includes('¿Sobre qué tratamiento específico te gustaría saber más?')) {
+            quickRepliesDiv.innerHTML = `
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Limpieza dental')">Limpieza dental</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Empastes')">Empastes</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Ortodoncia')">Ortodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Cirugía oral')">Cirugía oral</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Blanqueamiento')">Blanqueamiento</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Endodoncia')">Endodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Periodoncia')">Periodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Implantes dentales')">Implantes dentales</button>
+            `;
+        } else if (message.includes('¿Te gustaría agendar una cita para que un especialista pueda revisar tu caso personalmente?')) {
+            quickRepliesDiv.innerHTML = `
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Sí, quiero agendar una cita')">Sí, quiero agendar una cita</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('No, gracias')">No, gracias</button>
+            `;
+        } else if (message.includes('¿Sobre qué tratamiento específico te gustaría saber más?')) {
+            quickRepliesDiv.innerHTML = `
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Limpieza dental')">Limpieza dental</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Empastes')">Empastes</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Ortodoncia')">Ortodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Cirugía oral')">Cirugía oral</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Blanqueamiento')">Blanqueamiento</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Endodoncia')">Endodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Periodoncia')">Periodoncia</button>
+                <button class="quick-reply-btn" onclick="sendQuickMessage('Implantes dentales')">Implantes dentales</button>
+            `;
+        }
+
+        messageDiv.appendChild(quickRepliesDiv);
+    }
+
+    // Mostrar input de padecimiento si corresponde
+    if (showInputPadecimiento && sender === 'bot') {
+        console.log('Mostrando input de padecimiento');
+        setTimeout(() => {
+            mostrarInputPadecimiento();
+        }, 300);
+    }
+
+    // Agregar calendario si es necesario
+    if (showCalendar && sender === 'bot') {
+        setTimeout(() => {
+            mostrarCalendarioEnChat();
+        }, 500);
+    }
+
+    // Agregar selector de horas si es necesario
+    if (showHours && sender === 'bot') {
+        setTimeout(() => {
+            mostrarHorasEnChat();
+        }, 500);
+    }
+
+    // Agregar botones de confirmación si es necesario
+    if (showConfirmation && sender === 'bot') {
+        const confirmationDiv = document.createElement('div');
+        confirmationDiv.className = 'quick-reply-buttons';
+        confirmationDiv.innerHTML = `
+            <button class="quick-reply-btn" onclick="confirmarCita()" style="background: #28a745; color: white; border-color: #28a745;">
+                ✅ Sí, confirmar cita
+            </button>
+            <button class="quick-reply-btn" onclick="cancelarCita()" style="background: #dc3545; color: white; border-color: #dc3545;">
+                ❌ Cancelar
+            </button>
+        `;
+        messageDiv.appendChild(confirmationDiv);
+    }
+
+    // Agregar botones de FAQ si es necesario
+    if (showBotonesFAQ && sender === 'bot') {
+        const faqDiv = document.createElement('div');
+        faqDiv.className = 'quick-reply-buttons';
+        faqDiv.innerHTML = `
+            <button class="quick-reply-btn" onclick="sendQuickMessage('limpieza dental duración')">
+                ⏱️ ¿Cuánto dura una limpieza?
+            </button>
+            <button class="quick-reply-btn" onclick="sendQuickMessage('blanqueamiento dolor')">
+                🦷 ¿Es doloroso el blanqueamiento?
+            </button>
+            <button class="quick-reply-btn" onclick="sendQuickMessage('ortodoncia duración')">
+                ⏰ ¿Cuánto dura la ortodoncia?
+            </button>
+            <button class="quick-reply-btn" onclick="sendQuickMessage('empaste anestesia')">
+                💉 ¿Necesito anestesia para empaste?
+            </button>
+            <button class="quick-reply-btn" onclick="sendQuickMessage('frecuencia visitas')">
+                📅 ¿Con qué frecuencia debo ir?
+            </button>
+            <button class="quick-reply-btn" onclick="sendQuickMessage('emergencia dolor')">
+                🚨 ¿Qué hago en emergencia?
+            </button>
+        `;
+        messageDiv.appendChild(faqDiv);
+    }
+
+    chatMessages.appendChild(messageDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+function showTypingIndicator() {
+    const indicator = document.getElementById('typingIndicator');
+    indicator.style.display = 'block';
+    document.getElementById('chatMessages').scrollTop = document.getElementById('chatMessages').scrollHeight;
+}
+
+function hideTypingIndicator() {
+    const indicator = document.getElementById('typingIndicator');
+    indicator.style.display = 'none';
+}
+
+// Envía un mensaje al chat: solo el identificador de la conversación si el
+// servidor ya la tiene o, si no, el estado completo para que la guarde
+function enviarMensajeChat(message) {
+    const cuerpo = conversacionId
+        ? { message: message, conversacion_id: conversacionId, version: versionConversacion }
+        : { message: message, estado: estadoConversacion, datos_cita: datosCita, usar_conversacion: true };
+    return fetch('/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(cuerpo)
+    });
+}
+
+async function sendToAPI(message) {
+    if (isTyping) return;
+
+    isTyping = true;
+    showTypingIndicator();
+
+    try {
+        // Manejar el flujo de citas
+        if (pasoCita > 0) {
+            manejarFlujoCitas(message);
+            hideTypingIndicator();
+            return;
+        }
+
+        let response = await enviarMensajeChat(message);
+        if (response.status === 409) {
+            // El servidor ya no tiene la conversación: reenviar el estado completo
+            conversacionId = null;
+            response = await enviarMensajeChat(message);
+        }
+
+        const data = await response.json();
+
+        hideTypingIndicator();
+
+        if (response.status === 429 || response.status === 503) {
+            // Límite de peticiones o servidor saturado: el mensaje indica que hay que esperar
+            addMessage(data.error, 'bot');
+        } else if (data.error) {
+            addMessage('Lo siento, ha ocurrido un error. Por favor, inténtalo de nuevo.', 'bot');
+        } else {
+            // Actualizar estado de la conversación
+            if (data.estado) {
+                estadoConversacion = data.estado;
+                console.log('Estado actualizado:', estadoConversacion);
+            }
+
+            // Con la conversación guardada en el servidor solo llegan los cambios
+            if (data.conversacion_id) {
+                conversacionId = data.conversacion_id;
+                versionConversacion = data.version;
+            }
+
+            // Actualizar datos de la cita
+            if (data.datos_cita) {
+                datosCita = { ...datosCita, ...data.datos_cita };
+                console.log('Datos de cita actualizados:', datosCita);
+            }
+            (data.datos_cita_eliminados || []).forEach(campo => delete datosCita[campo]);
+
+            // Verificar si el mensaje contiene preguntas que requieren botones de respuesta rápida
+            const showQuickReplies = data.response.includes('¿Ya tienes un tratamiento abierto con nuestra clínica?') || 
+               data.response.includes('¿Tu cita es para una revisión general periódica o tienes algún padecimiento específico que te gustaría consultar?') ||
+               data.response.includes('¿Sobre qué tratamiento específico te gustaría saber más?') ||
+               data.response.includes('¿Te gustaría agendar una cita para que un especialista pueda revisar tu caso personalmente?');
+
+            // Verificar qué elementos mostrar
+            const showCalendar = data.mostrar_calendario;
+            const showHours = data.mostrar_horas;
+            const showConfirmation = data.mostrar_confirmacion;
+            const limpiarPantalla = data.limpiar_pantalla;
+            const showInputPadecimiento = data.mostrar_input_padecimiento;
+            const showBotonesFAQ = data.mostrar_botones_faq;
+
+            console.log('Backend response:', data);
+            console.log('showInputPadecimiento:', showInputPadecimiento);
+            console.log('showBotonesFAQ:', showBotonesFAQ);
+
+            // Si se debe limpiar la pantalla, hacerlo antes de agregar el mensaje
+            if (limpiarPantalla) {
+                document.getElementById('chatMessages').innerHTML = '';
+            }
+
+            addMessage(data.response, 'bot', showQuickReplies, false, showCalendar, showHours, showConfirmation, showInputPadecimiento, data.imagenes || [], showBotonesFAQ);
+
+            // Debug: mostrar la respuesta del chatbot
+            console.log('Respuesta del chatbot:', data.response);
+            console.log('Imágenes recibidas:', data.imagenes);
+
+
+        }
+    } catch (error) {
+        hideTypingIndicator();
+        addMessage('Lo siento, no puedo conectarme al servidor en este momento. Por favor, inténtalo más tarde.', 'bot');
+    } finally {
+        isTyping = false;
+    }
+}
+
+// Función para manejar el flujo de citas
+function manejarFlujoCitas(message) {
+    switch (pasoCita) {
+        case 1: // Fecha y hora ya seleccionadas, ahora pedir nombre
+            datosCita.nombre = message;
+            addMessage(`Gracias ${message}. Ahora necesito tu número de teléfono de contacto.`, 'bot');
+            pasoCita = 2;
+            break;
+
+        case 2: // Teléfono
+            datosCita.telefono = message;
+            addMessage('Perfecto. Ahora necesito tu dirección de email para enviarte la confirmación de la cita.', 'bot');
+            pasoCita = 3;
+            break;
+
+        case 3: // Email
+            datosCita.email = message;
+            addMessage('¡Excelente! Tu cita ha sido programada exitosamente. Recibirás una confirmación por email.', 'bot');
+            // Guardar la cita en la base de datos
+            guardarCitaFinal();
+            break;
+
+        default:
+            // Si no está en el flujo de citas, enviar al API normal
+            sendToAPI(message);
+            break;
+    }
+}
+
+// Variables para el flujo de citas
+let datosCita = {
+    nombre: '',
+    telefono: '',
+    email: '',
+    tipo_cita: '',
+    fecha: '',
+    fechaMostrar: '',
+    hora: ''
+};
+let estadoConversacion = 'inicial';
+// Conversación guardada en el servidor (se olvida cada vez que se reinician los datos)
+let conversacionId = null;
+let versionConversacion = 0;
+let pasoCita = 0; // 0: no iniciado, 1: fecha/hora, 2: nombre, 3: telefono, 4: email
+
+// Enfocar el input al cargar la página
+document.addEventListener('DOMContentLoaded', function() {
+    // El input está comentado, así que no intentamos enfocarlo
+    // document.getElementById('messageInput').focus();
+
+    // Manejar el teclado virtual en móviles
+    const messageInput = document.getElementById('messageInput');
+    const chatContainer = document.querySelector('.chat-container');
+
+    // Solo agregar event listener si el elemento existe
+    if (messageInput) {
+        // Ajustar la vista cuando aparece el teclado virtual
+        messageInput.addEventListener('focus', function() {
+            if (window.innerWidth <= 768) {
+                setTimeout(() => {
+                    chatContainer.scrollIntoView({ behavior: 'smooth', block: 'end' });
+                }, 300);
+            }
+        });
+    }
+
+    // Prevenir zoom en iOS
+    document.addEventListener('gesturestart', function(e) {
+        e.preventDefault();
+    });
+
+    // Ajustar altura en dispositivos móviles
+    function adjustMobileHeight() {
+        if (window.innerWidth <= 768) {
+            const vh = window.innerHeight * 0.01;
+            document.documentElement.style.setProperty('--vh', `${vh}px`);
+        }
+    }
+
+    adjustMobileHeight();
+    window.addEventListener('resize', adjustMobileHeight);
+});
+
+
+
+
+
+
+
+// Función para mostrar calendario en el chat
+function mostrarCalendarioEnChat() {
+    const chatMessages = document.getElementById('chatMessages');
+    const calendarDiv = document.createElement('div');
+    calendarDiv.className = 'message bot-message';
+    calendarDiv.innerHTML = `
+        <div style="margin-bottom: 10px;">Selecciona una fecha disponible:</div>
+        <div class="calendar-container" style="max-width: 300px; margin: 0 auto;">
+            <div class="calendar-header">
+                <button type="button" class="calendar-nav" onclick="cambiarMesChat(-1)">‹</button>
+                <h3 id="mesActualChat"></h3>
+                <button type="button" class="calendar-nav" onclick="cambiarMesChat(1)">›</button>
+            </div>
+            <div class="calendar-grid">
+                <div class="calendar-weekdays">
+                    <div>Lun</div>
+                    <div>Mar</div>
+                    <div>Mié</div>
+                    <div>Jue</div>
+                    <div>Vie</div>
+                    <div>Sáb</div>
+                </div>
+                <div id="calendar-days-chat" class="calendar-days"></div>
+            </div>
+        </div>
+    `;
+    chatMessages.appendChild(calendarDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    // Ocultar el input cuando se muestra el calendario (si existe)
+    const inputContainer = document.querySelector('.chat-input-container');
+    if (inputContainer) {
+        inputContainer.classList.add('hidden');
+    }
+
+    // Reinicializar variables del calendario y mostrar con un pequeño delay
+    reinicializarCalendario();
+    setTimeout(() => {
+        mostrarCalendarioChat();
+    }, 100);
+}
+
+// Función para mostrar horas en el chat
+function mostrarHorasEnChat() {
+    if (!datosCita.fecha) return;
+
+    fetch(`/api/horas-disponibles/${datosCita.fecha}`)
+        .then(response => response.json())
+        .then(data => {
+            const chatMessages = document.getElementById('chatMessages');
+            const hoursDiv = document.createElement('div');
+            hoursDiv.className = 'message bot-message';
+            hoursDiv.innerHTML = `
+                <div style="margin-bottom: 10px;">Selecciona una hora disponible:</div>
+                <div class="hours-grid" style="max-width: 300px; margin: 0 auto;">
+                    ${data.horas.map(hora => `
+                        <button class="hour-btn" onclick="seleccionarHoraChat('${hora}')">${hora}</button>
+                    `).join('')}
+                </div>
+            `;
+            chatMessages.appendChild(hoursDiv);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+
+            // Mostrar el input cuando se muestran las horas (si existe)
+            const inputContainer = document.querySelector('.chat-input-container');
+            if (inputContainer) {
+                inputContainer.classList.remove('hidden');
+            }
+        })
+        .catch(error => {
+            console.error('Error al cargar las horas:', error);
+        });
+}
+
+// Variables para el calendario del chat - Inicializar al cargar la página
+let fechaActualChat = new Date();
+let mesActualChat = fechaActualChat.getMonth();
+let añoActualChat = fechaActualChat.getFullYear();
+
+// Nombres de los meses
+const mesesChat = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 
+                  'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'];
+
+// Función para reinicializar las variables del calendario
+function reinicializarCalendario() {
+    fechaActualChat = new Date();
+    mesActualChat = fechaActualChat.getMonth();
+    añoActualChat = fechaActualChat.getFullYear();
+    console.log('Calendario reinicializado:', mesActualChat, añoActualChat);
+}
+
+function mostrarCalendarioChat() {
+    console.log('Inicializando calendario...');
+    console.log('Mes actual:', mesActualChat, 'Año actual:', añoActualChat);
+
+    // Verificar que las variables estén correctamente inicializadas
+    if (mesActualChat === undefined || añoActualChat === undefined) {
+        console.error('Variables del calendario no inicializadas, reinicializando...');
+        reinicializarCalendario();
+    }
+
+    const primerDia = new Date(añoActualChat, mesActualChat, 1);
+    const ultimoDia = new Date(añoActualChat, mesActualChat + 1, 0);
+    const primerDiaSemana = primerDia.getDay();
+    const diasEnMes = ultimoDia.getDate();
+
+    console.log('Primer día del mes:', primerDia);
+    console.log('Último día del mes:', ultimoDia);
+    console.log('Días en el mes:', diasEnMes);
+    console.log('Primer día de la semana:', primerDiaSemana);
+
+    // Ajustar para que Lunes sea 1 y Domingo sea 7
+    let primerDiaSemanaAjustado = primerDiaSemana;
+    if (primerDiaSemana === 0) primerDiaSemanaAjustado = 7;
+
+    console.log('Primer día ajustado:', primerDiaSemanaAjustado);
+
+    // Actualizar título del mes
+    const mesActualElement = document.getElementById('mesActualChat');
+    if (mesActualElement) {
+        mesActualElement.textContent = `${mesesChat[mesActualChat]} ${añoActualChat}`;
+        console.log('Título actualizado:', mesActualElement.textContent);
+    } else {
+        console.error('No se encontró el elemento mesActualChat');
+    }
+
+    // Generar días del calendario
+    const calendarDays = document.getElementById('calendar-days-chat');
+    if (calendarDays) {
+        calendarDays.innerHTML = '';
+        console.log('Limpiando calendario...');
+
+        // Agregar espacios vacíos para alinear con los días de la semana
+        for (let i = 1; i < primerDiaSemanaAjustado; i++) {
+            const emptyDay = document.createElement('div');
+            emptyDay.className = 'calendar-day disabled';
+            calendarDays.appendChild(emptyDay);
+        }
+
+        console.log('Agregados', primerDiaSemanaAjustado - 1, 'días vacíos');
+
+        // Agregar días del mes
+        for (let dia = 1; dia <= diasEnMes; dia++) {
+            const dayElement = document.createElement('div');
+            dayElement.className = 'calendar-day';
+            dayElement.textContent = dia;
+
+            const fechaCompleta = new Date(añoActualChat, mesActualChat, dia);
+            const diaSemana = fechaCompleta.getDay();
+            const esHoy = esFechaHoyChat(fechaCompleta);
+            const esPasado = fechaCompleta < new Date(fechaActualChat.getFullYear(), fechaActualChat.getMonth(), fechaActualChat.getDate());
+            const esDomingo = diaSemana === 0;
+
+            // Aplicar clases según el estado del día
+            if (esPasado) {
+                dayElement.classList.add('disabled');
+            } else if (esDomingo) {
+                dayElement.classList.add('disabled');
+            } else if (esHoy) {
+                dayElement.classList.add('today');
+            } else {
+                dayElement.classList.add('available');
+
+                // Agregar evento de clic
+                dayElement.addEventListener('click', function() {
+                    seleccionarFechaChat(fechaCompleta, this);
+                });
+            }
+
+            calendarDays.appendChild(dayElement);
+        }
+
+        console.log('Agregados', diasEnMes, 'días del mes');
+        console.log('Total de elementos en el calendario:', calendarDays.children.length);
+
+        marcarDiasCompletosChat(mesActualChat, añoActualChat, diasEnMes);
+    } else {
+        console.error('No se encontró el elemento calendar-days-chat');
+    }
+}
+
+// Deshabilitar los días del mes que ya no tienen horas libres (una sola petición por mes)
+function marcarDiasCompletosChat(mes, año, diasEnMes) {
+    const desde = `${año}-${String(mes + 1).padStart(2, '0')}-01`;
+
+    fetch(`/api/disponibilidad?desde=${desde}&dias=${diasEnMes}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignorar la respuesta si el usuario ya ha cambiado de mes
+            if (mes !== mesActualChat || año !== añoActualChat || !data.dias) return;
+
+            const completos = new Set(
+                data.dias.filter(dia => dia.libres === 0).map(dia => Number(dia.fecha.slice(8)))
+            );
+            document.querySelectorAll('#calendar-days-chat .calendar-day.available').forEach(day => {
+                if (completos.has(Number(day.textContent))) {
+                    const diaCompleto = day.cloneNode(true);
+                    diaCompleto.classList.remove('available');
+                    diaCompleto.classList.add('disabled');
+                    day.replaceWith(diaCompleto);
+                }
+            });
+        })
+        .catch(error => {
+            console.error('Error al cargar la disponibilidad del mes:', error);
+        });
+}
+
+function cambiarMesChat(direccion) {
+    mesActualChat += direccion;
+
+    if (mesActualChat > 11) {
+        mesActualChat = 0;
+        añoActualChat++;
+    } else if (mesActualChat < 0) {
+        mesActualChat = 11;
+        añoActualChat--;
+    }
+
+    mostrarCalendarioChat();
+}
+
+function formatearFecha(fecha) {
+    const dia = fecha.getDate().toString().padStart(2, '0');
+    const mes = (fecha.getMonth() + 1).toString().padStart(2, '0');
+    const año = fecha.getFullYear();
+    return `${dia}/${mes}/${año}`;
+}
+
+function seleccionarFechaChat(fecha, elemento) {
+    // Remover selección anterior
+    document.querySelectorAll('#calendar-days-chat .calendar-day.selected').forEach(day => {
+        day.classList.remove('selected');
+    });
+
+    // Seleccionar nueva fecha
+    elemento.classList.add('selected');
+    datosCita.fecha = fecha.toISOString().split('T')[0]; // Mantener formato interno YYYY-MM-DD
+    datosCita.fechaMostrar = formatearFecha(fecha); // Formato para mostrar DD/MM/YYYY
+
+    // Mostrar directamente las horas disponibles
+    setTimeout(() => {
+        mostrarHorasEnChat();
+    }, 500);
+}
+
+function seleccionarHoraChat(hora) {
+    datosCita.hora = hora;
+
+    // Mostrar formulario con los tres inputs
+    setTimeout(() => {
+        const chatMessages = document.getElementById('chatMessages');
+        const formDiv = document.createElement('div');
+        formDiv.className = 'message bot-message';
+        formDiv.innerHTML = `
+            <div style="margin-bottom: 15px;">Perfecto, has seleccionado ${datosCita.fechaMostrar} a las ${hora}. Ahora necesito tus datos personales:</div>
+            <div class="form-container" style="max-width: 400px; margin: 0 auto;">
+                <div class="form-group">
+                    <label for="nombreInput">Nombre completo:</label>
+                    <input type="text" id="nombreInput" class="form-input" placeholder="Tu nombre completo" onkeypress="handleFormKeyPress(event, 'nombreInput', 'telefonoInput')">
+                </div>
+                <div class="form-group">
+                    <label for="telefonoInput">Teléfono:</label>
+                    <input type="tel" id="telefonoInput" class="form-input" placeholder="Tu número de teléfono" onkeypress="handleFormKeyPress(event, 'telefonoInput', 'emailInput')">
+                </div>
+                <div class="form-group">
+                    <label for="emailInput">Email:</label>
+                    <input type="email" id="emailInput" class="form-input" placeholder="Tu dirección de email" onkeypress="handleFormKeyPress(event, 'emailInput', null)">
+                </div>
+                <div class="form-actions">
+                    <button type="button" class="btn-primary" onclick="enviarDatosPersonales()">Continuar</button>
+                    <button type="button" class="btn-secondary" onclick="cancelarReserva()">Cancelar</button>
+                </div>
+            </div>
+        `;
+        chatMessages.appendChild(formDiv);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+
+        // Ocultar el input general (si existe)
+        const inputContainer = document.querySelector('.chat-input-container');
+        if (inputContainer) {
+            inputContainer.classList.add('hidden');
+        }
+
+        // Enfocar el primer input
+        setTimeout(() => {
+            document.getElementById('nombreInput').focus();
+        }, 100);
+    }, 500);
+}
+
+function esFechaHoyChat(fecha) {
+    const hoy = new Date();
+    return fecha.getDate() === hoy.getDate() &&
+           fecha.getMonth() === hoy.getMonth() &&
+           fecha.getFullYear() === hoy.getFullYear();
+}
+
+function confirmarCita() {
+    // Enviar datos al servidor
+    fetch('/api/guardar-cita-chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(datosCita)
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            // Mostrar mensaje de confirmación
+            const chatMessages = document.getElementById('chatMessages');
+            const confirmDiv = document.createElement('div');
+            confirmDiv.className = 'message bot-message';
+            confirmDiv.innerHTML = `
+                <div style="margin-bottom: 10px;">${data.mensaje}</div>
+            `;
+            chatMessages.appendChild(confirmDiv);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+
+            // Resetear datos
+            conversacionId = null;
+            datosCita = {
+                nombre: '',
+                telefono: '',
+                email: '',
+                tipo_cita: '',
+                fecha: '',
+                hora: ''
+            };
+        } else {
+            alert('Error al guardar la cita: ' + data.error);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Error al guardar la cita. Por favor, inténtalo de nuevo.');
+    });
+}
+
+function cancelarCita() {
+    sendQuickMessage('No, cancelar');
+}
+
+// Función para enviar datos personales
+function enviarDatosPersonales() {
+    const nombre = document.getElementById('nombreInput').value.trim();
+    const telefono = document.getElementById('telefonoInput').value.trim();
+    const email = document.getElementById('emailInput').value.trim();
+
+    // Validar campos
+    if (!nombre || !telefono || !email) {
+        alert('Por favor completa todos los campos');
+        return;
+    }
+
+    // Validar email básico
+    const emailRegex = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
+    if (!emailRegex.test(email)) {
+        alert('Por favor ingresa un email válido');
+        return;
+    }
+
+    // Guardar datos
+    datosCita.nombre = nombre;
+    datosCita.telefono = telefono;
+    datosCita.email = email;
+
+    // Mostrar resumen de la cita
+    mostrarResumenCita();
+}
+
+// Función para mostrar resumen de la cita
+function mostrarResumenCita() {
+    const chatMessages = document.getElementById('chatMessages');
+    const resumenDiv = document.createElement('div');
+    resumenDiv.className = 'message bot-message';
+    resumenDiv.innerHTML = `
+        <div style="margin-bottom: 15px;">¡Excelente! Aquí tienes el resumen de tu cita:</div>
+        <div class="form-container" style="max-width: 400px; margin: 0 auto;">
+            <div class="resumen-item">
+                <strong>📅 Fecha:</strong> ${datosCita.fechaMostrar}
+            </div>
+            <div class="resumen-item">
+                <strong>🕐 Hora:</strong> ${datosCita.hora}
+            </div>
+            <div class="resumen-item">
+                <strong>👤 Nombre:</strong> ${datosCita.nombre}
+            </div>
+            <div class="resumen-item">
+                <strong>📞 Teléfono:</strong> ${datosCita.telefono}
+            </div>
+            <div class="resumen-item">
+                <strong>📧 Email:</strong> ${datosCita.email}
+            </div>
+            <div class="resumen-item">
+                <strong>🏥 Tipo:</strong> ${datosCita.tipo_cita === 'revision' ? 'Revisión general' : 'Padecimiento específico'}
+            </div>
+            <div class="form-actions">
+                <button type="button" class="btn-primary" onclick="confirmarCita()">✅ Confirmar cita</button>
+                <button type="button" class="btn-secondary" onclick="cancelarCita()">❌ Cancelar</button>
+            </div>
+        </div>
+    `;
+    chatMessages.appendChild(resumenDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+// Función para cancelar reserva
+function cancelarReserva() {
+    const chatMessages = document.getElementById('chatMessages');
+    const cancelDiv = document.createElement('div');
+    cancelDiv.className = 'message bot-message';
+    cancelDiv.innerHTML = `
+        <div style="margin-bottom: 10px;">Entendido, la reserva ha sido cancelada. Si cambias de opinión, puedes volver a solicitar una cita en cualquier momento.</div>
+    `;
+    chatMessages.appendChild(cancelDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    // Resetear datos
+    conversacionId = null;
+    datosCita = {
+        nombre: '',
+        telefono: '',
+        email: '',
+        tipo_cita: '',
+        fecha: '',
+        fechaMostrar: '',
+        hora: ''
+    };
+}
+
+// Función para manejar teclas en el formulario
+function handleFormKeyPress(event, currentInput, nextInput) {
+    if (event.key === 'Enter') {
+        event.preventDefault();
+
+        if (nextInput) {
+            // Mover al siguiente input
+            document.getElementById(nextInput).focus();
+        } else {
+            // En el último input, enviar el formulario
+            enviarDatosPersonales();
+        }
+    }
+}
+
+// Función para volver al inicio
+function volverAlInicio() {
+    // Limpiar el chat
+    document.getElementById('chatMessages').innerHTML = '';
+
+    // Ocultar el botón volver
+    document.getElementById('backButton').classList.remove('show');
+
+    // Mostrar el menú principal
+    document.getElementById('quickActions').style.display = 'flex';
+
+    // Mostrar el mensaje de bienvenida
+    document.querySelector('.welcome-message').style.display = 'block';
+
+    // Resetear variables de estado
+    estadoConversacion = 'inicial';
+    conversacionId = null;
+    datosCita = {
+        nombre: '',
+        telefono: '',
+        email: '',
+        tipo_cita: '',
+        fecha: '',
+        fechaMostrar: '',
+        hora: ''
+    };
+    pasoCita = 0;
+    // Forzar que el siguiente mensaje se envíe con estadoConversacion = 'inicial'
+    window.__resetEstadoConversacion = true;
+}
+
+// Función para activar el botón volver
+function activarBotonVolver() {
+    document.getElementById('backButton').classList.add('show');
+    // Ocultar el menú principal
+    document.getElementById('quickActions').style.display = 'none';
+    // Ocultar el mensaje de bienvenida
+    document.querySelector('.welcome-message').style.display = 'none';
+}
+
+// Función para limpiar el chat
+function limpiarChat() {
+    document.getElementById('chatMessages').innerHTML = '';
+}
+
+// Modificar sendQuickMessage para respetar el reset forzado
+const _originalSendQuickMessage = sendQuickMessage;
+sendQuickMessage = function(message) {
+    if (window.__resetEstadoConversacion) {
+        estadoConversacion = 'inicial';
+        window.__resetEstadoConversacion = false;
+    }
+    _originalSendQuickMessage(message);
+};
+
+function mostrarInputPadecimiento() {
+    const chatMessages = document.getElementById('chatMessages');
+    const inputDiv = document.createElement('div');
+    inputDiv.className = 'message bot-message';
+    inputDiv.innerHTML = `
+        <div style="margin-bottom: 10px;">Describe brevemente tu padecimiento o motivo de consulta:</div>
+        <input type="text" id="inputPadecimiento" class="form-input" placeholder="Ej: dolor de muela, inflamación, etc." style="margin-bottom: 10px; width: 100%; max-width: 350px;">
+        <button class="btn-primary" onclick="enviarPadecimiento()">Continuar</button>
+    `;
+    chatMessages.appendChild(inputDiv);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+    setTimeout(() => {
+        document.getElementById('inputPadecimiento').focus();
+    }, 100);
+}
+
+function enviarPadecimiento() {
+    const input = document.getElementById('inputPadecimiento');
+    const texto = input.value.trim();
+    if (!texto) {
+        alert('Por favor, describe tu padecimiento.');
+        return;
+    }
+    addMessage(texto, 'user');
+    sendToAPI(texto);
+}
@@ -0,0 +1,359 @@
+let currentDate = new Date();
+let currentView = 'daily';
+let appointments = [];
+let loadedRange = null;
+let dataVersion = null;
+
+// Inicializar
+document.addEventListener('DOMContentLoaded', function() {
+    loadAppointments();
+    updateCurrentDate();
+});
+
+// Cambiar vista
+function changeView(view) {
+    currentView = view;
+
+    // Actualizar botones
+    document.querySelectorAll('.view-btn').forEach(btn => btn.classList.remove('active'));
+    event.target.classList.add('active');
+
+    // Ocultar todas las vistas
+    document.getElementById('dailyView').classList.remove('active');
+    document.getElementById('weeklyView').classList.remove('active');
+    document.getElementById('monthlyView').classList.remove('active');
+
+    // Mostrar vista seleccionada
+    document.getElementById(view + 'View').classList.add('active');
+
+    // Actualizar contenido
+    updateView();
+}
+
+// Navegación de fechas
+function previousPeriod() {
+    if (currentView === 'monthly') {
+        currentDate.setMonth(currentDate.getMonth() - 1);
+    } else {
+        currentDate.setDate(currentDate.getDate() - 1);
+    }
+    updateCurrentDate();
+    loadAppointments();
+}
+
+function nextPeriod() {
+    if (currentView === 'monthly') {
+        currentDate.setMonth(currentDate.getMonth() + 1);
+    } else {
+        currentDate.setDate(currentDate.getDate() + 1);
+    }
+    updateCurrentDate();
+    loadAppointments();
+}
+
+function goToToday() {
+    currentDate = new Date();
+    updateCurrentDate();
+    loadAppointments();
+}
+
+function updateCurrentDate() {
+    const options = { 
+        weekday: 'long', 
+        year: 'numeric', 
+        month: 'long', 
+        day: 'numeric' 
+    };
+    document.getElementById('currentDate').textContent = currentDate.toLocaleDateString('es-ES', options);
+
+    if (currentView === 'daily') {
+        document.getElementById('dailyDate').textContent = currentDate.toLocaleDateString('es-ES', options);
+    }
+}
+
+// Rango de fechas visible: el mes actual y la semana actual completa
+function getVisibleRange() {
+    const monthStart = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
+    const monthEnd = new Date(currentDate.getFullYear(), currentDate.getMonth() + 1, 0);
+    const weekStart = getWeekStart(currentDate);
+    const weekEnd = new Date(weekStart);
+    weekEnd.setDate(weekStart.getDate() + 6);
+
+    return {
+        desde: (weekStart < monthStart ? weekStart : monthStart).toISOString().split('T')[0],
+        hasta: (weekEnd > monthEnd ? weekEnd : monthEnd).toISOString().split('T')[0]
+    };
+}
+
+// Cargar citas desde el servidor (solo el rango visible, página a página)
+async function loadAppointments() {
+    const range = getVisibleRange();
+    const loaded = [];
+    let cursor = null;
+    let lastVersion = null;
+
+    try {
+        do {
+            let url = `/api/citas?desde=${range.desde}&hasta=${range.hasta}`;
+            if (cursor) {
+                url += `&cursor=${encodeURIComponent(cursor)}`;
+            }
+            const response = await fetch(url);
+            const data = await response.json();
+            loaded.push(...(data.citas || []));
+            cursor = data.siguiente_cursor;
+            lastVersion = lastVersion || data.version;
+        } while (cursor);
+
+        appointments = loaded;
+        loadedRange = range;
+        dataVersion = lastVersion;
+    } catch (error) {
+        console.error('Error al cargar citas:', error);
+        appointments = [];
+    }
+    updateView();
+}
+
+// Actualizar vista actual
+function updateView() {
+    switch (currentView) {
+        case 'daily':
+            updateDailyView();
+            break;
+        case 'weekly':
+            updateWeeklyView();
+            break;
+        case 'monthly':
+            updateMonthlyView();
+            break;
+    }
+}
+
+// Vista diaria
+function updateDailyView() {
+    const slotsContainer = document.getElementById('dailySlots');
+    const targetDate = currentDate.toISOString().split('T')[0];
+
+    // Generar slots de tiempo (9:00-18:00)
+    let html = '';
+    for (let hour = 9; hour < 18; hour++) {
+        const timeSlot = `${hour.toString().padStart(2, '0')}:00`;
+        const timeSlot30 = `${hour.toString().padStart(2, '0')}:30`;
+
+        // Buscar citas para este horario
+        const appointment = appointments.find(apt => 
+            apt.fecha === targetDate && apt.hora === timeSlot
+        );
+        const appointment30 = appointments.find(apt => 
+            apt.fecha === targetDate && apt.hora === timeSlot30
+        );
+
+        html += `
+            <div class="time-slot">
+                <div class="time-hour">${timeSlot}</div>
+                <div class="appointment-info">
+                    ${appointment ? createAppointmentHTML(appointment) : '<span class="empty-slot">Disponible</span>'}
+                </div>
+                ${appointment ? `<div class="appointment-status status-${appointment.estado}">${appointment.estado}</div>` : ''}
+            </div>
+            <div class="time-slot">
+                <div class="time-hour">${timeSlot30}</div>
+                <div class="appointment-info">
+                    ${appointment30 ? createAppointmentHTML(appointment30) : '<span class="empty-slot">Disponible</span>'}
+                </div>
+                ${appointment30 ? `<div class="appointment-status status-${appointment30.estado}">${appointment30.estado}</div>` : ''}
+            </div>
+        `;
+    }
+
+    slotsContainer.innerHTML = html;
+}
+
+// Vista semanal
+function updateWeeklyView() {
+    const gridContainer = document.getElementById('weeklyGrid');
+    const weekStart = getWeekStart(currentDate);
+
+    let html = '';
+    const weekdays = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom'];
+
+    for (let i = 0; i < 7; i++) {
+        const currentDay = new Date(weekStart);
+        currentDay.setDate(weekStart.getDate() + i);
+        const dayDate = currentDay.toISOString().split('T')[0];
+
+        // Buscar citas para este día
+        const dayAppointments = appointments.filter(apt => apt.fecha === dayDate);
+
+        html += `
+            <div class="week-day">
+                <div class="day-header">
+                    ${weekdays[i]}<br>
+                    <small>${currentDay.getDate()}</small>
+                </div>
+                <div class="day-appointments">
+                    ${dayAppointments.map(apt => `
+                        <div class="day-appointment" onclick="showAppointmentDetails(${apt.id})">
+                            ${apt.hora} - ${apt.nombre}
+                        </div>
+                    `).join('')}
+                </div>
+            </div>
+        `;
+    }
+
+    gridContainer.innerHTML = html;
+}
+
+// Vista mensual
+function updateMonthlyView() {
+    const calendarContainer = document.getElementById('monthlyCalendar');
+    const monthStart = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
+    const monthEnd = new Date(currentDate.getFullYear(), currentDate.getMonth() + 1, 0);
+    const firstDay = monthStart.getDay() || 7; // Lunes = 1, Domingo = 7
+
+    // Actualizar título
+    const monthNames = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio',
+                      'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'];
+    document.getElementById('monthlyTitle').textContent = 
+        `${monthNames[currentDate.getMonth()]} ${currentDate.getFullYear()}`;
+
+    let html = `
+        <div class="calendar-weekdays">
+            <div class="weekday-header">Lun</div>
+            <div class="weekday-header">Mar</div>
+            <div class="weekday-header">Mié</div>
+            <div class="weekday-header">Jue</div>
+            <div class="weekday-header">Vie</div>
+            <div class="weekday-header">Sáb</div>
+            <div class="weekday-header">Dom</div>
+        </div>
+        <div class="calendar-days">
+    `;
+
+    // Agregar días del mes anterior
+    for (let i = 1; i < firstDay; i++) {
+        html += '<div class="calendar-day other-month"></div>';
+    }
+
+    // Agregar días del mes actual
+    for (let day = 1; day <= monthEnd.getDate(); day++) {
+        const currentDay = new Date(currentDate.getFullYear(), currentDate.getMonth(), day);
+        const dayDate = currentDay.toISOString().split('T')[0];
+
+        // Buscar citas para este día
+        const dayAppointments = appointments.filter(apt => apt.fecha === dayDate);
+
+        html += `
+            <div class="calendar-day">
+                <div class="day-number">${day}</div>
+                <div class="day-appointments-month">
+                    ${dayAppointments.map(apt => `
+                        <div class="day-appointment-month" onclick="showAppointmentDetails(${apt.id})">
+                            ${apt.hora} - ${apt.nombre}
+                        </div>
+                    `).join('')}
+                </div>
+            </div>
+        `;
+    }
+
+    html += '</div>';
+    calendarContainer.innerHTML = html;
+}
+
+// Funciones auxiliares
+function getWeekStart(date) {
+    const d = new Date(date);
+    const day = d.getDay();
+    const diff = d.getDate() - day + (day === 0 ? -6 : 1); // Ajustar para que la semana empiece en lunes
+    return new Date(d.setDate(diff));
+}
+
+function createAppointmentHTML(appointment) {
+    const tipo = appointment.tipo === 'revision' ? 'Revisión' : 'Padecimiento';
+    return `
+        <div class="appointment-name">${appointment.nombre}</div>
+        <div class="appointment-details">
+            ${tipo} - ${appointment.telefono}
+        </div>
+    `;
+}
+
+function showAppointmentDetails(appointmentId) {
+    const appointment = appointments.find(apt => apt.id === appointmentId);
+    if (appointment) {
+        alert(`Detalles de la cita:\n\nNombre: ${appointment.nombre}\nTeléfono: ${appointment.telefono}\nEmail: ${appointment.email}\nFecha: ${appointment.fecha}\nHora: ${appointment.hora}\nTipo: ${appointment.tipo === 'revision' ? 'Revisión General' : 'Padecimiento'}\nEstado: ${appointment.estado}`);
+    }
+}
+
+// Pedir solo los cambios desde la última versión; 304 si no hay ninguno
+async function pollAppointments() {
+    const range = getVisibleRange();
+    if (dataVersion === null || !loadedRange ||
+        loadedRange.desde !== range.desde || loadedRange.hasta !== range.hasta) {
+        return loadAppointments();
+    }
+
+    try {
+        const response = await fetch(
+            `/api/citas?desde=${range.desde}&hasta=${range.hasta}&since=${dataVersion}`,
+            { headers: { 'If-None-Match': `"${dataVersion}"` } }
+        );
+        if (response.status === 304) {
+            return;
+        }
+
+        const data = await response.json();
+        if (data.recargar) {
+            return loadAppointments();
+        }
+
+        // Combinar los cambios con las citas ya cargadas; las que ya no cumplen los filtros se quitan
+        const byId = new Map(appointments.map(apt => [apt.id, apt]));
+        (data.citas || []).forEach(apt => {
+            if (apt.fuera_de_filtro) {
+                byId.delete(apt.id);
+            } else {
+                byId.set(apt.id, apt);
+            }
+        });
+        appointments = Array.from(byId.values());
+        dataVersion = data.version;
+        updateView();
+    } catch (error) {
+        console.error('Error al actualizar citas:', error);
+    }
+}
+
+// Recibir las citas nuevas y los cambios al momento (Server-Sent Events)
+let eventSource = null;
+
+function mergeAppointment(apt) {
+    const index = appointments.findIndex(item => item.id === apt.id);
+    if (index >= 0) {
+        appointments[index] = apt;
+    } else {
+        appointments.push(apt);
+    }
+    updateView();
+}
+
+function connectEvents() {
+    if (!window.EventSource) return;
+
+    eventSource = new EventSource('/api/eventos');
+    eventSource.addEventListener('cita_creada', e => mergeAppointment(JSON.parse(e.data)));
+    eventSource.addEventListener('cita_actualizada', e => mergeAppointment(JSON.parse(e.data)));
+    eventSource.addEventListener('recargar', () => loadAppointments());
+}
+
+connectEvents();
+
+// Si no hay canal de eventos abierto, actualizar cada 30 segundos
+setInterval(() => {
+    if (!eventSource || eventSource.readyState !== EventSource.OPEN) {
+        pollAppointments();
+    }
+}, 30000);
@@ -3,8 +3,12 @@
 Script de prueba para verificar la funcionalidad de la base de datos
 """
 
-from app import app, db, Cita
+from app import app, db, Cita, get_disponibilidad_rango, get_horas_disponibles, invalidar_ocupacion, reservar_cita, _ACCESO_DB, DB_CONCURRENCIA
+import app as aplicacion
+import sqlite3
 from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from unittest.mock import patch
 
 def test_database():
     """Prueba la creación de la base de datos y algunas operaciones básicas"""
@@ -46,5 +50,245 @@ def test_database():
         print("✅ Todas las pruebas de base de datos pasaron exitosamente")
         return True
 
+def test_horas_disponibles():
+    """Prueba que una cita ocupa su franja y libera la caché de ocupación"""
+    
+    with app.app_context():
+        db.create_all()
+        fecha = datetime.now().date() + timedelta(days=1)
+        while fecha.weekday() >= 5:
+            fecha += timedelta(days=1)
+        fecha_str = fecha.strftime('%Y-%m-%d')
+        
+        horas_antes = get_horas_disponibles(fecha_str)
+        assert len(horas_antes) == 18
+        
+        with app.test_client() as client:
+            response = client.post('/api/guardar-cita', json={
+                'nombre': 'Paciente Prueba',
+                'telefono': '+34 600 000 000',
+                'email': 'prueba@test.com',
+                'tipo_cita': 'revision',
+                'fecha': fecha_str,
+                'hora': '09:30'
+            })
+        cita_id = response.get_json()['cita_id']
+        
+        try:
+            horas_despues = get_horas_disponibles(fecha_str)
+            assert '09:30' not in horas_despues
+            assert len(horas_despues) == len(horas_antes) - 1
+            print("✅ Las horas disponibles reflejan la nueva cita")
+        finally:
+            db.session.delete(db.session.get(Cita, cita_id))
+            db.session.commit()
+            invalidar_ocupacion(fecha)
+
+def test_doble_reserva():
+    """Prueba que una franja pendiente no se puede reservar dos veces"""
+    
+    with app.app_context():
+        db.create_all()
+        fecha = datetime.now().date() + timedelta(days=2)
+        datos = {
+            'nombre': 'Paciente Prueba',
+            'telefono': '+34 600 000 000',
+            'email': 'prueba@test.com',
+            'tipo_cita': 'revision',
+            'fecha': fecha,
+            'hora': '11:00'
+        }
+        
+        primera = reservar_cita(**datos)
+        try:
+            assert primera is not None
+            assert reservar_cita(**datos) is None
+            print("✅ La segunda reserva de la misma franja se rechaza")
+        finally:
+            db.session.delete(primera)
+            db.session.commit()
+            invalidar_ocupacion(fecha)
+
+def test_cache_ocupacion():
+    """La caché de ocupación solo guarda días de la ventana y no acepta lecturas anteriores a una reserva"""
+    
+    with app.app_context():
+        lejana = datetime.now().date() + timedelta(days=aplicacion.VENTANA_RESERVAS_DIAS + 400)
+        get_horas_disponibles(lejana.strftime('%Y-%m-%d'))
+        assert lejana not in aplicacion._OCUPACION_DIAS
+        
+        fecha = datetime.now().date() + timedelta(days=3)
+        invalidar_ocupacion(fecha)
+        # Una consulta lee la generación, una reserva invalida el día y la consulta termina después
+        generacion = aplicacion.generacion_ocupacion(fecha)
+        invalidar_ocupacion(fecha)
+        aplicacion.guardar_ocupacion(fecha, 0b1, 0, generacion)
+        assert fecha not in aplicacion._OCUPACION_DIAS
+        
+        aplicacion.guardar_ocupacion(fecha, 0b1, 0, aplicacion.generacion_ocupacion(fecha))
+        assert fecha in aplicacion._OCUPACION_DIAS
+        invalidar_ocupacion(fecha)
+    
+    print("✅ La caché de ocupación está acotada y descarta lecturas obsoletas")
+
+def test_disponibilidad_rango():
+    """El rango de disponibilidad coincide con las horas de cada día y refleja las reservas"""
+    
+    with app.app_context():
+        db.create_all()
+        desde = datetime.now().date() + timedelta(days=1)
+        cliente = app.test_client()
+        
+        def comprobar():
+            dias = cliente.get(f'/api/disponibilidad?desde={desde.isoformat()}&dias=14&horas=1').get_json()['dias']
+            assert dias
+            for dia in dias:
+                assert dia['horas'] == get_horas_disponibles(dia['fecha'])
+            return {dia['fecha']: dia for dia in dias}
+        
+        antes = comprobar()
+        fecha = min(datetime.strptime(f, '%Y-%m-%d').date() for f in antes)
+        cita = reservar_cita('Paciente Prueba', '+34 600 000 000', 'prueba@test.com', 'revision', fecha, '12:00')
+        try:
+            despues = comprobar()
+            assert '12:00' not in despues[fecha.isoformat()]['horas']
+            assert despues[fecha.isoformat()]['libres'] == antes[fecha.isoformat()]['libres'] - 1
+        finally:
+            db.session.delete(cita)
+            db.session.commit()
+            invalidar_ocupacion(fecha)
+        
+        # Fuera de la ventana de reservas no se consulta ni se guarda nada
+        lejana = datetime.now().date() + timedelta(days=aplicacion.VENTANA_RESERVAS_DIAS + 400)
+        assert get_disponibilidad_rango(lejana, 30) == []
+    
+    print("✅ La disponibilidad por rango coincide con la de cada día")
+
+def test_cambios_desde_version():
+    """Un cambio confirmado después de una versión llega aunque su hora de modificación sea anterior"""
+    
+    with app.app_context():
+        db.create_all()
+        cliente = app.test_client()
+        version = cliente.get('/api/citas?limite=1').get_json()['version']
+        
+        # Otro proceso tomó la hora antes de esperar el bloqueo de escritura
+        cita = Cita(nombre='Paciente Prueba', telefono='+34 600 000 000', email='prueba@test.com',
+                    tipo_cita='revision', fecha=datetime.now().date() + timedelta(days=4), hora='16:00',
+                    fecha_modificacion=datetime(2000, 1, 1))
+        db.session.add(cita)
+        db.session.commit()
+        try:
+            datos = cliente.get(f'/api/citas?since={version}').get_json()
+            assert [c['id'] for c in datos['citas']] == [cita.id]
+            assert datos['version'] > version
+            # Una versión que no es de esta base de datos obliga a recargar
+            assert cliente.get(f'/api/citas?since={datos["version"] + 1}').get_json()['recargar']
+            
+            # El alta se distingue de un cambio hecho en el mismo segundo
+            assert cita.num_cambio == cita.num_cambio_alta
+            cliente.post(f'/api/citas/{cita.id}/estado', json={'estado': 'confirmada'})
+            db.session.refresh(cita)
+            assert cita.estado == 'confirmada' and cita.num_cambio > cita.num_cambio_alta
+            
+            # Una cita que deja de cumplir el filtro llega marcada para quitarla
+            datos = cliente.get(f'/api/citas?estado=pendiente&since={version}').get_json()
+            assert [(c['id'], c.get('fuera_de_filtro')) for c in datos['citas']] == [(cita.id, True)]
+            datos = cliente.get(f'/api/citas?estado=confirmada&since={version}').get_json()
+            assert [(c['id'], c.get('fuera_de_filtro')) for c in datos['citas']] == [(cita.id, None)]
+        finally:
+            db.session.delete(cita)
+            db.session.commit()
+            invalidar_ocupacion(cita.fecha)
+    
+    print("✅ Los cambios se sincronizan por número de cambio, no por hora")
+
+def test_contadores_durante_reconciliacion():
+    """Un alta registrada mientras se ejecuta la consulta de reconciliación no se pierde"""
+    from estadisticas import ContadoresCitas
+    
+    def cargar():
+        # Otro hilo guarda una cita después de que la consulta haya leído la tabla
+        contadores.registrar_alta('pendiente', 'revision')
+        return [('pendiente', 'revision', 3)]
+    
+    contadores = ContadoresCitas(cargar)
+    contadores.reconciliar()
+    assert contadores.resumen()['citas_pendientes'] == 4
+    
+    # Con la versión de la tabla, un cambio que no ha registrado este proceso obliga a recargar
+    tabla = {'version': 5, 'filas': [('pendiente', 'revision', 5)], 'cargas': 0}
+    
+    def cargar_tabla():
+        tabla['cargas'] += 1
+        return tabla['filas']
+    
+    contadores = ContadoresCitas(cargar_tabla, version=lambda: tabla['version'])
+    assert contadores.resumen()['total_citas'] == 5
+    tabla.update(version=6, filas=[('pendiente', 'revision', 6)])
+    contadores.registrar_alta('pendiente', 'revision', 6)
+    assert contadores.resumen()['total_citas'] == 6 and tabla['cargas'] == 1
+    # Otro worker guarda las citas 7 y 8
+    tabla.update(version=8, filas=[('pendiente', 'revision', 7), ('confirmada', 'revision', 1)])
+    assert contadores.resumen()['total_citas'] == 8 and tabla['cargas'] == 2
+    print("✅ Las altas durante la reconciliación y las de otros workers se cuentan")
+
+def test_base_datos_ocupada():
+    """Con todos los accesos a la base de datos ocupados, las APIs responden 503 enseguida"""
+    
+    cliente = app.test_client()
+    fecha = datetime.now().date() + timedelta(days=60)
+    invalidar_ocupacion(fecha)
+    espera_original = aplicacion.DB_ESPERA_MAXIMA
+    aplicacion.DB_ESPERA_MAXIMA = 0.01
+    for _ in range(DB_CONCURRENCIA):
+        _ACCESO_DB.acquire()
+    try:
+        respuesta = cliente.get(f'/api/horas-disponibles/{fecha.isoformat()}')
+        assert respuesta.status_code == 503
+        assert respuesta.headers['Retry-After']
+        respuesta = cliente.get('/api/disponibilidad?dias=30')
+        assert respuesta.status_code == 503
+        
+        # El formulario se vuelve a mostrar con el aviso, sin error 500
+        formulario = {'nombre': 'Paciente Prueba', 'telefono': '+34 600 000 000', 'email': 'prueba@test.com',
+                      'tipo_cita': 'revision', 'fecha': fecha.isoformat(), 'hora': '10:00'}
+        respuesta = cliente.post('/guardar-cita-form', data=formulario)
+        assert respuesta.status_code == 503
+        assert respuesta.headers['Retry-After']
+        assert 'El servidor está ocupado' in respuesta.get_data(as_text=True)
+        respuesta = cliente.post('/guardar-cita-form', data=dict(formulario, hora=''))
+        assert respuesta.status_code == 503
+        
+        # También el panel y la administración pasan por el mismo límite
+        assert cliente.get('/api/citas').status_code == 503
+        assert cliente.get('/api/database-stats').status_code == 503
+        assert cliente.post('/api/citas/1/estado', json={'estado': 'confirmada'}).status_code == 503
+        
+        # El chat sigue respondiendo porque no necesita la base de datos
+        respuesta = cliente.post('/chat', json={'message': 'hola'})
+        assert respuesta.status_code == 200
+    finally:
+        for _ in range(DB_CONCURRENCIA):
+            _ACCESO_DB.release()
+        aplicacion.DB_ESPERA_MAXIMA = espera_original
+    
+    # SQLite bloqueado por otro proceso: 503 sin el texto del error de SQL
+    bloqueo = OperationalError('INSERT INTO cita', {}, sqlite3.OperationalError('database is locked'))
+    with patch.object(db.session, 'commit', side_effect=bloqueo):
+        respuesta = cliente.post('/api/guardar-cita', json=dict(formulario, hora='11:00'))
+    assert respuesta.status_code == 503
+    assert respuesta.headers['Retry-After']
+    assert 'locked' not in respuesta.get_data(as_text=True)
+    
+    print("✅ Con la base de datos saturada se responde 503 y el chat sigue disponible")
+
 if __name__ == "__main__":
-    test_database() 
\ No newline at end of file
+    test_database()
+    test_horas_disponibles()
+    test_doble_reserva()
+    test_cache_ocupacion()
+    test_disponibilidad_rango()
+    test_cambios_desde_version()
+    test_contadores_durante_reconciliacion()
+    test_base_datos_ocupada()
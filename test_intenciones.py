@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para verificar el buscador de intenciones del chatbot
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from intenciones import AutomataPalabras, IndiceTrigramas
+from catalogo import CatalogoRecargable
+from app import app, obtener_respuesta, CATALOGO
+
+def test_automata_prioridad():
+    """El autómata devuelve el patrón de menor rango aunque aparezca después"""
+    automata = AutomataPalabras([('cita', 1, 'cita'), ('hola', 0, 'hola'), ('la', 2, 'la')])
+    assert automata.buscar('quiero una cita, hola') == 'hola'
+    assert automata.buscar('una cita') == 'cita'
+    assert automata.buscar('nada que ver') is None
+    assert automata.contiene('escala')
+    print("✅ El autómata respeta la prioridad de los patrones")
+
+def test_claves_antes_que_palabras():
+    """Las claves exactas tienen prioridad sobre las palabras clave"""
+    resultado = obtener_respuesta('¿Qué horarios tenéis para pedir cita?')
+    assert resultado['respuesta'] == CATALOGO.actual.respuestas['horarios']
+    assert resultado['estado'] == 'inicial'
+
+    resultado = obtener_respuesta('me gustaría pedir cita')
+    assert resultado['estado'] == 'preguntando_tratamiento_abierto'
+    print("✅ Las claves exactas se evalúan antes que las palabras clave")
+
+def test_menu_tratamientos():
+    """En el menú de tratamientos se aceptan palabras sueltas de la clave"""
+    resultado = obtener_respuesta('me interesa la endodoncia', 'en_menu_tratamientos', {})
+    assert resultado['respuesta'] == CATALOGO.actual.respuestas['endodoncia']['texto']
+    assert resultado['estado'] == 'en_menu_tratamientos'
+    print("✅ El menú de tratamientos encuentra el tratamiento solicitado")
+
+def test_coincidencia_aproximada():
+    """Sin coincidencias literales se usa la clave más parecida, sin tildes ni faltas de ortografía"""
+    indice = IndiceTrigramas([('ortodoncia', 0, 'ortodoncia'), ('limpieza dental', 1, 'limpieza'), ('dirección', 2, 'ubicaciones')])
+    assert indice.buscar('¿hacéis ORTODONSIA?') == 'ortodoncia'
+    assert indice.buscar('direccion') == 'ubicaciones'
+    assert indice.buscar('limpiesa dental') == 'limpieza'
+    assert indice.buscar('gracias') is None
+    assert [valor for valor, _ in indice.similares('ortodonsia y limpiesa dental', k=5)] == ['limpieza', 'ortodoncia']
+
+    resultado = obtener_respuesta('información de la endodonsia')
+    assert resultado['respuesta'] == CATALOGO.actual.respuestas['endodoncia']['texto']
+    assert obtener_respuesta('asdfgh qwerty')['intencion'] == 'default'
+    print("✅ Los mensajes con faltas de ortografía encuentran su respuesta")
+
+def test_respuestas_por_estado():
+    """Las respuestas sí/no de cada estado se reconocen como palabras completas"""
+    # 'si' no debe coincidir dentro de 'visita' ni 'no' dentro de 'buenos'
+    resultado = obtener_respuesta('¿cada cuánto hay que hacer una visita?', 'preguntando_tratamiento_abierto', {})
+    assert 'contacta directamente' not in resultado['respuesta']
+    assert obtener_respuesta('buenos días', 'preguntando_tratamiento_abierto', {})['estado'] == 'inicial'
+    assert obtener_respuesta('buenos días', 'preguntando_tratamiento_abierto', {})['intencion'] == 'buenos días'
+
+    assert obtener_respuesta('Si, ya tengo', 'preguntando_tratamiento_abierto', {})['estado'] == 'inicial'
+    assert obtener_respuesta('no, es mi primera vez', 'preguntando_tratamiento_abierto', {})['estado'] == 'preguntando_tipo_cita'
+    resultado = obtener_respuesta('tengo dolores', 'preguntando_tipo_cita', None)
+    assert resultado['estado'] == 'solicitando_detalle_padecimiento'
+    assert resultado['datos_cita'] == {'tipo_cita': 'padecimiento'}
+    assert obtener_respuesta('no, mejor otro día', 'confirmando_cita', {})['datos_cita'] == {}
+    print("✅ Cada estado reconoce sus respuestas como palabras completas")
+
+def test_imagenes_locales():
+    """Las imágenes del catálogo se sirven desde la propia aplicación, con srcset si hay variantes"""
+    import app as aplicacion
+    cliente = app.test_client()
+    imagenes = cliente.post('/chat', json={'message': 'ortodoncia'}).get_json()['imagenes']
+    assert [imagen['alt'] for imagen in imagenes] == ['Antes de ortodoncia', 'Después de ortodoncia']
+    assert all(imagen['url'].startswith('/static/') for imagen in imagenes)
+    assert cliente.get(imagenes[0]['url']).status_code == 200
+
+    variantes = {
+        'ancho': 800, 'alto': 600,
+        'miniatura': {'ancho': 150, 'alto': 120, 'variantes': {
+            'jpg': [['img/x-150x120.h.jpg', 150], ['img/x-300x240.h.jpg', 300]],
+            'webp': [['img/x-150x120.h.webp', 150], ['img/x-300x240.h.webp', 300]]}},
+        'grande': {'jpg': [['img/x-640.h.jpg', 640]], 'webp': [['img/x-640.h.webp', 640]]}
+    }
+    aplicacion.IMAGENES['prueba-variantes'] = variantes
+    try:
+        imagen = aplicacion.resolver_imagen({'id': 'prueba-variantes', 'alt': 'Prueba'})
+    finally:
+        del aplicacion.IMAGENES['prueba-variantes']
+    assert imagen['url'] == '/static/dist/img/x-150x120.h.jpg'
+    assert imagen['srcset_webp'] == '/static/dist/img/x-150x120.h.webp 150w, /static/dist/img/x-300x240.h.webp 300w'
+    assert imagen['grande'] == '/static/dist/img/x-640.h.jpg'
+    assert aplicacion.resolver_imagen({'id': 'no-existe', 'alt': ''}) is None
+    print("✅ Las imágenes se sirven desde la aplicación con sus variantes")
+
+def test_conversacion_en_servidor():
+    """Con la conversación en el servidor solo viajan el identificador y los cambios"""
+    cliente = app.test_client()
+    datos = cliente.post('/chat', json={'message': 'quiero una cita', 'usar_conversacion': True}).get_json()
+    assert datos['estado'] == 'preguntando_tratamiento_abierto'
+    conversacion = {'conversacion_id': datos['conversacion_id'], 'version': datos['version']}
+
+    datos = cliente.post('/chat', json={'message': 'no', **conversacion}).get_json()
+    assert datos['estado'] == 'preguntando_tipo_cita'
+    conversacion['version'] = datos['version']
+
+    datos = cliente.post('/chat', json={'message': 'revisión general', **conversacion}).get_json()
+    assert datos['estado'] == 'solicitando_fecha'
+    assert datos['datos_cita'] == {'tipo_cita': 'revision'}
+
+    # Una versión antigua obliga al cliente a reenviar su estado completo
+    respuesta = cliente.post('/chat', json={'message': 'hola', **conversacion})
+    assert respuesta.status_code == 409
+    assert respuesta.get_json()['conversacion_desconocida']
+    print("✅ La conversación se guarda en el servidor y el cliente recibe solo los cambios")
+
+def test_conversacion_desconocida():
+    """Un worker que no conoce la conversación responde 409 y el cliente reenvía el estado completo"""
+    cliente = app.test_client()
+    datos = cliente.post('/chat', json={'message': 'quiero una cita', 'usar_conversacion': True}).get_json()
+    datos = cliente.post('/chat', json={'message': 'no', 'conversacion_id': datos['conversacion_id'],
+                                        'version': datos['version']}).get_json()
+    assert datos['estado'] == 'preguntando_tipo_cita'
+
+    # Conversación caducada o guardada solo en la memoria de otro worker
+    respuesta = cliente.post('/chat', json={'message': 'revisión general', 'conversacion_id': 'de-otro-worker',
+                                            'version': 3})
+    assert respuesta.status_code == 409
+
+    # Reenvío como hace index.js: estado y datos completos y una conversación nueva
+    datos = cliente.post('/chat', json={'message': 'revisión general', 'usar_conversacion': True,
+                                        'estado': datos['estado'], 'datos_cita': {}}).get_json()
+    assert datos['estado'] == 'solicitando_fecha'
+    assert datos['datos_cita'] == {'tipo_cita': 'revision'}
+    assert datos['conversacion_id'] != 'de-otro-worker'
+
+    # Con el archivo SQLite compartido, otro worker sí la encuentra
+    from conversaciones import AlmacenConversaciones
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'conversaciones.db')
+        worker_a = AlmacenConversaciones(ruta_sqlite=ruta)
+        worker_b = AlmacenConversaciones(ruta_sqlite=ruta)
+        version = worker_a.guardar('compartida', 0, 'solicitando_fecha', {'tipo_cita': 'revision'})
+        assert worker_b.obtener('compartida', version) == (version, 'solicitando_fecha', {'tipo_cita': 'revision'})
+
+        # Si los dos workers guardan a partir de la misma versión, el segundo pierde
+        assert worker_a.guardar('compartida', version, 'solicitando_hora', {'fecha': '01/01/2030'}) == version + 1
+        assert worker_b.guardar('compartida', version, 'inicial', {}) is None
+        assert worker_b.obtener('compartida', version + 1)[1] == 'solicitando_hora'
+        assert worker_b.guardar('nueva', 0, 'inicial', {}) == 1
+        assert worker_a.guardar('nueva', 0, 'inicial', {}) is None
+
+    # Un identificador que no es texto no llega a la tabla
+    respuesta = cliente.post('/chat', json={'message': 'hola', 'conversacion_id': ['x'], 'version': 1})
+    assert respuesta.status_code == 400
+    print("✅ Sin la conversación se pide el estado completo y con SQLite la comparten los workers")
+
+def test_recarga_catalogo():
+    """El catálogo se sustituye al cambiar el archivo y conserva la versión anterior si no es válido"""
+    with open(CATALOGO.ruta, encoding='utf-8') as f:
+        contenido = json.load(f)
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'catalogo.json')
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f, ensure_ascii=False)
+        recargable = CatalogoRecargable(ruta, directorio_cache=os.path.join(directorio, 'cache'), intervalo=0)
+        anterior = recargable.actual
+
+        contenido['respuestas']['horarios'] = 'Abrimos todos los días'
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f, ensure_ascii=False)
+        assert recargable.comprobar()
+        assert recargable.actual is not anterior
+        resultado = obtener_respuesta('horarios', 'inicial', {}, recargable.actual)
+        assert resultado['respuesta'] == 'Abrimos todos los días'
+        # La versión anterior no cambia para las peticiones que ya la estaban usando
+        assert anterior.respuestas['horarios'] != 'Abrimos todos los días'
+
+        nuevo = recargable.actual
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write('{"respuestas": ')
+        assert not recargable.comprobar()
+        assert recargable.actual is nuevo
+
+        # Estructura incorrecta que solo falla al construir los autómatas
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(dict(contenido, tratamientos_menu=5), f, ensure_ascii=False)
+        assert not recargable.comprobar()
+        assert recargable.actual is nuevo
+
+        # Un error en al_cambiar tampoco llega a la petición y se reintenta en la siguiente comprobación
+        fallos = [RuntimeError('precalentamiento fallido')]
+
+        def al_cambiar(catalogo):
+            if fallos:
+                raise fallos.pop()
+        recargable.al_cambiar = al_cambiar
+        contenido['respuestas']['horarios'] = 'Abrimos de lunes a sábado'
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f, ensure_ascii=False)
+        assert not recargable.comprobar()
+        assert recargable.actual is nuevo
+        assert recargable.comprobar()
+        assert recargable.actual.respuestas['horarios'] == 'Abrimos de lunes a sábado'
+
+        # Al consultarlo, la recarga se hace en otro hilo y la petición sigue con la versión anterior
+        anterior = recargable.actual
+        puede_terminar = threading.Event()
+        recargable.al_cambiar = lambda catalogo: puede_terminar.wait(5)
+        recargable.intervalo = 0.001
+        contenido['respuestas']['horarios'] = 'Abrimos de lunes a viernes'
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f, ensure_ascii=False)
+        time.sleep(0.01)
+        assert recargable.actual is anterior
+        assert recargable._hilo_recarga is not None
+        puede_terminar.set()
+        recargable._hilo_recarga.join(5)
+        assert recargable.actual.respuestas['horarios'] == 'Abrimos de lunes a viernes'
+    print("✅ El catálogo se recarga sin reiniciar y descarta las versiones no válidas")
+
+if __name__ == "__main__":
+    test_automata_prioridad()
+    test_claves_antes_que_palabras()
+    test_menu_tratamientos()
+    test_coincidencia_aproximada()
+    test_respuestas_por_estado()
+    test_imagenes_locales()
+    test_conversacion_en_servidor()
+    test_conversacion_desconocida()
+    test_recarga_catalogo()
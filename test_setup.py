@@ -3,6 +3,7 @@
 Script de prueba para verificar la configuración de la aplicación
 """
 
+import json
 import os
 import sys
 from datetime import datetime
@@ -57,6 +58,229 @@ def test_health_endpoint():
         print(f"❌ Error probando el endpoint /health: {e}")
         return False
 
+def test_estaticos():
+    """Prueba que las páginas usen los archivos estáticos con hash y se sirvan comprimidos"""
+    try:
+        import re
+        from app import app
+        with app.test_client() as client:
+            html = client.get('/').get_data(as_text=True)
+            rutas = re.findall(r'(?:href|src)="(/static/dist/[^"]+)"', html)
+            if len(rutas) != 2:
+                print(f"❌ La página principal no referencia los archivos con hash: {rutas}")
+                return False
+            response = client.get(rutas[1], headers={'Accept-Encoding': 'gzip'})
+            if response.status_code != 200 or response.headers.get('Content-Encoding') != 'gzip' \
+                    or 'immutable' not in response.headers.get('Cache-Control', ''):
+                print(f"❌ {rutas[1]} no se sirve comprimido con caché inmutable")
+                return False
+            print("✅ Los archivos estáticos se sirven con hash, comprimidos y con caché inmutable")
+            return True
+    except Exception as e:
+        print(f"❌ Error probando los archivos estáticos: {e}")
+        return False
+
+def test_paginas_cacheadas():
+    """Prueba que las páginas se revaliden con ETag y se regeneren al cambiar la configuración"""
+    try:
+        from app import app, CHATBOT_CONFIG
+        with app.test_client() as client:
+            etag = client.get('/panel').headers.get('ETag')
+            if client.get('/panel', headers={'If-None-Match': etag}).status_code != 304:
+                print("❌ /panel no responde 304 con el mismo ETag")
+                return False
+            etag = client.get('/').headers.get('ETag')
+            nombre = CHATBOT_CONFIG['clinic_name']
+            CHATBOT_CONFIG['clinic_name'] = 'Clínica de Prueba'
+            try:
+                response = client.get('/', headers={'If-None-Match': etag})
+            finally:
+                CHATBOT_CONFIG['clinic_name'] = nombre
+            if response.status_code != 200 or 'Clínica de Prueba' not in response.get_data(as_text=True):
+                print("❌ La página principal no se regenera al cambiar la configuración")
+                return False
+            
+            # Al reconstruir los estáticos la página enlaza las nuevas versiones
+            import app as aplicacion
+            ruta = aplicacion.RUTA_MANIFIESTO_ESTATICOS
+            with open(ruta, encoding='utf-8') as f:
+                original = f.read()
+            fecha = os.stat(ruta).st_mtime_ns
+            etag = client.get('/panel').headers.get('ETag')
+            try:
+                with open(ruta, 'w', encoding='utf-8') as f:
+                    json.dump(dict(json.loads(original), **{'js/panel.js': 'js/panel.0123456789.js'}), f)
+                os.utime(ruta, ns=(fecha + 10**9, fecha + 10**9))
+                response = client.get('/panel', headers={'If-None-Match': etag})
+            finally:
+                with open(ruta, 'w', encoding='utf-8') as f:
+                    f.write(original)
+                os.utime(ruta, ns=(fecha, fecha))
+            if response.status_code != 200 or 'panel.0123456789.js' not in response.get_data(as_text=True):
+                print("❌ La página no se regenera al reconstruir los estáticos")
+                return False
+            print("✅ Las páginas se cachean con ETag y se regeneran al cambiar la configuración")
+            return True
+    except Exception as e:
+        print(f"❌ Error probando la caché de páginas: {e}")
+        return False
+
+def test_compresion():
+    """Prueba que las respuestas grandes se compriman, también las que se envían por partes"""
+    try:
+        import gzip
+        from app import app
+        with app.test_client() as client:
+            response = client.post('/chat', json={'message': 'información sobre financiación'},
+                                   headers={'Accept-Encoding': 'gzip'})
+            if response.headers.get('Content-Encoding') != 'gzip' or b'financiaci' not in gzip.decompress(response.data):
+                print("❌ La respuesta del chat no se comprime")
+                return False
+            response = client.post('/chat', json={'message': 'hola'}, headers={'Accept-Encoding': 'gzip'})
+            if 'Content-Encoding' in response.headers:
+                print("❌ Se comprimen respuestas por debajo del mínimo")
+                return False
+            response = client.get('/export-csv', headers={'Accept-Encoding': 'gzip'})
+            if response.headers.get('Content-Encoding') != 'gzip' or not gzip.decompress(response.data).startswith(b'ID,'):
+                print("❌ La exportación CSV no se comprime por partes")
+                return False
+            print("✅ Las respuestas se comprimen según Accept-Encoding")
+            return True
+    except Exception as e:
+        print(f"❌ Error probando la compresión: {e}")
+        return False
+
+def test_limites():
+    """Prueba que un cliente que agota su ráfaga recibe 429 sin afectar a los demás"""
+    try:
+        from app import app, LIMITADORES, LIMITE_CONCURRENCIA
+        rafaga = int(LIMITADORES['reservas'].rafaga)
+        with app.test_client() as client:
+            # Peticiones incompletas: también cuentan para el límite
+            for _ in range(rafaga):
+                client.post('/api/guardar-cita', json={}, environ_base={'REMOTE_ADDR': '198.51.100.7'})
+            response = client.post('/api/guardar-cita', json={}, environ_base={'REMOTE_ADDR': '198.51.100.7'})
+            if response.status_code != 429 or int(response.headers.get('Retry-After', 0)) < 1:
+                print(f"❌ El cliente que agota el límite recibe {response.status_code}")
+                return False
+            response = client.post('/api/guardar-cita', json={}, environ_base={'REMOTE_ADDR': '198.51.100.8'})
+            if response.status_code == 429:
+                print("❌ El límite de un cliente afecta a otro")
+                return False
+            # Abrir conversaciones nuevas no multiplica el límite de la IP
+            ip = {'REMOTE_ADDR': '198.51.100.9'}
+            for _ in range(int(LIMITADORES['chat'].rafaga)):
+                client.post('/chat', json={'message': 'hola', 'usar_conversacion': True}, environ_base=ip)
+            response = client.post('/chat', json={'message': 'hola', 'usar_conversacion': True}, environ_base=ip)
+            if response.status_code != 429:
+                print("❌ Las conversaciones nuevas amplían el límite de la IP")
+                return False
+            # Y dentro de una conversación se aplica además su propio límite, más estricto
+            ip = {'REMOTE_ADDR': '198.51.100.10'}
+            datos = client.post('/chat', json={'message': 'hola', 'usar_conversacion': True}, environ_base=ip).get_json()
+            conversacion = {'conversacion_id': datos['conversacion_id'], 'version': datos['version']}
+            for _ in range(int(LIMITADORES['conversacion'].rafaga)):
+                response = client.post('/chat', json={'message': 'hola', **conversacion}, environ_base=ip)
+                conversacion['version'] = response.get_json().get('version', conversacion['version'])
+            response = client.post('/chat', json={'message': 'hola', **conversacion}, environ_base=ip)
+            if response.status_code != 429:
+                print("❌ La conversación no tiene límite propio")
+                return False
+        if LIMITE_CONCURRENCIA.en_curso != 0:
+            print("❌ Quedan huecos de concurrencia sin liberar")
+            return False
+        print("✅ Los límites por cliente funcionan correctamente")
+        return True
+    except Exception as e:
+        print(f"❌ Error probando los límites: {e}")
+        return False
+
+def test_maximo_eventos():
+    """Prueba que las conexiones de eventos simultáneas no superan el máximo aunque no hayan empezado"""
+    try:
+        import app as aplicacion
+        maximo_original = aplicacion.EVENTOS_MAX_SUSCRIPTORES
+        aplicacion.EVENTOS_MAX_SUSCRIPTORES = 1
+        try:
+            with aplicacion.app.test_client() as client:
+                primera = client.get('/api/eventos')
+                segunda = client.get('/api/eventos')
+                if primera.status_code != 200 or segunda.status_code != 503:
+                    print(f"❌ Dos conexiones con máximo 1: {primera.status_code} y {segunda.status_code}")
+                    return False
+                # Cerrada sin haber enviado nada, el hueco queda libre
+                primera.close()
+                if aplicacion.CANAL_EVENTOS.suscriptores != 0:
+                    print("❌ El hueco de la conexión cerrada no se libera")
+                    return False
+                tercera = client.get('/api/eventos')
+                tercera.close()
+                if tercera.status_code != 200:
+                    print("❌ No se puede volver a conectar tras cerrar")
+                    return False
+        finally:
+            aplicacion.EVENTOS_MAX_SUSCRIPTORES = maximo_original
+        print("✅ El máximo de conexiones de eventos se respeta")
+        return True
+    except Exception as e:
+        print(f"❌ Error probando el máximo de eventos: {e}")
+        return False
+
+def test_eventos_otro_worker():
+    """Prueba que un Last-Event-ID de otro worker creado a partir del mismo canal pide recargar"""
+    try:
+        from eventos import CanalEventos
+        canal = CanalEventos()
+        lectura, escritura = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Worker: hereda el canal del maestro (mismo instante de creación)
+            os.write(escritura, canal._arranque.encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        arranque_hijo = os.read(lectura, 100).decode()
+        os.close(lectura)
+        os.close(escritura)
+        
+        for numero in range(3):
+            canal.publicar('cita_creada', {'id': numero})
+        flujo = canal.escuchar(f'{arranque_hijo}-1', latido=0.01, duracion_maxima=0)
+        next(flujo)
+        if arranque_hijo == canal._arranque or 'event: recargar' not in next(flujo):
+            print("❌ Un identificador de otro worker se toma como propio")
+            return False
+        flujo.close()
+        print("✅ Los identificadores de eventos de otro worker piden recargar")
+        return True
+    except Exception as e:
+        print(f"❌ Error probando los eventos entre workers: {e}")
+        return False
+
+def test_registro_tras_fork():
+    """Prueba que cada worker escribe el registro con una cola propia, no con la heredada"""
+    try:
+        import registro
+        registro.configurar_registro()
+        cola_padre = registro._cola
+        lectura, escritura = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            propia = registro._cola is not cola_padre and registro._oyente._thread.is_alive()
+            os.write(escritura, b'1' if propia else b'0')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        propia = os.read(lectura, 1) == b'1'
+        os.close(lectura)
+        os.close(escritura)
+        if not propia:
+            print("❌ El worker usa la cola de registro del proceso padre")
+            return False
+        print("✅ Cada worker registra con su propia cola y su hilo de escritura")
+        return True
+    except Exception as e:
+        print(f"❌ Error probando el registro tras fork: {e}")
+        return False
+
 def main():
     """Ejecuta todas las pruebas"""
     print("🔍 Iniciando pruebas de configuración...")
@@ -68,7 +292,14 @@ def main():
         test_imports,
         test_app_creation,
         test_database,
-        test_health_endpoint
+        test_health_endpoint,
+        test_estaticos,
+        test_paginas_cacheadas,
+        test_compresion,
+        test_limites,
+        test_maximo_eventos,
+        test_eventos_otro_worker,
+        test_registro_tras_fork
     ]
     
     passed = 0